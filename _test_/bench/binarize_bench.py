@@ -0,0 +1,116 @@
+"""
+MarkseatReader._binarize_image の実行時間を計測するベンチマーク
+
+変更前 (セルごとにcv2.threshold, 結果をコピー)、
+現在 (セルのスライスを事前計算し, cv2.thresholdで出力に直接書き込む)、
+numpyで全セルのOtsuをまとめて計算する案 (batched) を比較する
+3つとも出力は同じ。1回あたりの時間は他の処理の影響でばらつくので、
+ROUNDS回の平均をREPEATS回測り、最も短いものを表示する
+
+実行: python -m _test_.bench.binarize_bench
+"""
+
+import time
+import cv2
+import numpy as np
+from mark_seat_reader import Margin, MarkseatReader
+from step.ssq_step import create_ssq_processor
+from step.mssq_step import create_mssq_processor
+
+ROUNDS = 200
+REPEATS = 7
+
+
+def binarize_legacy(reader: MarkseatReader, src: np.ndarray) -> np.ndarray:
+    """
+    変更前の_binarize_image
+    """
+    output = np.zeros_like(src)
+    for row_index in range(reader.row):
+        for col_index in range(reader.col):
+            x, y, _, _ = reader.layout.cell_rects[row_index, col_index].tolist()
+            cell = src[y : y + reader.cell_height, x : x + reader.cell_width]
+            _, cell_bin = cv2.threshold(
+                cell, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU
+            )
+            output[y : y + reader.cell_height, x : x + reader.cell_width] = cell_bin
+    return output
+
+
+def binarize_batched(reader: MarkseatReader, src: np.ndarray) -> np.ndarray:
+    """
+    (行, 列, 高さ, 幅) のビューから全セルのヒストグラムをbincountで作り、
+    Otsuのしきい値をnumpyでまとめて計算する案
+    (セルの間隔がそろっている倍率1.0の配置でのみ使える)
+    """
+    cell_width, cell_height = (int(pitch) for pitch in reader.layout.pitch)
+    top = reader.cell_margin.margin_top
+    left = reader.cell_margin.margin_left
+
+    def cell_view(image: np.ndarray) -> np.ndarray:
+        grid = image.reshape(reader.row, cell_height, reader.col, cell_width)
+        cells = grid[:, top : top + reader.cell_height, :, left : left + reader.cell_width]
+        return cells.transpose(0, 2, 1, 3)
+
+    cells = cell_view(src)
+    count = reader.row * reader.col
+    pixels = reader.cell_width * reader.cell_height
+    flat = cells.reshape(count, pixels)
+    offsets = np.arange(count, dtype=np.intp)[:, None] * 256
+    hist = np.bincount((flat + offsets).ravel(), minlength=count * 256)
+    hist = hist.reshape(count, 256)
+    # クラス間分散 ∝ (M*c1 - N*s1)^2 / (c1*(N-c1))
+    c1 = np.cumsum(hist, axis=1)
+    s1 = np.cumsum(hist * np.arange(256), axis=1)
+    c2 = pixels - c1
+    denominator = np.where((c1 > 0) & (c2 > 0), c1 * c2, 0).astype(np.float64)
+    numerator = (s1[:, -1:] * c1 - pixels * s1).astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma = np.where(denominator > 0, numerator * numerator / denominator, 0.0)
+    thresholds = sigma.argmax(axis=1).reshape(reader.row, reader.col)
+
+    output = np.zeros_like(src)
+    np.multiply(
+        cells <= thresholds[:, :, None, None],
+        255,
+        out=cell_view(output),
+        casting="unsafe",
+    )
+    return output
+
+
+def measure(func, *args) -> float:
+    func(*args)
+    best = float("inf")
+    for _ in range(REPEATS):
+        begin = time.perf_counter()
+        for _ in range(ROUNDS):
+            func(*args)
+        best = min(best, (time.perf_counter() - begin) / ROUNDS * 1000)
+    return best
+
+
+def main():
+    rng = np.random.default_rng(0)
+    ssq = create_ssq_processor(working_scale=1.0).markseat_reader
+    mssq = create_mssq_processor(working_scale=1.0).reader1
+    large = MarkseatReader(Margin(0, 0, 0, 0), 200, 10, 20, 10, Margin(2, 3, 3, 2))
+    for label, reader in [("SSQ 16x4", ssq), ("MSSQ 8x5", mssq), ("200x10", large)]:
+        region_width, region_height = reader.layout.region_size
+        shape = (region_height, region_width)
+        src = np.clip(rng.normal(200, 20, shape), 0, 255).astype(np.uint8)
+        expected = binarize_legacy(reader, src)
+        assert np.array_equal(reader._binarize_image(src), expected)
+        assert np.array_equal(binarize_batched(reader, src), expected)
+        legacy = measure(binarize_legacy, reader, src)
+        current = measure(reader._binarize_image, src)
+        batched = measure(binarize_batched, reader, src)
+        print(
+            f"{label:10s} legacy {legacy:7.3f} ms  current {current:7.3f} ms"
+            f" ({legacy / current:4.2f}x)  batched {batched:7.3f} ms"
+            f" ({legacy / batched:4.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+ループバックでコマンド("start"などのStringData)の往復時間を計測するベンチマーク
+
+旧DataSender (4回のsendall, Nagle有効) と
+現DataSender (キャッシュしたヘッダ + sendmsg 1回, TCP_NODELAY) を比較する
+
+実行: python -m _test_.bench.sender_latency_bench
+"""
+
+import socket
+import statistics
+import threading
+import time
+from network.data.frame_reader import FrameReader
+from network.data.multi_type_data_decoder import MultiTypeDataDecoder
+from network.data.serializable_data import SerializableData
+from network.data.string_data import StringData, StringDataDecoder, STRING_DATA_TYPE
+from network.tcp_common import DataSender, set_no_delay
+
+ROUNDS = 200
+
+
+class LegacyDataSender:
+    """
+    変更前のDataSender
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+
+    def send(self, data: SerializableData):
+        encoded = data.name().encode()
+        self.sock.sendall(len(encoded).to_bytes(4, byteorder="little"))
+        self.sock.sendall(encoded)
+        bytes_data = data.to_bytes()
+        self.sock.sendall(len(bytes_data).to_bytes(4, byteorder="little"))
+        self.sock.sendall(bytes_data)
+
+
+def _echo_server(server_sock: socket.socket, no_delay: bool):
+    client_sock, _ = server_sock.accept()
+    set_no_delay(client_sock, no_delay)
+    decoder = MultiTypeDataDecoder({STRING_DATA_TYPE: StringDataDecoder()})
+    reader = FrameReader(client_sock)
+    sender = DataSender(client_sock)
+    try:
+        while True:
+            decoder.accept(reader)
+            sender.send(StringData("ack"))
+    except ConnectionError:
+        pass
+    finally:
+        client_sock.close()
+
+
+def measure(sender_class, no_delay: bool) -> list[float]:
+    server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_sock.bind(("127.0.0.1", 0))
+    server_sock.listen()
+    thread = threading.Thread(
+        target=_echo_server, args=(server_sock, no_delay), daemon=True
+    )
+    thread.start()
+
+    sock = socket.create_connection(server_sock.getsockname())
+    set_no_delay(sock, no_delay)
+    decoder = MultiTypeDataDecoder({STRING_DATA_TYPE: StringDataDecoder()})
+    reader = FrameReader(sock)
+    sender = sender_class(sock)
+    commands = ["start", "reset", "sound", "stop"]
+    latencies = []
+    for i in range(ROUNDS):
+        begin = time.perf_counter()
+        sender.send(StringData(commands[i % len(commands)]))
+        decoder.accept(reader)
+        latencies.append((time.perf_counter() - begin) * 1000)
+    sock.close()
+    thread.join()
+    server_sock.close()
+    return latencies
+
+
+def main():
+    for label, sender_class, no_delay in [
+        ("legacy 4x sendall, Nagle", LegacyDataSender, False),
+        ("legacy 4x sendall, TCP_NODELAY", LegacyDataSender, True),
+        ("sendmsg, Nagle", DataSender, False),
+        ("sendmsg, TCP_NODELAY", DataSender, True),
+    ]:
+        latencies = measure(sender_class, no_delay)
+        print(
+            f"{label:32s} median {statistics.median(latencies):7.3f} ms"
+            f"  p99 {sorted(latencies)[int(len(latencies) * 0.99) - 1]:7.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import cv2
+from cv2 import aruco
+import numpy as np
+from mark_seat_reader import CorrectionProcessor, MarkseatReader
+
+MARKER_SIZE = 150
+
+
+def _draw_marks(
+    rect: np.ndarray, reader: MarkseatReader, answers: list[int], value: int
+):
+    """
+    readerの座標系でマークしたセルを、補正後の長方形画像に描く
+    """
+    layout_width, layout_height = reader.layout.scaled_size
+    sx = rect.shape[1] / layout_width
+    sy = rect.shape[0] / layout_height
+    for row, col in enumerate(answers):
+        for c in range(reader.col):
+            x, y, _, _ = reader.layout.cell_rects[row, c].tolist()
+            x += reader.offset_left
+            y += reader.offset_top
+            top_left = (int(x * sx), int(y * sy))
+            bottom_right = (
+                int((x + reader.cell_width) * sx),
+                int((y + reader.cell_height) * sy),
+            )
+            # 枠線と、マークしたセルの塗りつぶし
+            cv2.rectangle(rect, top_left, bottom_right, 150, 1)
+            if c == col:
+                cv2.rectangle(rect, top_left, bottom_right, value, -1)
+
+
+def make_sheet(
+    correction: CorrectionProcessor,
+    readers: list[MarkseatReader],
+    answers: list[list[int]],
+    photo_size: tuple[int, int] = (3024, 4032),
+    tilt: float = 0.05,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    マーカーの内側の頂点で囲まれた長方形にマークシートを描き、
+    少し傾けて撮影したようなRGB画像を返す
+
+    :param answers: readerごとの、各行でマークする列 (-1ならマークしない)
+    :param photo_size: 出力画像の (幅, 高さ)
+    """
+    rng = np.random.default_rng(seed)
+    rect = np.full((correction.rectH, correction.rectW), 235, dtype=np.uint8)
+    for reader, reader_answers in zip(readers, answers):
+        _draw_marks(rect, reader, reader_answers, 40)
+
+    # マーカーを長方形の外側に置いた用紙全体の画像
+    pad = MARKER_SIZE + 60
+    sheet = np.full(
+        (correction.rectH + pad * 2, correction.rectW + pad * 2), 245, dtype=np.uint8
+    )
+    sheet[pad : pad + correction.rectH, pad : pad + correction.rectW] = rect
+    dictionary = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
+    inner = [
+        (pad, pad),
+        (pad + correction.rectW, pad),
+        (pad + correction.rectW, pad + correction.rectH),
+        (pad, pad + correction.rectH),
+    ]
+    # 各マーカーのpreset_corner_idsの頂点が長方形の角に来るように置く
+    offsets = {0: (0, 0), 1: (-1, 0), 2: (-1, -1), 3: (0, -1)}
+    for marker_id, corner_id, (x, y) in zip(
+        correction.preset_ids, correction.preset_corner_ids, inner
+    ):
+        marker = aruco.generateImageMarker(dictionary, marker_id, MARKER_SIZE)
+        dx, dy = offsets[corner_id]
+        mx = x + dx * MARKER_SIZE if dx else x
+        my = y + dy * MARKER_SIZE if dy else y
+        sheet[my : my + MARKER_SIZE, mx : mx + MARKER_SIZE] = marker
+
+    # 用紙を画面の中央付近に、少し台形にして配置する
+    width, height = photo_size
+    h, w = sheet.shape
+    scale = min(width / w, height / h) * 0.85
+    cx, cy = width / 2, height / 2
+    src = np.float32([(0, 0), (w, 0), (w, h), (0, h)])
+    dst = []
+    for px, py in src:
+        jitter = rng.uniform(-tilt, tilt, 2) * (w * scale, h * scale)
+        dst.append(
+            (cx + (px - w / 2) * scale + jitter[0], cy + (py - h / 2) * scale + jitter[1])
+        )
+    M = cv2.getPerspectiveTransform(src, np.float32(dst))
+    photo = cv2.warpPerspective(
+        sheet, M, (width, height), flags=cv2.INTER_LINEAR, borderValue=90
+    )
+    noise = rng.normal(0, 3, photo.shape)
+    photo = np.clip(photo + noise, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(photo, cv2.COLOR_GRAY2RGB)
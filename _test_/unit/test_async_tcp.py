@@ -0,0 +1,139 @@
+import queue
+import socket
+import threading
+import time
+import pytest
+from network.async_tcp_client import AsyncTCPClient
+from network.async_tcp_common import EventLoopThread
+from network.async_tcp_server import AsyncTCPServer
+from network.data.envelope import ENVELOPE_VERSION, EnvelopeDataDecoder
+from network.data.multi_type_data_decoder import MultiTypeDataDecoder
+from network.data.string_data import (
+    STRING_DATA_TYPE,
+    STRING_DATA_TYPE_ID,
+    StringData,
+    StringDataDecoder,
+)
+from network.tcp_common import encode_data
+
+
+def _envelope_decoder() -> EnvelopeDataDecoder:
+    return EnvelopeDataDecoder(
+        {STRING_DATA_TYPE_ID: StringDataDecoder()},
+        legacy_decoder=MultiTypeDataDecoder({STRING_DATA_TYPE: StringDataDecoder()}),
+    )
+
+
+def _wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def loop_thread():
+    loop_thread = EventLoopThread()
+    loop_thread.start()
+    yield loop_thread
+    loop_thread.stop()
+
+
+@pytest.fixture
+def server(loop_thread):
+    received: queue.Queue = queue.Queue()
+    server = AsyncTCPServer(
+        _envelope_decoder(),
+        lambda data: received.put(data.get_data()),
+        loop_thread,
+        host="127.0.0.1",
+        port=0,
+        protocol_version=ENVELOPE_VERSION,
+    )
+    server.received = received
+    server.start_server()
+    yield server
+    server.stop_server()
+
+
+def _address(server: AsyncTCPServer) -> tuple:
+    return server._server.sockets[0].getsockname()
+
+
+def _client_count(server: AsyncTCPServer, loop_thread: EventLoopThread) -> int:
+    async def count():
+        return len(server._clients)
+
+    return loop_thread.run_sync(count())
+
+
+def test_frames_split_across_reads(server):
+    with socket.create_connection(_address(server), timeout=5) as sock:
+        first = encode_data(StringData("first"))
+        second = encode_data(StringData("second"), ENVELOPE_VERSION)
+        for i in range(len(first)):
+            sock.sendall(first[i : i + 1])
+            time.sleep(0.001)
+        sock.sendall(second + first)
+        assert [server.received.get(timeout=5) for _ in range(3)] == [
+            "first",
+            "second",
+            "first",
+        ]
+
+
+def test_client_disconnect_removes_connection(server, loop_thread):
+    client = AsyncTCPClient(_envelope_decoder(), loop_thread)
+    assert client.connect(*_address(server))
+    assert _wait_until(lambda: _client_count(server, loop_thread) == 1)
+    client.disconnect()
+    assert not client.connected
+    assert _wait_until(lambda: _client_count(server, loop_thread) == 0)
+
+
+def test_stop_while_receive_is_blocked(server, loop_thread):
+    disconnected = threading.Event()
+    client = AsyncTCPClient(_envelope_decoder(), loop_thread)
+    client.on_receive = lambda data: None
+    client.on_disconnected = disconnected.set
+    assert client.connect(*_address(server))
+    with socket.create_connection(_address(server), timeout=5) as sock:
+        # サーバは続きを待ち、クライアントはサーバからの受信を待っている
+        sock.sendall(encode_data(StringData("partial"))[:6])
+        assert _wait_until(lambda: _client_count(server, loop_thread) == 2)
+        start = time.monotonic()
+        server.stop_server()
+        assert time.monotonic() - start < 1
+        assert not server.running
+        assert sock.recv(1) == b""
+    # サーバが閉じた接続は、クライアントの受信タスクが切断として扱う
+    assert disconnected.wait(5)
+    assert not client.connected
+
+
+def test_hello_negotiation(server, loop_thread):
+    received: queue.Queue = queue.Queue()
+    client = AsyncTCPClient(
+        _envelope_decoder(), loop_thread, protocol_version=ENVELOPE_VERSION
+    )
+    client.on_receive = lambda data: received.put(data.get_data())
+    try:
+        assert client.connect(*_address(server))
+        assert _wait_until(
+            lambda: client._send_queue.protocol_version == ENVELOPE_VERSION
+            and all(
+                send_queue.protocol_version == ENVELOPE_VERSION
+                for send_queue in list(server._clients.values())
+            )
+            and _client_count(server, loop_thread) == 1
+        )
+        client.send_data(StringData("to server"))
+        server.send_all(StringData("to client"))
+        # Helloはon_receiveに渡さない
+        assert server.received.get(timeout=5) == "to server"
+        assert received.get(timeout=5) == "to client"
+        assert server.received.empty() and received.empty()
+    finally:
+        client.disconnect()
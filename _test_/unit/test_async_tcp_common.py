@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from network.async_tcp_common import AsyncSendQueue
+
+
+class _BrokenWriter:
+    """
+    書き込みが失敗するStreamWriterの代わり
+    """
+
+    def writelines(self, buffers):
+        pass
+
+    async def drain(self):
+        raise ConnectionResetError("peer closed")
+
+
+def test_put_fails_after_write_error():
+    async def run():
+        send_queue = AsyncSendQueue(_BrokenWriter(), max_messages=1)
+        await send_queue.put([b"1"])
+        # 書き込みタスクが失敗して閉じるまでに、一杯のキューで待っているput
+        waiting = asyncio.ensure_future(send_queue.put([b"2"]))
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(waiting, 1)
+        assert send_queue.closed
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(send_queue.put([b"3"]), 1)
+
+    asyncio.run(run())
+
+
+class _StalledWriter:
+    """
+    書き込みが終わらないStreamWriterの代わり
+    """
+
+    def writelines(self, buffers):
+        pass
+
+    async def drain(self):
+        await asyncio.Event().wait()
+
+
+def test_control_messages_are_not_dropped():
+    async def run():
+        send_queue = AsyncSendQueue(
+            _StalledWriter(), max_messages=2, drop_oldest=True
+        )
+        await send_queue.put([b"sending"])
+        await asyncio.sleep(0)
+        await send_queue.put([b"control1"], droppable=False)
+        await send_queue.put([b"bulk1"])
+        await send_queue.put([b"bulk2"])
+        # 一杯でも、破棄してよくないメッセージは待たずに追加する
+        await asyncio.wait_for(send_queue.put([b"control2"], droppable=False), 1)
+        assert [buffers for buffers, _ in send_queue._messages] == [
+            [b"control1"],
+            [b"bulk2"],
+            [b"control2"],
+        ]
+        assert send_queue.stats.dropped == 1
+        send_queue.close()
+
+    asyncio.run(run())
@@ -0,0 +1,135 @@
+import PIL.ImageTk
+import pytest
+from PIL import Image
+from step.base_survey_step import BaseSurveyUI
+
+
+class _FakeCanvas:
+    """
+    Tkなしで動くように、BaseSurveyUIが使うCanvasのメソッドだけを持つ
+    after()は登録するだけで、run_pending()で登録順に実行する
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.pending: dict[int, tuple] = {}
+        self.cancelled: list[int] = []
+        self.images: list = []
+        self._next_id = 0
+
+    def after(self, ms, callback, *args):
+        self._next_id += 1
+        self.pending[self._next_id] = (ms, callback, args)
+        return self._next_id
+
+    def after_cancel(self, after_id):
+        self.cancelled.append(after_id)
+        self.pending.pop(after_id, None)
+
+    def run_pending(self):
+        pending, self.pending = self.pending, {}
+        for _, callback, args in pending.values():
+            callback(*args)
+
+    def winfo_exists(self):
+        return True
+
+    def winfo_width(self):
+        return self.width
+
+    def winfo_height(self):
+        return self.height
+
+    def winfo_screenwidth(self):
+        return 1920
+
+    def winfo_screenheight(self):
+        return 1080
+
+    def delete(self, tag):
+        pass
+
+    def create_image(self, x, y, anchor, image):
+        self.images.append(image)
+        return len(self.images)
+
+    def coords(self, item, x, y):
+        pass
+
+    def itemconfigure(self, item, image):
+        self.images.append(image)
+
+
+class _FakePhotoImage:
+    def __init__(self, image: Image.Image):
+        self.size = image.size
+        self.pasted = 0
+
+    def width(self):
+        return self.size[0]
+
+    def height(self):
+        return self.size[1]
+
+    def paste(self, image: Image.Image):
+        assert image.size == self.size
+        self.pasted += 1
+
+
+@pytest.fixture
+def photo_images(monkeypatch):
+    created: list[_FakePhotoImage] = []
+
+    def create(image):
+        photo = _FakePhotoImage(image)
+        created.append(photo)
+        return photo
+
+    monkeypatch.setattr(PIL.ImageTk, "PhotoImage", create)
+    return created
+
+
+def _make_ui(width: int = 400, height: int = 300) -> BaseSurveyUI:
+    ui = BaseSurveyUI(None, [], "")
+    ui.canvas = _FakeCanvas(width, height)
+    return ui
+
+
+def test_configure_burst_redraws_once():
+    ui = _make_ui()
+    events = []
+    ui._on_resize = events.append
+    # ウィンドウの端をドラッグしている間に続けて届く
+    for i in range(5):
+        ui._on_configure(i)
+    assert len(ui.canvas.pending) == 1
+    assert len(ui.canvas.cancelled) == 4
+    assert next(iter(ui.canvas.pending.values()))[0] == ui.RESIZE_DEBOUNCE_MS
+    ui.canvas.run_pending()
+    # 最後のイベントで1回だけ再描画する
+    assert events == [4]
+    assert ui._resize_after_id is None
+
+
+def test_same_size_redraw_reuses_photo_image(photo_images):
+    ui = _make_ui()
+    image = Image.new("RGB", (800, 600))
+    ui.update_canvas(image)
+    ui.update_canvas(image)
+    assert len(photo_images) == 1
+    assert photo_images[0].pasted == 1
+    # 大きさが変わったら作り直す
+    ui.canvas.width, ui.canvas.height = 200, 150
+    ui.update_canvas(image)
+    assert len(photo_images) == 2
+    assert ui.canvas.images[-1] is photo_images[1]
+
+
+def test_make_base_reduces_to_screen_size_and_orients():
+    ui = _make_ui()
+    # Orientation=6 は90度回転して表示する
+    base = ui._make_base(Image.new("RGB", (4032, 3024)), 6)
+    assert base.size == (1008, 1344)
+    # 画面より小さい画像は縮小しない
+    assert ui._make_base(Image.new("RGB", (640, 480)), 1).size == (640, 480)
@@ -0,0 +1,142 @@
+import queue
+import socket
+import threading
+import time
+from network.data.envelope import ENVELOPE_VERSION, EnvelopeDataDecoder
+from network.data.multi_type_data_decoder import MultiTypeDataDecoder
+from network.data.string_data import (
+    STRING_DATA_TYPE,
+    STRING_DATA_TYPE_ID,
+    StringData,
+    StringDataDecoder,
+)
+from network.tcp_client import TCPClient
+from network.tcp_common import DataReceiver, encode_data
+from network.tcp_server import TCPServer
+
+
+def _start_receiver(sock: socket.socket):
+    received: queue.Queue = queue.Queue()
+    failed = threading.Event()
+    receiver = DataReceiver(
+        sock,
+        MultiTypeDataDecoder({STRING_DATA_TYPE: StringDataDecoder()}),
+        lambda data: received.put(data.get_data()),
+        failed.set,
+    )
+    receiver.start()
+    return receiver, received, failed
+
+
+def test_frames_split_across_reads():
+    a, b = socket.socketpair()
+    receiver, received, failed = _start_receiver(a)
+    try:
+        first = encode_data(StringData("first"))
+        second = encode_data(StringData("second"))
+        # 1バイトずつ届いても、2つのメッセージが1回で届いても同じように読める
+        for i in range(len(first)):
+            b.sendall(first[i : i + 1])
+            time.sleep(0.001)
+        b.sendall(second + first)
+        assert [received.get(timeout=5) for _ in range(3)] == [
+            "first",
+            "second",
+            "first",
+        ]
+        assert not failed.is_set()
+    finally:
+        receiver.stop()
+        receiver.join(1)
+        a.close()
+        b.close()
+
+
+def test_peer_disconnect_calls_on_failed():
+    a, b = socket.socketpair()
+    receiver, received, failed = _start_receiver(a)
+    try:
+        b.sendall(encode_data(StringData("last"))[:6])
+        b.close()
+        assert failed.wait(5)
+        receiver.join(1)
+        assert not receiver.is_alive()
+        assert received.empty()
+    finally:
+        a.close()
+
+
+def test_stop_while_waiting_for_data():
+    a, b = socket.socketpair()
+    receiver, _, failed = _start_receiver(a)
+    try:
+        time.sleep(0.1)
+        start = time.monotonic()
+        receiver.stop()
+        receiver.join(1)
+        assert not receiver.is_alive()
+        assert time.monotonic() - start < 1
+        assert not failed.is_set()
+    finally:
+        a.close()
+        b.close()
+
+
+def test_stop_while_waiting_for_rest_of_frame():
+    a, b = socket.socketpair()
+    receiver, received, failed = _start_receiver(a)
+    try:
+        # メッセージの途中で受信を待っている
+        b.sendall(encode_data(StringData("partial"))[:6])
+        time.sleep(0.1)
+        receiver.stop()
+        receiver.join(1)
+        assert not receiver.is_alive()
+        assert received.empty()
+        assert not failed.is_set()
+    finally:
+        a.close()
+        b.close()
+
+
+def _envelope_decoder() -> EnvelopeDataDecoder:
+    return EnvelopeDataDecoder(
+        {STRING_DATA_TYPE_ID: StringDataDecoder()},
+        legacy_decoder=MultiTypeDataDecoder({STRING_DATA_TYPE: StringDataDecoder()}),
+    )
+
+
+def _wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_hello_negotiation_over_loopback():
+    received: queue.Queue = queue.Queue()
+    server = TCPServer(
+        _envelope_decoder(),
+        lambda data: received.put(data.get_data()),
+        host="127.0.0.1",
+        port=0,
+        protocol_version=ENVELOPE_VERSION,
+    )
+    server.start_server()
+    client = TCPClient(_envelope_decoder(), protocol_version=ENVELOPE_VERSION)
+    try:
+        assert client.connect(port=server.server_sock.getsockname()[1])
+        assert _wait_until(
+            lambda: client._sender.protocol_version == ENVELOPE_VERSION
+            and len(server.client_threads) == 1
+            and server.client_threads[0][1].protocol_version == ENVELOPE_VERSION
+        )
+        client.send_data(StringData("v2"))
+        # Helloはon_receiveに渡さない
+        assert received.get(timeout=5) == "v2"
+        assert received.empty()
+    finally:
+        client.disconnect()
+        server.stop_server()
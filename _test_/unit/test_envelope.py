@@ -0,0 +1,134 @@
+import asyncio
+import socket
+import pytest
+from network.data.envelope import (
+    ENVELOPE_HEADER,
+    ENVELOPE_MAGIC,
+    ENVELOPE_VERSION,
+    EnvelopeDataDecoder,
+)
+from network.data.frame_reader import FrameReader, IncompleteFrame
+from network.data.multi_type_data_decoder import MultiTypeDataDecoder
+from network.data.string_data import (
+    STRING_DATA_TYPE,
+    STRING_DATA_TYPE_ID,
+    StringData,
+    StringDataDecoder,
+)
+from network.data.serializable_data import SerializableData, get_type_id
+from network.tcp_common import encode_data
+
+
+def _envelope(
+    type_id: int, payload: bytes, version: int = ENVELOPE_VERSION
+) -> bytes:
+    return (
+        ENVELOPE_HEADER.pack(ENVELOPE_MAGIC, version, 0, type_id, len(payload))
+        + payload
+    )
+
+
+def _decoder(max_payload_size: int = 1024) -> EnvelopeDataDecoder:
+    return EnvelopeDataDecoder(
+        {STRING_DATA_TYPE_ID: StringDataDecoder()},
+        legacy_decoder=MultiTypeDataDecoder({STRING_DATA_TYPE: StringDataDecoder()}),
+        max_payload_size=max_payload_size,
+    )
+
+
+def test_encode_v2():
+    assert encode_data(StringData("start"), ENVELOPE_VERSION) == _envelope(
+        STRING_DATA_TYPE_ID, b"start"
+    )
+
+
+def test_type_id_registry():
+    class Unregistered(SerializableData):
+        def to_bytes(self) -> bytes:
+            return b""
+
+        def name(self) -> str:
+            return "Unregistered"
+
+    assert get_type_id(StringData("start")) == STRING_DATA_TYPE_ID
+    with pytest.raises(KeyError):
+        get_type_id(Unregistered())
+    with pytest.raises(ValueError):
+
+        class Duplicated(Unregistered, type_id=STRING_DATA_TYPE_ID):
+            pass
+
+
+def test_decode_v2_and_legacy_on_same_connection():
+    a, b = socket.socketpair()
+    try:
+        a.sendall(
+            encode_data(StringData("v2"), ENVELOPE_VERSION)
+            + encode_data(StringData("legacy"))
+        )
+        decoder = _decoder()
+        reader = FrameReader(b)
+        assert decoder.accept(reader).get_data() == "v2"
+        assert decoder.accept(reader).get_data() == "legacy"
+    finally:
+        a.close()
+        b.close()
+
+
+def test_skip_unknown_and_oversized():
+    a, b = socket.socketpair()
+    try:
+        a.sendall(
+            _envelope(99, b"x" * 10)
+            + _envelope(STRING_DATA_TYPE_ID, b"y" * 2048)
+            + _envelope(STRING_DATA_TYPE_ID, b"v3", version=ENVELOPE_VERSION + 1)
+            + encode_data(StringData("next"), ENVELOPE_VERSION)
+        )
+        decoder = _decoder()
+        # バッファより大きいメッセージも、バッファを拡張せずに読み飛ばす
+        assert decoder.accept(FrameReader(b, buffer_size=64)).get_data() == "next"
+        assert decoder.skipped == 3
+    finally:
+        a.close()
+        b.close()
+
+
+def test_skip_oversized_non_blocking():
+    a, b = socket.socketpair()
+    b.setblocking(False)
+    try:
+        decoder = _decoder(max_payload_size=50)
+        reader = FrameReader(b, buffer_size=64, blocking=False)
+        # 後半が未着のまま読み飛ばしを始める
+        a.sendall(_envelope(STRING_DATA_TYPE_ID, b"y" * 100)[:-80])
+        reader.receive()
+        reader.begin()
+        with pytest.raises(IncompleteFrame):
+            decoder.accept(reader)
+        reader.rollback()
+        a.sendall(b"y" * 80 + encode_data(StringData("next"), ENVELOPE_VERSION))
+        while not reader.ready:
+            reader.receive()
+        reader.begin()
+        assert decoder.accept(reader).get_data() == "next"
+        assert decoder.skipped == 1
+    finally:
+        a.close()
+        b.close()
+
+
+def test_accept_async():
+    async def run():
+        stream = asyncio.StreamReader()
+        stream.feed_data(
+            _envelope(99, b"x" * 10)
+            + _envelope(STRING_DATA_TYPE_ID, b"v3", version=ENVELOPE_VERSION + 1)
+            + encode_data(StringData("v2"), ENVELOPE_VERSION)
+            + encode_data(StringData("legacy"))
+        )
+        decoder = _decoder()
+        first = await decoder.accept_async(stream)
+        second = await decoder.accept_async(stream)
+        return first.get_data(), second.get_data(), decoder.skipped
+
+    assert asyncio.run(run()) == ("v2", "legacy", 2)
@@ -0,0 +1,53 @@
+from file_transfer import PART_SUFFIX, FileTransfer
+
+
+def _write(path, size, seed):
+    data = bytes((i * seed) % 251 for i in range(size))
+    path.write_bytes(data)
+    return data
+
+
+def test_transfer_all_copies_verifies_and_removes_sources(tmp_path):
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    expected = {
+        f"board{i}.csv": _write(src_dir / f"board{i}.csv", 100_000 + i, i + 1)
+        for i in range(5)
+    }
+    dst_dir = tmp_path / "dst"
+    transfer = FileTransfer(workers=3, buffer_size=4096, allow_rename=False)
+    results = transfer.transfer_all(sorted(src_dir.iterdir()), dst_dir)
+    assert all(result.ok for result in results)
+    assert not list(src_dir.iterdir())
+    assert {path.name: path.read_bytes() for path in dst_dir.iterdir()} == expected
+
+
+def test_transfer_resumes_part_file_and_restarts_when_corrupt(tmp_path):
+    dst_dir = tmp_path / "dst"
+    dst_dir.mkdir()
+    src = tmp_path / "board.csv"
+    part = dst_dir / ("board.csv" + PART_SUFFIX)
+    transfer = FileTransfer(buffer_size=4096, allow_rename=False)
+
+    data = _write(src, 50_000, 7)
+    part.write_bytes(data[:20_000])
+    result = transfer.transfer(src, dst_dir)
+    assert result.ok and result.resumed == 20_000 and result.copied == 30_000
+    assert (dst_dir / "board.csv").read_bytes() == data
+    assert not src.exists() and not part.exists()
+
+    data = _write(src, 50_000, 3)
+    part.write_bytes(b"x" * 20_000)
+    result = transfer.transfer(src, dst_dir)
+    assert result.ok and result.copied == 80_000
+    assert (dst_dir / "board.csv").read_bytes() == data
+
+
+def test_transfer_reports_error_and_keeps_source(tmp_path):
+    src = tmp_path / "board.csv"
+    src.write_bytes(b"0,1,2\n")
+    blocker = tmp_path / "dst"
+    blocker.write_bytes(b"")  # ディレクトリを作れない
+    result = FileTransfer(allow_rename=False).transfer(src, blocker)
+    assert not result.ok and result.error
+    assert src.exists()
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+import pytest
+import file_watcher
+from file_watcher import FileWatcher
+
+
+def _watch_and_write(tmp_path, monkeypatch, use_inotify: bool):
+    if not use_inotify:
+        monkeypatch.setattr(file_watcher, "_create_inotify", lambda directory: None)
+    ready = []
+    done = threading.Event()
+
+    def on_ready(paths):
+        ready.extend((path.name, path.stat().st_size) for path in paths)
+        done.set()
+        return [True] * len(paths)
+
+    (tmp_path / "ignored.txt").write_text("x")
+    watcher = FileWatcher(
+        tmp_path, "*.csv", on_ready, settle_time=0.3, poll_interval=0.05
+    )
+    watcher.start()
+    try:
+        # 書き込み途中のファイルは渡されない
+        with open(tmp_path / "board.csv", "w") as f:
+            for _ in range(5):
+                f.write("0,1,2\n" * 100)
+                f.flush()
+                time.sleep(0.1)
+            assert not done.is_set()
+        assert done.wait(5)
+        assert ready == [("board.csv", 3000)]
+        progress = watcher.progress
+        assert progress.moved == ["board.csv"] and not progress.writing
+        assert progress.inotify == use_inotify
+    finally:
+        watcher.stop()
+        watcher.join(1)
+    assert not watcher.is_alive()
+
+
+def test_inotify_waits_until_size_is_stable(tmp_path, monkeypatch):
+    inotify = file_watcher._create_inotify(tmp_path)
+    if inotify is None:
+        pytest.skip("inotify is not available")
+    inotify.close()
+    _watch_and_write(tmp_path, monkeypatch, use_inotify=True)
+
+
+def test_polling_fallback(tmp_path, monkeypatch):
+    _watch_and_write(tmp_path, monkeypatch, use_inotify=False)
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_failed_file_is_retried(tmp_path, monkeypatch, use_inotify):
+    if use_inotify:
+        inotify = file_watcher._create_inotify(tmp_path)
+        if inotify is None:
+            pytest.skip("inotify is not available")
+        inotify.close()
+    else:
+        monkeypatch.setattr(file_watcher, "_create_inotify", lambda directory: None)
+    calls = []
+    done = threading.Event()
+
+    def on_ready(paths):
+        calls.append([path.name for path in paths])
+        if len(calls) < 3:
+            return [False] * len(paths)
+        done.set()
+        return [True] * len(paths)
+
+    watcher = FileWatcher(
+        tmp_path,
+        "*.csv",
+        on_ready,
+        settle_time=0.1,
+        poll_interval=0.05,
+        retry_interval=0.2,
+    )
+    (tmp_path / "board.csv").write_text("0,1,2\n")
+    watcher.start()
+    try:
+        # 書き換えられなくても、間隔を空けて渡し直す
+        assert done.wait(5)
+        assert calls == [["board.csv"]] * 3
+        progress = watcher.progress
+        assert progress.moved == ["board.csv"] and not progress.failed
+    finally:
+        watcher.stop()
+        watcher.join(1)
+
+
+class _OverflowingInotify:
+    """
+    2回目以降の読み出しでイベントが溢れたことだけを伝えるinotify
+    """
+
+    def __init__(self):
+        self.fd, self._write = os.pipe()
+        self.read = threading.Event()
+        self.reads = 0
+
+    def notify(self):
+        os.write(self._write, b"\0")
+
+    def read_names(self):
+        os.read(self.fd, 64)
+        self.reads += 1
+        self.read.set()
+        return set(), self.reads > 1
+
+    def close(self):
+        os.close(self.fd)
+        os.close(self._write)
+
+
+def test_inotify_overflow_rescans_directory(tmp_path, monkeypatch):
+    inotify = _OverflowingInotify()
+    monkeypatch.setattr(file_watcher, "_create_inotify", lambda directory: inotify)
+    done = threading.Event()
+    ready = []
+
+    def on_ready(paths):
+        ready.extend(path.name for path in paths)
+        done.set()
+        return [True] * len(paths)
+
+    watcher = FileWatcher(tmp_path, "*.csv", on_ready, settle_time=0.1)
+    watcher.start()
+    try:
+        # 最初のイベントを読んだら、監視を始める前のファイルは調べ終わっている
+        inotify.notify()
+        assert inotify.read.wait(5)
+        # このファイルのイベントは溢れて届かない
+        (tmp_path / "board.csv").write_text("0,1,2\n")
+        time.sleep(0.3)
+        assert not done.is_set()
+        inotify.notify()
+        assert done.wait(5)
+        assert ready == ["board.csv"]
+    finally:
+        watcher.stop()
+        watcher.join(1)
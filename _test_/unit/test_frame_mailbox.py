@@ -0,0 +1,40 @@
+import threading
+from frame_mailbox import FrameMailbox
+
+
+def test_take_latest_drops_older_frames():
+    mailbox = FrameMailbox(capacity=3)
+    for i in range(5):
+        mailbox.put(i)
+    frame = mailbox.take_latest()
+    assert (frame.seq, frame.image) == (5, 4)
+    assert mailbox.take_latest() is None
+    stats = mailbox.stats
+    # 溢れた2枚と、読み飛ばした2枚
+    assert (stats.received, stats.taken, stats.dropped) == (5, 1, 4)
+
+
+def test_drain():
+    mailbox = FrameMailbox()
+    mailbox.put("old")
+    assert mailbox.drain() == 1
+    assert len(mailbox) == 0
+    mailbox.put("new")
+    assert mailbox.take_latest().image == "new"
+    assert mailbox.last_seq == 2
+
+
+def test_bounded_under_concurrent_puts():
+    mailbox = FrameMailbox(capacity=2)
+    threads = [
+        threading.Thread(target=lambda: [mailbox.put(i) for i in range(1000)])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(mailbox) == 2
+    assert mailbox.take_latest().seq == 4000
+    stats = mailbox.stats
+    assert stats.received == stats.taken + stats.dropped == 4000
@@ -0,0 +1,73 @@
+import time
+import cv2
+import numpy as np
+from PIL import Image
+from frame_mailbox import FrameMailbox
+from frame_quality import FrameQualityGate
+from recognition_worker import RecognitionWorker
+from step.ssq_step import SSQ_MARKER_IDS, create_ssq_processor
+from step.mssq_step import MSSQ_MARKER_IDS, create_mssq_processor
+from _test_.sheet_image import make_sheet
+
+
+def test_gate_accepts_sheet_and_rejects_blank_or_blurred():
+    processor = create_ssq_processor()
+    image = make_sheet(
+        processor.correction_processor,
+        [processor.markseat_reader],
+        [[0] * 16],
+        photo_size=(1512, 2016),
+    )
+    gate = FrameQualityGate(SSQ_MARKER_IDS)
+    sharp = gate.assess(Image.fromarray(image))
+    assert sharp.markers == 4 and gate.accepts(sharp)
+    blurred = gate.assess(cv2.GaussianBlur(image, (0, 0), 4))
+    assert blurred.sharpness < sharp.sharpness
+    assert not gate.accepts(gate.assess(np.full_like(image, 200)))
+
+
+def test_gate_counts_only_preset_marker_ids():
+    processor = create_mssq_processor()
+    image = make_sheet(
+        processor.correction_processor,
+        [processor.reader1, processor.reader2],
+        [[0] * 8, [0] * 8],
+        photo_size=(1512, 2016),
+    )
+    assert FrameQualityGate(MSSQ_MARKER_IDS).assess(image).markers == 4
+    # 別の用紙のマーカーが4つ写っていても通さない
+    ssq_gate = FrameQualityGate(SSQ_MARKER_IDS)
+    quality = ssq_gate.assess(image)
+    assert quality.markers == 0 and not ssq_gate.accepts(quality)
+
+
+def test_small_markers_are_below_gate_but_readable():
+    processor = create_ssq_processor()
+    answers = [i % 4 for i in range(16)]
+    small = make_sheet(
+        processor.correction_processor,
+        [processor.markseat_reader],
+        [answers],
+        photo_size=(600, 800),
+    )
+    # 12MPの写真の隅に小さく写った用紙
+    image = np.full((4032, 3024, 3), 90, np.uint8)
+    image[:800, :600] = small
+    mailbox = FrameMailbox(capacity=4)
+    gate = FrameQualityGate(SSQ_MARKER_IDS)
+    assert not gate.accepts(gate.assess(image))
+    worker = RecognitionWorker(mailbox, processor, gate, burst_window=0.2)
+    mailbox.put(image)
+    mailbox.put(np.full_like(image, 200))
+    worker.start()
+    try:
+        deadline = time.monotonic() + 30
+        result = worker.poll()
+        while result is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+            result = worker.poll()
+        assert result is not None and result.seq == 1
+        assert result.answers == answers
+    finally:
+        worker.stop()
+        worker.join(5)
@@ -0,0 +1,65 @@
+import socket
+import threading
+import pytest
+from network.data.frame_reader import FrameReader
+from network.data.multi_type_data_decoder import MultiTypeDataDecoder
+from network.data.string_data import StringDataDecoder, STRING_DATA_TYPE
+
+
+def _frame(payload: bytes) -> bytes:
+    return len(payload).to_bytes(4, byteorder="little") + payload
+
+
+def test_read_headers_and_payloads_from_buffer():
+    a, b = socket.socketpair()
+    try:
+        a.sendall(_frame(b"hello") + _frame(b"world"))
+        reader = FrameReader(b, buffer_size=64)
+        assert reader.read_uint32() == 5
+        assert bytes(reader.read_exact(5)) == b"hello"
+        # 2つ目のメッセージは1回目のrecv_intoで受信済み
+        assert reader.buffered == 9
+        assert reader.read_uint32() == 5
+        assert reader.read_bytes(5) == b"world"
+    finally:
+        a.close()
+        b.close()
+
+
+def test_payload_larger_than_buffer():
+    a, b = socket.socketpair()
+    payload = bytes(range(256)) * 4096  # 1MiB
+    sender = threading.Thread(target=a.sendall, args=(_frame(payload) * 2,))
+    sender.start()
+    try:
+        reader = FrameReader(b, buffer_size=16)
+        for _ in range(2):
+            size = reader.read_uint32()
+            assert bytes(reader.read_exact(size)) == payload
+    finally:
+        sender.join()
+        a.close()
+        b.close()
+
+
+def test_multi_type_decoder():
+    a, b = socket.socketpair()
+    try:
+        # DataSender.send(StringData("start")) と同じバイト列
+        a.sendall(_frame(STRING_DATA_TYPE.encode()) + _frame(b"start"))
+        decoder = MultiTypeDataDecoder({STRING_DATA_TYPE: StringDataDecoder()})
+        decoded = decoder.accept(FrameReader(b))
+        assert decoded.get_name() == STRING_DATA_TYPE
+        assert decoded.get_data() == "start"
+    finally:
+        a.close()
+        b.close()
+
+
+def test_connection_closed():
+    a, b = socket.socketpair()
+    a.sendall(b"\x10\x00")
+    a.close()
+    with pytest.raises(ConnectionError):
+        FrameReader(b).read_uint32()
+    b.close()
@@ -0,0 +1,20 @@
+import io
+import numpy as np
+from PIL import Image
+from network.data.image_data import IMAGE_DATA_TYPE, ImageDataDecoder
+
+
+def _jpeg(width: int, height: int) -> memoryview:
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((height, width, 3), 128, dtype=np.uint8)).save(
+        buffer, "JPEG"
+    )
+    return memoryview(buffer.getvalue())
+
+
+def test_decode_size_reduces_jpeg_by_long_side():
+    decoded = ImageDataDecoder(150).decode(_jpeg(400, 640))
+    assert decoded.get_name() == IMAGE_DATA_TYPE
+    # 長辺が150以上になる最小の縮小率は1/4
+    assert decoded.get_data().size == (100, 160)
+    assert ImageDataDecoder().decode(_jpeg(400, 640)).get_data().size == (400, 640)
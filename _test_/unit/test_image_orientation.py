@@ -0,0 +1,23 @@
+import io
+import numpy as np
+from PIL import Image, ImageOps
+from image_orientation import (
+    apply_orientation,
+    orientation_exif,
+    oriented_size,
+    read_orientation,
+)
+
+
+def test_orientation_round_trip_matches_exif_transpose():
+    pixels = np.arange(2 * 3 * 3, dtype=np.uint8).reshape(2, 3, 3)
+    image = Image.fromarray(pixels)
+    for orientation in range(1, 9):
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG", exif=orientation_exif(orientation))
+        loaded = Image.open(buffer)
+        assert read_orientation(loaded) == orientation
+        expected = ImageOps.exif_transpose(loaded)
+        oriented = apply_orientation(image, orientation)
+        assert oriented.size == oriented_size(image.size, orientation)
+        assert np.array_equal(np.asarray(oriented), np.asarray(expected))
@@ -0,0 +1,228 @@
+import cv2
+import numpy as np
+from step.ssq_step import create_ssq_processor
+from step.mssq_step import create_mssq_processor
+from _test_.sheet_image import make_sheet
+
+
+def _binarize_per_cell(reader, src: np.ndarray) -> np.ndarray:
+    output = np.zeros_like(src)
+    for row_index in range(reader.row):
+        for col_index in range(reader.col):
+            x, y, _, _ = reader.layout.cell_rects[row_index, col_index].tolist()
+            cell = src[y : y + reader.cell_height, x : x + reader.cell_width]
+            _, cell_bin = cv2.threshold(
+                cell, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU
+            )
+            output[y : y + reader.cell_height, x : x + reader.cell_width] = cell_bin
+    return output
+
+
+def test_binarize_matches_per_cell_threshold():
+    reader = create_ssq_processor().markseat_reader
+    region_width, region_height = reader.layout.region_size
+    rng = np.random.default_rng(0)
+    src = rng.integers(0, 256, (region_height, region_width), dtype=np.uint8)
+    assert np.array_equal(reader._binarize_image(src), _binarize_per_cell(reader, src))
+
+
+def test_read_ssq_sheet():
+    processor = create_ssq_processor()
+    answers = [i % 4 for i in range(16)]
+    image = make_sheet(
+        processor.correction_processor, [processor.markseat_reader], [answers]
+    )
+    assert processor.read_answers_array(image)[0] == answers
+
+
+def test_read_mssq_sheet():
+    processor = create_mssq_processor()
+    upper = [i % 5 for i in range(8)]
+    lower = [(i * 2) % 5 for i in range(8)]
+    image = make_sheet(
+        processor.correction_processor,
+        [processor.reader1, processor.reader2],
+        [upper, lower],
+    )
+    assert processor.read_answers_array(image)[0] == upper + lower
+
+
+def test_score_and_row_confidence():
+    processor = create_ssq_processor()
+    reader = processor.markseat_reader
+    answers = [i % 4 for i in range(15)] + [-1]
+    image = make_sheet(processor.correction_processor, [reader], [answers])
+    corrected, _ = processor.correction_processor.correct(
+        cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    )
+    scores = reader.score(cv2.cvtColor(corrected, cv2.COLOR_BGR2GRAY))
+    assert scores.shape == (16, 4)
+    assert scores[:15].argmax(axis=1).tolist() == answers[:15]
+    confidence = reader.row_confidence(scores)
+    # マークした行ははっきりしていて、無回答の行は確信度が低い
+    assert confidence[:15].min() > 0.5
+    assert confidence[15] < 0.5
+
+
+def test_read_warped_matches_corrected_image_path():
+    processor = create_ssq_processor(working_scale=1.0)
+    reader = processor.markseat_reader
+    answers = [(i * 3) % 4 for i in range(16)]
+    image = make_sheet(processor.correction_processor, [reader], [answers], seed=3)
+    corrected, rect = processor.correction_processor.correct(
+        cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    )
+    expected = reader.read(cv2.cvtColor(corrected, cv2.COLOR_BGR2GRAY))
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    homography = processor.correction_processor.get_homography(rect)
+    rect_size = processor.correction_processor.rect_size
+    assert reader.read_warped(gray, homography, rect_size) == expected
+    half = create_ssq_processor(working_scale=0.5).markseat_reader
+    assert half.read_warped(gray, homography, rect_size) == expected
+
+
+def _cell_corners(reader) -> np.ndarray:
+    """
+    各セルの (x0, y0, x1, y1) を、レイアウト全体の座標で返す
+    """
+    layout = reader.layout
+    top_left = layout.cell_rects[..., :2] + (reader.offset_left, reader.offset_top)
+    bottom_right = top_left + (layout.cell_width, layout.cell_height)
+    return np.concatenate([top_left, bottom_right], axis=-1)
+
+
+def test_scaled_layout_keeps_cell_positions():
+    from mark_seat_reader import MarkseatReader
+
+    ssq = create_ssq_processor(working_scale=1.0)
+    mssq = create_mssq_processor(working_scale=1.0)
+    for design in [ssq.markseat_reader, mssq.reader1, mssq.reader2]:
+        for scale in [0.5, 0.3]:
+            scaled = MarkseatReader(
+                design.layout.rect_margin,
+                design.row,
+                design.col,
+                design.cell_width,
+                design.cell_height,
+                design.cell_margin,
+                scale,
+            )
+            # 行・列が進んでも丸めの誤差が積み重ならない
+            error = _cell_corners(scaled) - _cell_corners(design) * scale
+            assert np.abs(error).max() <= 1.0
+
+
+def test_read_design_scale_sheet_at_working_scale():
+    design = create_ssq_processor(working_scale=1.0)
+    answers = [(i * 3) % 4 for i in range(16)]
+    # 指定した寸法 (倍率1.0) の配置で描いた用紙を、倍率0.5で読む
+    image = make_sheet(design.correction_processor, [design.markseat_reader], [answers])
+    half = create_ssq_processor(working_scale=0.5)
+    assert half.read_answers_array(image)[0] == answers
+
+    design = create_mssq_processor(working_scale=1.0)
+    upper = [i % 5 for i in range(8)]
+    lower = [(i * 2 + 1) % 5 for i in range(8)]
+    image = make_sheet(
+        design.correction_processor,
+        [design.reader1, design.reader2],
+        [upper, lower],
+    )
+    half = create_mssq_processor(working_scale=0.5)
+    assert half.read_answers_array(image)[0] == upper + lower
+
+
+def test_sheet_layout_is_shared():
+    from mark_seat_reader import Margin, MarkseatReader
+
+    args = (Margin(10, 20, 10, 20), 8, 5, 30, 20, Margin(2, 3, 2, 3))
+    first = MarkseatReader(*args, scale=0.5)
+    second = MarkseatReader(*args, scale=0.5)
+    assert first.layout is second.layout
+    assert MarkseatReader(*args).layout is not first.layout
+    assert not first.layout.cell_rects.flags.writeable
+    for row in range(first.row):
+        for col in range(first.col):
+            x, y, _, _ = first.layout.cell_rects[row, col].tolist()
+            assert first.layout.cell_slices[row][col] == (
+                slice(y, y + first.cell_height),
+                slice(x, x + first.cell_width),
+            )
+
+
+def test_overlay_polygons_blends_only_marked_cells():
+    processor = create_ssq_processor()
+    correction = processor.correction_processor
+    reader = processor.markseat_reader
+    image = np.full((900, 1200, 3), 200, dtype=np.uint8)
+    rect = np.float32([(100, 50), (1100, 80), (1080, 850), (120, 820)])
+    polygons = reader.cell_polygons([[1]] + [[]] * 15, correction.rect_size)
+    result = correction.overlay_polygons(image.copy(), polygons, rect, alpha=0.5)
+
+    M = cv2.getPerspectiveTransform(correction.pts2, rect)
+    corners = cv2.perspectiveTransform(polygons.reshape(-1, 1, 2), M).reshape(-1, 2)
+    center = corners.mean(axis=0).astype(int)
+    assert (result[center[1], center[0]] == 100).all()
+    changed = np.argwhere((result != image).any(axis=2))
+    assert len(changed) > 0
+    assert (changed[:, ::-1] >= np.floor(corners.min(axis=0))).all()
+    assert (changed[:, ::-1] <= np.ceil(corners.max(axis=0))).all()
+
+
+def test_coarse_detection_matches_full_resolution():
+    from mark_seat_reader import CorrectionProcessor
+
+    processor = create_ssq_processor()
+    answers = [i % 4 for i in range(16)]
+    image = make_sheet(
+        processor.correction_processor, [processor.markseat_reader], [answers]
+    )
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    full = CorrectionProcessor(1000, 900, detection_size=max(gray.shape))
+    coarse = CorrectionProcessor(1000, 900, detection_size=1024)
+    # 小さすぎて縮小画像では見つからない場合は元の解像度で探し直す
+    fallback = CorrectionProcessor(1000, 900, detection_size=64)
+    expected = full.get_rectangle_gray(gray)
+    assert np.abs(coarse.get_rectangle_gray(gray) - expected).max() < 0.25
+    assert np.abs(fallback.get_rectangle_gray(gray) - expected).max() < 0.25
+
+
+def test_tracking_reuses_previous_markers():
+    from mark_seat_reader import CorrectionProcessor
+
+    processor = create_ssq_processor()
+    answers = [i % 4 for i in range(16)]
+    image = make_sheet(
+        processor.correction_processor, [processor.markseat_reader], [answers]
+    )
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    moved = np.roll(gray, (300, -200), axis=(0, 1))
+    reference = CorrectionProcessor(1000, 900)
+    tracker = CorrectionProcessor(1000, 900, tracking=True)
+
+    first = tracker.get_rectangle_gray(gray)
+    homography = tracker.get_homography(first)
+    second = tracker.get_rectangle_gray(gray)
+    assert np.abs(second - first).max() < 0.25
+    assert tracker.get_homography(second) is homography
+    # 大きく動いたら画像全体を探し直す
+    third = tracker.get_rectangle_gray(moved)
+    assert np.abs(third - reference.get_rectangle_gray(moved)).max() < 0.25
+    assert tracker.get_homography(third) is not homography
+    stats = tracker.tracking_stats
+    assert (stats.hits, stats.misses, stats.reused) == (1, 1, 1)
+
+
+def test_reset_tracking_detects_whole_image_again():
+    processor = create_ssq_processor()
+    answers = [i % 4 for i in range(16)]
+    image = make_sheet(
+        processor.correction_processor, [processor.markseat_reader], [answers]
+    )
+    assert processor.read_answers_array(image)[0] == answers
+    processor.reset_tracking()
+    assert processor.read_answers_array(image)[0] == answers
+    stats = processor.correction_processor.tracking_stats
+    assert (stats.hits, stats.misses) == (0, 0)
+    assert processor.read_answers_array(image)[0] == answers
+    assert stats.hits == 1
@@ -0,0 +1,33 @@
+import os
+import step.util as sutil
+from participant_index import ParticipantIndex
+
+
+def test_scan_add_and_prefix_lookup(tmp_path):
+    never = sutil.calc_condition(sutil.MODE_NEVER, sutil.POSITION_NONE)
+    always = sutil.calc_condition(2, 1)
+    for condition, name, mtime in [
+        (never, "tanaka", 100),
+        (always, "tanaka", 300),
+        (always, "takahashi", 200),
+    ]:
+        save_dir = sutil.get_save_dir(tmp_path, condition, name)
+        save_dir.mkdir(parents=True)
+        os.utime(save_dir, (mtime, mtime))
+    (tmp_path / "MSSQ").mkdir()  # 条件のディレクトリではない
+
+    index = ParticipantIndex(tmp_path)
+    index.scan()
+    assert index.get_completed_conditions("tanaka") == [never, always]
+    assert index.get_last_modified_time("tanaka") == 300
+    assert index.get_completed_conditions(" ") == []
+    assert index.get_last_modified_time("suzuki") == -1
+    assert index.find_names("ta") == ["takahashi", "tanaka"]
+    assert index.find_names("tan") == ["tanaka"]
+    assert index.find_names("ta", limit=1) == ["takahashi"]
+
+    index.add_dir(sutil.get_save_dir(tmp_path, never, "takeda"), 400)
+    index.add_dir(tmp_path / "MSSQ")
+    assert index.find_names("tak") == ["takahashi", "takeda"]
+    assert index.get_completed_conditions("takeda") == [never]
+    assert index.get_last_modified_time("takeda") == 400
@@ -0,0 +1,40 @@
+import numpy as np
+from PIL import Image
+from recognition_cache import CachedFrame, RecognitionCache
+from step.base_survey_step import BaseDataSaver
+
+
+def _frame(value: int, answers=None) -> CachedFrame:
+    image = Image.new("RGB", (100, 100), (value, value, value))
+    return CachedFrame(image, image, 6, answers, np.float32([[1, 2]] * 4))
+
+
+def test_lru_eviction_and_disk_tier(tmp_path):
+    # 1枚30000バイトなので2枚まで
+    cache = RecognitionCache(max_bytes=70000, disk_dir=tmp_path)
+    for key in ("a", "b", "c"):
+        cache.put("SSQ", key, _frame(10, [1, 2]))
+        if key == "b":
+            assert cache.get("SSQ", "a") is not None
+    assert len(cache) == 2 and cache.nbytes == 60000
+    assert cache.get("SSQ", "c") is not None and cache.get("MSSQ", "c") is None
+    # メモリから捨てた"b"はディスクから読み直す
+    restored = cache.get("SSQ", "b")
+    assert (restored.answers, restored.orientation) == ([1, 2], 6)
+    assert np.array_equal(restored.rect, np.float32([[1, 2]] * 4))
+    assert (cache.hits, cache.disk_hits, cache.misses) == (2, 1, 1)
+
+
+def test_saved_image_is_loaded_from_cache(tmp_path):
+    cache = RecognitionCache()
+    saver = BaseDataSaver(tmp_path, "SSQ", cache)
+    image = Image.new("RGB", (2000, 1000), (200, 100, 50))
+    saver.save_image(image, 8)
+    saver.save_csv([0, 1])
+    loaded, answers = saver.load()
+    assert loaded.image is image and loaded.orientation == 8
+    assert loaded.preview.size == (1280, 640)
+    assert answers == ["0", "1"]
+    # キャッシュがなければファイルからデコードする
+    uncached, _ = BaseDataSaver(tmp_path, "SSQ").load()
+    assert uncached.image.size == (2000, 1000) and uncached.orientation == 8
@@ -0,0 +1,82 @@
+import os
+import time
+import numpy as np
+import pytest
+from recognition_pool import RecognitionPool
+from step.base_survey_step import BaseImageProcessor
+from step.ssq_step import SSQ_PROCESSOR, create_ssq_processor
+from _test_.sheet_image import make_sheet
+
+
+def test_recognize_in_worker_processes():
+    processor = create_ssq_processor()
+    answers = [i % 4 for i in range(16)]
+    images = [
+        make_sheet(
+            processor.correction_processor,
+            [processor.markseat_reader],
+            [answers],
+            photo_size=(1512, 2016),
+            seed=seed,
+        )
+        for seed in range(3)
+    ]
+    pool = RecognitionPool({SSQ_PROCESSOR: create_ssq_processor}, workers=2)
+    try:
+        futures = [pool.submit(SSQ_PROCESSOR, image) for image in images]
+        futures.append(pool.submit(SSQ_PROCESSOR, np.zeros((100, 100, 3), np.uint8)))
+        results = [future.result(60) for future in futures]
+    finally:
+        pool.close()
+    for image, (result_answers, rect, overlay) in zip(images, results):
+        assert result_answers == answers
+        assert rect.shape == (4, 2)
+        # 同じ処理をこのプロセスで行った結果と一致する
+        expected = processor.overlay_array(image, rect, answers)
+        assert np.array_equal(overlay, expected)
+    assert results[-1] == (None, None, None)
+
+
+class _ExitProcessor(BaseImageProcessor):
+    def read_answers_array(self, rgb):
+        os._exit(1)
+
+
+class _BlockingProcessor(BaseImageProcessor):
+    def read_answers_array(self, rgb):
+        time.sleep(60)
+
+
+# ワーカープロセスから読み込むため、モジュールレベルの関数にする
+def _create_exit_processor():
+    return _ExitProcessor()
+
+
+def _create_blocking_processor():
+    return _BlockingProcessor()
+
+
+def test_worker_exit_fails_pending_futures():
+    pool = RecognitionPool({"exit": _create_exit_processor}, workers=1, slot_bytes=1024)
+    image = np.zeros((8, 8, 3), np.uint8)
+    try:
+        future = pool.submit("exit", image)
+        with pytest.raises(RuntimeError):
+            future.result(30)
+        with pytest.raises(RuntimeError):
+            pool.submit("exit", image)
+    finally:
+        pool.close()
+
+
+def test_close_fails_pending_futures():
+    pool = RecognitionPool(
+        {"block": _create_blocking_processor}, workers=1, slot_bytes=1024
+    )
+    image = np.zeros((8, 8, 3), np.uint8)
+    futures = [pool.submit("block", image) for _ in range(2)]
+    pool.close()
+    for future in futures:
+        assert isinstance(future.exception(0), RuntimeError)
+    with pytest.raises(RuntimeError):
+        pool.submit("block", image)
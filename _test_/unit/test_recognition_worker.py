@@ -0,0 +1,263 @@
+import threading
+import time
+from concurrent.futures import Future
+from frame_mailbox import FrameMailbox
+from frame_quality import FrameQuality, FrameQualityGate
+from PIL import Image
+from recognition_cache import RecognitionCache
+from recognition_worker import RecognitionWorker
+
+
+class _SlowProcessor:
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.read = []
+
+    def read_answers(self, image):
+        self.read.append(image)
+        if image == "old":
+            self.started.set()
+            self.release.wait()
+        return [0, 1], None
+
+    def overlay_image(self, image, rect, answers):
+        return f"overlay:{image}"
+
+
+def _wait_result(worker: RecognitionWorker):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        result = worker.poll()
+        if result is not None:
+            return result
+        time.sleep(0.01)
+    raise TimeoutError
+
+
+def test_stale_frame_is_cancelled():
+    mailbox = FrameMailbox()
+    processor = _SlowProcessor()
+    worker = RecognitionWorker(mailbox, processor)
+    worker.start()
+    try:
+        mailbox.put("old")
+        processor.started.wait(5)
+        # 認識中に新しい画像が届く
+        mailbox.put("new")
+        processor.release.set()
+        result = _wait_result(worker)
+        assert result.seq == 2
+        assert result.overlay == "overlay:new"
+        assert result.answers == [0, 1]
+        assert set(result.timings) >= {"wait", "read_answers", "overlay", "total"}
+        stats = worker.stats
+        assert (stats.completed, stats.cancelled) == (1, 1)
+    finally:
+        worker.stop()
+        worker.join(5)
+    assert not worker.is_alive()
+
+
+class _FakeGate(FrameQualityGate):
+    QUALITIES = {
+        "blurry": FrameQuality(5.0, 4),
+        "sharp": FrameQuality(300.0, 4),
+        "sharper_no_markers": FrameQuality(500.0, 2),
+        "blank": FrameQuality(0.0, 0),
+    }
+
+    def assess(self, image):
+        return self.QUALITIES[image]
+
+
+class _RecordingProcessor:
+    def __init__(self):
+        self.read = []
+
+    def read_answers(self, image):
+        self.read.append(image)
+        return [0], None
+
+    def overlay_image(self, image, rect, answers):
+        return f"overlay:{image}"
+
+
+def test_burst_picks_best_frame_and_still_recognizes_below_gate():
+    mailbox = FrameMailbox(capacity=4)
+    processor = _RecordingProcessor()
+    worker = RecognitionWorker(mailbox, processor, _FakeGate([0, 1, 2, 3]), burst_window=0.2)
+    for image in ("blurry", "sharp", "sharper_no_markers"):
+        mailbox.put(image)
+    worker.start()
+    try:
+        result = _wait_result(worker)
+        assert result.overlay == "overlay:sharp"
+        assert result.quality == _FakeGate.QUALITIES["sharp"]
+        assert "quality" in result.timings
+        # 質を満たす画像がなくても、マーカーが多く見つかった画像を認識する
+        mailbox.put("blank")
+        mailbox.put("blurry")
+        result = _wait_result(worker)
+        assert result.overlay == "overlay:blurry"
+        # 1枚だけなら質は調べない
+        mailbox.put("blank")
+        result = _wait_result(worker)
+        assert (result.overlay, result.quality) == ("overlay:blank", None)
+        assert processor.read == ["sharp", "blurry", "blank"]
+        stats = worker.stats
+        assert (stats.completed, stats.rejected, stats.skipped) == (3, 1, 3)
+    finally:
+        worker.stop()
+        worker.join(5)
+
+
+class _ImageProcessor(_RecordingProcessor):
+    def overlay_image(self, image, rect, answers):
+        return image.copy()
+
+
+def test_duplicate_frame_uses_cache():
+    mailbox = FrameMailbox()
+    processor = _ImageProcessor()
+    cache = RecognitionCache()
+    worker = RecognitionWorker(mailbox, processor, cache=cache, cache_namespace="SSQ")
+    worker.start()
+    image = Image.new("RGB", (64, 48))
+    try:
+        mailbox.put(image, key="same")
+        first = _wait_result(worker)
+        mailbox.put(image, key="same")
+        second = _wait_result(worker)
+        assert processor.read == [image]
+        assert (second.answers, second.overlay) == (first.answers, first.overlay)
+        assert second.preview is first.preview
+        assert worker.stats.cached == 1
+    finally:
+        worker.stop()
+        worker.join(5)
+
+
+class _AsyncProcessor:
+    max_in_flight = 2
+
+    def __init__(self):
+        self.futures: dict[str, Future] = {}
+        self.submitted = threading.Semaphore(0)
+
+    def submit(self, image):
+        future = Future()
+        self.futures[image] = future
+        self.submitted.release()
+        return future
+
+
+def test_async_processor_keeps_frames_in_flight():
+    mailbox = FrameMailbox()
+    processor = _AsyncProcessor()
+    worker = RecognitionWorker(mailbox, processor)
+    worker.start()
+    try:
+        mailbox.put("old")
+        assert processor.submitted.acquire(timeout=5)
+        # 前の画像の結果を待たずに次の画像を依頼する
+        mailbox.put("new")
+        assert processor.submitted.acquire(timeout=5)
+        processor.futures["new"].set_result(([1], None, "overlay:new"))
+        result = _wait_result(worker)
+        assert (result.seq, result.overlay) == (2, "overlay:new")
+        assert "recognize" in result.timings
+        # 新しい画像の結果を返した後に終わった古い画像の結果は捨てる
+        processor.futures["old"].set_result(([0], None, "overlay:old"))
+        mailbox.put("none")
+        assert processor.submitted.acquire(timeout=5)
+        processor.futures["none"].set_result((None, None, None))
+        result = _wait_result(worker)
+        assert (result.seq, result.answers, result.overlay) == (3, None, "none")
+        stats = worker.stats
+        assert (stats.completed, stats.cancelled) == (2, 1)
+    finally:
+        worker.stop()
+        worker.join(5)
+    assert not worker.is_alive()
+
+
+class _CountingGate(_FakeGate):
+    def __init__(self, marker_ids):
+        super().__init__(marker_ids)
+        self.assessed = 0
+
+    def assess(self, image):
+        self.assessed += 1
+        return super().assess(image)
+
+
+def test_burst_is_capped_while_frames_keep_arriving():
+    mailbox = FrameMailbox(capacity=4)
+    processor = _RecordingProcessor()
+    gate = _CountingGate([0, 1, 2, 3])
+    worker = RecognitionWorker(
+        mailbox,
+        processor,
+        gate,
+        burst_window=0.15,
+        max_burst_frames=3,
+        max_burst_time=0.3,
+    )
+    stop = threading.Event()
+
+    def stream():
+        # burst_windowより短い間隔で送り続ける
+        while not stop.is_set():
+            mailbox.put("sharp")
+            time.sleep(0.02)
+
+    sender = threading.Thread(target=stream, daemon=True)
+    worker.start()
+    sender.start()
+    try:
+        start = time.monotonic()
+        result = _wait_result(worker)
+        assert time.monotonic() - start < 1
+        assert result.overlay == "overlay:sharp"
+        # 残した画像だけを調べる
+        assert gate.assessed == 3
+        assert worker.stats.skipped > 0
+    finally:
+        stop.set()
+        sender.join(1)
+        worker.stop()
+        worker.join(5)
+
+
+def test_async_waiting_frames_keep_only_latest():
+    mailbox = FrameMailbox()
+    processor = _AsyncProcessor()
+    worker = RecognitionWorker(mailbox, processor)
+    worker.start()
+    try:
+        for image in ("a", "b"):
+            mailbox.put(image)
+            assert processor.submitted.acquire(timeout=5)
+        # 依頼できる数が一杯の間に届いた画像は、最新の1枚だけを残す
+        for i in range(10):
+            mailbox.put(f"waiting{i}")
+            time.sleep(0.01)
+        assert _wait_until_taken(mailbox)
+        processor.futures["a"].set_result(([0], None, "overlay:a"))
+        assert processor.submitted.acquire(timeout=5)
+        assert list(processor.futures) == ["a", "b", "waiting9"]
+        # 溢れてmailboxが捨てた画像以外は、依頼せずにskippedに数える
+        assert worker.stats.skipped + mailbox.stats.dropped == 9
+    finally:
+        worker.stop()
+        worker.join(5)
+
+
+def _wait_until_taken(mailbox: FrameMailbox) -> bool:
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if len(mailbox) == 0:
+            return True
+        time.sleep(0.01)
+    return False
@@ -0,0 +1,115 @@
+import socket
+from network.data.frame_reader import FrameReader
+from network.data.multi_type_data_decoder import MultiTypeDataDecoder
+from network.data.string_data import StringData, StringDataDecoder, STRING_DATA_TYPE
+from network.tcp_common import QueuedDataSender, SendQueue, encode_data
+
+
+def test_send_queue_coalesces_small_messages():
+    queue = SendQueue(max_messages=10)
+    for i in range(3):
+        queue.put([b"head", f"{i}".encode()])
+    batch = queue.take_batch(max_bytes=1024)
+    assert b"".join(batch) == b"head0head1head2"
+    stats = queue.stats
+    assert stats.sent_messages == 3
+    assert stats.writes == 1
+    assert stats.max_depth == 3
+    assert stats.depth == 0
+
+
+def test_send_queue_batch_size_limit():
+    queue = SendQueue()
+    queue.put([b"a" * 8])
+    queue.put([b"b" * 8])
+    assert queue.take_batch(max_bytes=10) == [b"a" * 8]
+    assert queue.take_batch(max_bytes=10) == [b"b" * 8]
+
+
+def test_send_queue_drop_oldest():
+    queue = SendQueue(max_messages=2, drop_oldest=True)
+    for message in (b"1", b"2", b"3"):
+        assert queue.put([message])
+    assert queue.take_batch(max_bytes=1024) == [b"2", b"3"]
+    assert queue.stats.dropped == 1
+
+
+def test_send_queue_rejects_without_blocking():
+    queue = SendQueue(max_messages=1)
+    assert queue.put([b"1"], block=False)
+    assert not queue.put([b"2"], block=False)
+    assert queue.stats.rejected == 1
+    assert queue.take_batch(1024, block=False) == [b"1"]
+
+
+def test_send_queue_never_drops_control_messages():
+    queue = SendQueue(max_messages=2, drop_oldest=True)
+    assert queue.put([b"control1"], droppable=False)
+    assert queue.put([b"bulk1"])
+    # 破棄してよいメッセージだけを古い順に捨てる
+    assert queue.put([b"bulk2"])
+    # 一杯でも、破棄してよくないメッセージは待たずに追加する
+    assert queue.put([b"control2"], block=False, droppable=False)
+    assert queue.take_batch(max_bytes=1024) == [b"control1", b"bulk2", b"control2"]
+    assert queue.stats.dropped == 1
+
+    queue = SendQueue(max_messages=1)
+    assert queue.put([b"control1"], droppable=False)
+    assert not queue.put([b"bulk"], block=False)
+    assert queue.put([b"control2"], block=False, droppable=False)
+    assert queue.stats.rejected == 1
+
+
+class _BulkData(StringData):
+    droppable = True
+
+
+def test_queued_data_sender_reports_dropped_bulk_data(capsys):
+    a, b = socket.socketpair()
+    sender = QueuedDataSender(a)
+    # 書き込みスレッドは元のキューを待ち続けるので、このキューは空かない
+    writer_queue = sender.queue
+    sender.queue = SendQueue(max_messages=1)
+    try:
+        sender.send(StringData("control"))
+        sender.send(_BulkData("bulk"))
+        sender.send(StringData("stop"))
+        assert sender.stats.rejected == 1
+        assert sender.stats.depth == 2
+        assert "dropped StringData" in capsys.readouterr().out
+    finally:
+        writer_queue.close()
+        a.close()
+        b.close()
+
+
+def test_send_queue_closed():
+    queue = SendQueue()
+    queue.put([b"1"])
+    queue.close()
+    assert not queue.put([b"2"])
+    assert queue.take_batch(max_bytes=1024) == []
+
+
+def test_queued_data_sender_keeps_wire_format():
+    a, b = socket.socketpair()
+    sender = QueuedDataSender(a)
+    try:
+        messages = [f"message{i}" for i in range(100)]
+        for message in messages:
+            sender.send(StringData(message))
+        decoder = MultiTypeDataDecoder({STRING_DATA_TYPE: StringDataDecoder()})
+        reader = FrameReader(b)
+        assert [decoder.accept(reader).get_data() for _ in messages] == messages
+        stats = sender.stats
+        assert stats.sent_messages == len(messages)
+        assert stats.writes <= stats.sent_messages
+    finally:
+        sender.stop()
+        a.close()
+        b.close()
+
+
+def test_encode_data_matches_legacy_format():
+    encoded = encode_data(StringData("start"))
+    assert encoded == b"\x0a\x00\x00\x00StringData\x05\x00\x00\x00start"
@@ -0,0 +1,112 @@
+import queue
+import socket
+import time
+import pytest
+from network.data.envelope import (
+    ENVELOPE_MAGIC,
+    ENVELOPE_VERSION,
+    HELLO_DATA_TYPE,
+    EnvelopeDataDecoder,
+    HelloData,
+)
+from network.data.frame_reader import FrameReader
+from network.data.multi_type_data_decoder import MultiTypeDataDecoder
+from network.data.string_data import (
+    STRING_DATA_TYPE,
+    STRING_DATA_TYPE_ID,
+    StringData,
+    StringDataDecoder,
+)
+from network.tcp_common import encode_data
+from network.tcp_selector_server import SelectorTCPServer
+
+
+def _envelope_decoder() -> EnvelopeDataDecoder:
+    return EnvelopeDataDecoder(
+        {STRING_DATA_TYPE_ID: StringDataDecoder()},
+        legacy_decoder=MultiTypeDataDecoder({STRING_DATA_TYPE: StringDataDecoder()}),
+    )
+
+
+def _wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def server():
+    received: queue.Queue = queue.Queue()
+    server = SelectorTCPServer(
+        _envelope_decoder(),
+        lambda data: received.put(data.get_data()),
+        host="127.0.0.1",
+        port=0,
+        protocol_version=ENVELOPE_VERSION,
+    )
+    server.received = received
+    server.start_server()
+    yield server
+    server.stop_server()
+
+
+def _connect(server: SelectorTCPServer) -> socket.socket:
+    sock = socket.create_connection(server.server_sock.getsockname(), timeout=5)
+    assert _wait_until(lambda: server.client_count == 1)
+    return sock
+
+
+def test_frames_split_across_reads(server):
+    with _connect(server) as sock:
+        first = encode_data(StringData("first"))
+        second = encode_data(StringData("second"), ENVELOPE_VERSION)
+        for i in range(len(first)):
+            sock.sendall(first[i : i + 1])
+            time.sleep(0.001)
+        sock.sendall(second + first)
+        assert [server.received.get(timeout=5) for _ in range(3)] == [
+            "first",
+            "second",
+            "first",
+        ]
+
+
+def test_client_disconnect_removes_connection(server):
+    sock = _connect(server)
+    sock.sendall(encode_data(StringData("partial"))[:6])
+    sock.close()
+    assert _wait_until(lambda: server.client_count == 0)
+    assert server.received.empty()
+
+
+def test_stop_while_client_sends_partial_frame(server):
+    with _connect(server) as sock:
+        sock.sendall(encode_data(StringData("partial"))[:6])
+        time.sleep(0.1)
+        start = time.monotonic()
+        server.stop_server()
+        assert time.monotonic() - start < 1
+        assert not server._loop_thread.is_alive()
+        # サーバが接続を閉じたので、クライアントには接続の終わりが届く
+        assert sock.recv(1) == b""
+
+
+def test_hello_negotiation(server):
+    with _connect(server) as sock:
+        reader = FrameReader(sock)
+        decoder = _envelope_decoder()
+        sock.sendall(encode_data(HelloData(ENVELOPE_VERSION)))
+        hello = decoder.accept(reader)
+        assert hello.get_name() == HELLO_DATA_TYPE
+        assert hello.get_data() == ENVELOPE_VERSION
+        # Helloはon_receiveに渡さない
+        sock.sendall(encode_data(StringData("after hello"), ENVELOPE_VERSION))
+        assert server.received.get(timeout=5) == "after hello"
+        assert server.received.empty()
+        # ネゴシエーションした接続にはv2形式で送る
+        server.send_all(StringData("broadcast"))
+        assert reader.peek(len(ENVELOPE_MAGIC)) == ENVELOPE_MAGIC
+        assert decoder.accept(reader).get_data() == "broadcast"
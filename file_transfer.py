@@ -0,0 +1,174 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+# 転送途中のファイルに付ける拡張子
+PART_SUFFIX = ".part"
+DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+@dataclass
+class TransferResult:
+    src: Path
+    dst: Path
+    copied: int = 0  # 今回コピーしたバイト数 (同じファイルシステム内の移動なら0)
+    resumed: int = 0  # 前回の続きから再開した場合、再開位置のバイト数
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def file_hash(path: Path, buffer_size: int = DEFAULT_BUFFER_SIZE) -> str:
+    """
+    ファイルのSHA-256 (CPUの命令で速く計算できることが多い)
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                return digest.hexdigest()
+            digest.update(view[:read])
+
+
+def _copy_range(src_fd: int, dst_fd: int, offset: int, size: int, buffer_size: int):
+    """
+    src_fdのoffsetからsizeバイトを、dst_fdの同じ位置へコピーする
+    使えればcopy_file_range、次にsendfile (どちらもカーネル内でコピーする)、
+    使えなければバッファを介して読み書きする
+    """
+    remaining = size - offset
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    if hasattr(os, "copy_file_range"):
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(
+                    src_fd, dst_fd, min(remaining, buffer_size), offset
+                )
+                if copied == 0:
+                    break
+                offset += copied
+                remaining -= copied
+            return offset
+        except OSError:
+            # ファイルシステムが対応していない (EXDEV, EINVALなど) ときは次の方法で続ける
+            os.lseek(dst_fd, offset, os.SEEK_SET)
+    if hasattr(os, "sendfile"):
+        try:
+            while remaining > 0:
+                copied = os.sendfile(dst_fd, src_fd, offset, min(remaining, buffer_size))
+                if copied == 0:
+                    break
+                offset += copied
+                remaining -= copied
+            return offset
+        except OSError:
+            os.lseek(dst_fd, offset, os.SEEK_SET)
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    while remaining > 0:
+        data = os.read(src_fd, min(remaining, buffer_size))
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            view = view[os.write(dst_fd, view) :]
+        offset += len(data)
+        remaining -= len(data)
+    return offset
+
+
+class FileTransfer:
+    """
+    ファイルを別のディレクトリへ移す
+    同じファイルシステム内ならos.replaceで名前を変えるだけにする
+    別のファイルシステムなら、
+      1. 「名前.part」へコピーし (中断していれば続きから)
+      2. コピー元と.partのハッシュが一致することを確かめ
+      3. os.replaceで本来の名前にしてから
+      4. コピー元を消す
+    途中で止まっても、コピー元か移動先のどちらかには完全なファイルが残る
+
+    複数のファイルはtransfer_allでworkers個のスレッドから並列にコピーする
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        allow_rename: bool = True,
+    ):
+        """
+        :param allow_rename: Falseなら同じファイルシステム内でもコピーして確かめる
+        """
+        self.workers = workers
+        self.buffer_size = buffer_size
+        self.allow_rename = allow_rename
+
+    def transfer_all(self, sources: Iterable[Path], dst_dir: Path) -> list[TransferResult]:
+        sources = list(sources)
+        if len(sources) <= 1:
+            return [self.transfer(src, dst_dir) for src in sources]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(lambda src: self.transfer(src, dst_dir), sources))
+
+    def transfer(self, src: Path, dst_dir: Path) -> TransferResult:
+        dst = dst_dir / src.name
+        result = TransferResult(src, dst)
+        try:
+            dst_dir.mkdir(parents=True, exist_ok=True)
+            if self.allow_rename and src.stat().st_dev == dst_dir.stat().st_dev:
+                os.replace(src, dst)
+                return result
+            self._copy_verified(src, dst, result)
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+            print(f"Failed to transfer {src} to {dst}: {result.error}")
+        return result
+
+    def _copy_verified(self, src: Path, dst: Path, result: TransferResult):
+        src_hash = file_hash(src, self.buffer_size)
+        # 前回、名前を変えた後でコピー元を消す前に止まっていた
+        if dst.exists() and file_hash(dst, self.buffer_size) == src_hash:
+            src.unlink()
+            return
+        part = dst.with_name(dst.name + PART_SUFFIX)
+        size = src.stat().st_size
+        for attempt in range(2):
+            start = 0
+            if attempt == 0 and part.exists() and part.stat().st_size <= size:
+                start = part.stat().st_size
+            self._copy(src, part, start, size)
+            result.resumed = start
+            result.copied += size - start
+            if file_hash(part, self.buffer_size) == src_hash:
+                break
+            # 続きからコピーした前半が壊れていたので、最初からやり直す
+            part.unlink()
+        else:
+            raise IOError(f"checksum mismatch: {src}")
+        os.replace(part, dst)
+        src.unlink()
+
+    def _copy(self, src: Path, part: Path, start: int, size: int):
+        src_fd = os.open(src, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            dst_fd = os.open(
+                part, os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666
+            )
+            try:
+                os.ftruncate(dst_fd, start)
+                end = _copy_range(src_fd, dst_fd, start, size, self.buffer_size)
+                if end != size:
+                    raise IOError(f"{src} changed while copying ({end}/{size} bytes)")
+                os.fsync(dst_fd)
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
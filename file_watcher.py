@@ -0,0 +1,312 @@
+import ctypes
+import ctypes.util
+import dataclasses
+import fnmatch
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+
+
+@dataclass
+class WatchProgress:
+    writing: dict[str, int] = field(default_factory=dict)  # 書き込み中のファイル名と大きさ
+    moved: list[str] = field(default_factory=list)  # 処理が終わったファイル名
+    failed: list[str] = field(default_factory=list)  # 処理に失敗したファイル名
+    inotify: bool = False  # inotifyで監視しているか (Falseならポーリング)
+
+
+class _Inotify:
+    """
+    Linuxのinotifyでディレクトリ内のファイルの変更を受け取る (ctypesでlibcを呼ぶ)
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000  # イベントが溢れて捨てられた
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+    def __init__(self, directory: Path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed: {directory}")
+
+    def read_names(self) -> tuple[set[str], bool]:
+        """
+        届いているイベントのファイル名と、イベントが溢れたかを返す (ブロックしない)
+        溢れていたら、名前が届かなかったファイルがあるのでディレクトリを調べ直す必要がある
+        """
+        names = set()
+        overflowed = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return names, overflowed
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                if mask & self.IN_Q_OVERFLOW:
+                    overflowed = True
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if name:
+                    names.add(os.fsdecode(name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _create_inotify(directory: Path) -> Optional[_Inotify]:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        return _Inotify(directory)
+    except (OSError, AttributeError) as e:
+        print(f"inotify is not available, polling {directory}: {e}")
+        return None
+
+
+class FileWatcher(threading.Thread):
+    """
+    ディレクトリにpatternに合うファイルが書き込まれるのを待ち、書き終わったらon_readyを呼ぶスレッド
+    大きさがsettle_time秒変わらなければ書き終わったとみなす (書き込み途中のファイルは渡さない)
+    同時に書き終わったファイルはまとめて渡す
+    処理に失敗したファイルは、retry_interval秒から倍々に (最大max_retry_interval秒) 間隔を空けて再び渡す
+
+    Linuxではinotifyでイベントが届くまで待つので、ファイルが来ない間は何もしない
+    それ以外ではpoll_interval秒ごとにディレクトリを調べる
+    on_ready, on_progressはこのスレッドから呼ばれる
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        pattern: str,
+        on_ready: Callable[[list[Path]], list[bool]],
+        on_progress: Optional[Callable[[WatchProgress], None]] = None,
+        settle_time: float = 1.0,
+        poll_interval: float = 0.5,
+        retry_interval: float = 2.0,
+        max_retry_interval: float = 60.0,
+    ):
+        """
+        :param on_ready: 書き終わったファイルを受け取り、それぞれ処理できたらTrueにしたリストを返す
+        :param on_progress: 書き込み中のファイルや処理したファイルが変わるたびに呼ばれる
+        """
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.pattern = pattern
+        self.on_ready = on_ready
+        self.on_progress = on_progress
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.running = True
+        self._lock = threading.Lock()
+        self._progress = WatchProgress()
+        # 書き込み中のファイル名 → (大きさ, 最後に変化した時刻)
+        self._pending: dict[str, tuple[int, float]] = {}
+        # 処理に失敗したファイル名 → (大きさ, 次に渡す時刻, 次に失敗したときに空ける秒数)
+        self._retry: dict[str, tuple[int, float, float]] = {}
+        self._stopped = threading.Event()
+        # inotifyのselectを起こすためのパイプ (スレッドの終了時に閉じる)
+        self._wake_read, self._wake_write = os.pipe()
+        self._pipe_closed = False
+
+    @property
+    def progress(self) -> WatchProgress:
+        with self._lock:
+            return self._copy_progress()
+
+    def stop(self):
+        self.running = False
+        self._stopped.set()
+        with self._lock:
+            if not self._pipe_closed:
+                os.write(self._wake_write, b"\0")
+
+    def run(self):
+        inotify = _create_inotify(self.directory)
+        with self._lock:
+            self._progress.inotify = inotify is not None
+        try:
+            # 監視を始める前からあるファイル
+            self._scan()
+            while self.running:
+                timeout = self._next_timeout()
+                if inotify is not None:
+                    self._wait_events(inotify, timeout)
+                else:
+                    if timeout is None or timeout > self.poll_interval:
+                        timeout = self.poll_interval
+                    self._stopped.wait(timeout)
+                    self._scan()
+                if self.running:
+                    self._check_settled()
+        finally:
+            if inotify is not None:
+                inotify.close()
+            with self._lock:
+                self._pipe_closed = True
+                os.close(self._wake_read)
+                os.close(self._wake_write)
+
+    def _wait_events(self, inotify: _Inotify, timeout: Optional[float]):
+        readable, _, _ = select.select([inotify.fd, self._wake_read], [], [], timeout)
+        if inotify.fd not in readable:
+            return
+        names, overflowed = inotify.read_names()
+        for name in names:
+            if fnmatch.fnmatch(name, self.pattern):
+                self._update(name)
+        if overflowed:
+            print(f"inotify queue overflowed, rescanning {self.directory}")
+            self._scan()
+
+    def _scan(self):
+        try:
+            # Windowsではscandirの結果に大きさが含まれるので、ファイルごとにstatしない
+            with os.scandir(self.directory) as entries:
+                files = [
+                    (entry.name, entry.stat().st_size)
+                    for entry in entries
+                    if entry.is_file() and fnmatch.fnmatch(entry.name, self.pattern)
+                ]
+        except FileNotFoundError:
+            return
+        for name, size in files:
+            self._update(name, size)
+
+    def _update(self, name: str, size: Optional[int] = None):
+        """
+        ファイルの大きさを調べ、新しいファイルか大きさが変わっていれば時刻を記録する
+        """
+        if size is None:
+            try:
+                size = (self.directory / name).stat().st_size
+            except FileNotFoundError:
+                self._retry.pop(name, None)
+                if self._pending.pop(name, None) is not None:
+                    self._report()
+                return
+        retry = self._retry.get(name)
+        if retry is not None:
+            # 処理に失敗したファイルは、書き換えられるまで間隔を空けて渡し直す
+            if retry[0] == size:
+                return
+            del self._retry[name]
+        last = self._pending.get(name)
+        if last is None or last[0] != size:
+            self._pending[name] = (size, time.monotonic())
+            self._report()
+
+    def _next_timeout(self) -> Optional[float]:
+        """
+        次に書き終わったか調べるか、失敗したファイルを渡し直すまでの秒数
+        どちらのファイルもなければNone
+        """
+        deadlines = [changed + self.settle_time for _, changed in self._pending.values()]
+        deadlines += [retry_at for _, retry_at, _ in self._retry.values()]
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic())
+
+    def _check_settled(self):
+        now = time.monotonic()
+        settled = []
+        for name, (size, changed) in list(self._pending.items()):
+            if now - changed < self.settle_time:
+                continue
+            try:
+                current = (self.directory / name).stat().st_size
+            except FileNotFoundError:
+                del self._pending[name]
+                self._report()
+                continue
+            if current != size:
+                self._pending[name] = (current, now)
+                self._report()
+                continue
+            del self._pending[name]
+            settled.append(name)
+        for name, (size, retry_at, _) in list(self._retry.items()):
+            if now < retry_at:
+                continue
+            try:
+                current = (self.directory / name).stat().st_size
+            except FileNotFoundError:
+                del self._retry[name]
+                continue
+            if current == size:
+                settled.append(name)
+            else:
+                del self._retry[name]
+                self._pending[name] = (current, now)
+                self._report()
+        if not settled:
+            return
+        paths = [self.directory / name for name in settled]
+        try:
+            results = self.on_ready(paths)
+        except Exception as e:
+            print(f"Failed to handle {paths}: {e}")
+            results = [False] * len(paths)
+        for name, succeeded in zip(settled, results):
+            if succeeded:
+                self._retry.pop(name, None)
+                continue
+            _, _, delay = self._retry.get(name, (0, 0.0, self.retry_interval))
+            try:
+                size = (self.directory / name).stat().st_size
+            except FileNotFoundError:
+                self._retry.pop(name, None)
+                continue
+            self._retry[name] = (
+                size,
+                time.monotonic() + delay,
+                min(delay * 2, self.max_retry_interval),
+            )
+        with self._lock:
+            for name, succeeded in zip(settled, results):
+                if succeeded:
+                    self._progress.moved.append(name)
+                    if name in self._progress.failed:
+                        self._progress.failed.remove(name)
+                elif name not in self._progress.failed:
+                    self._progress.failed.append(name)
+        self._report()
+
+    def _report(self):
+        with self._lock:
+            self._progress.writing = {
+                name: size for name, (size, _) in self._pending.items()
+            }
+            progress = self._copy_progress()
+        if self.on_progress is not None:
+            self.on_progress(progress)
+
+    def _copy_progress(self) -> WatchProgress:
+        return dataclasses.replace(
+            self._progress,
+            writing=dict(self._progress.writing),
+            moved=list(self._progress.moved),
+            failed=list(self._progress.failed),
+        )
@@ -0,0 +1,140 @@
+import dataclasses
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Optional
+
+
+@dataclass(frozen=True)
+class Frame:
+    seq: int  # 受信順の通し番号 (1から)
+    image: Any
+    received_at: float  # time.monotonic() での受信時刻
+    orientation: int = 1  # EXIFのOrientation。画素は回転せず、表示と保存のときに使う
+    key: Optional[str] = None  # 画像の内容のハッシュ (同じ画像の認識結果を使い回すため)
+
+
+@dataclass
+class MailboxStats:
+    received: int = 0  # put()された数
+    taken: int = 0  # 取り出された数
+    dropped: int = 0  # 表示されずに捨てられた数 (溢れ、take_latestでの読み飛ばし、drain)
+
+
+class FrameMailbox:
+    """
+    受信した画像を受け渡す上限付きの箱 (新しいものが優先)
+    受信スレッドがput()し、UIスレッドがtake_latest()で最新の1枚だけを取り出す
+
+    capacityを超えると古い画像から捨てるので、連続で送られてきても
+    メモリに画像が溜まり続けることはない
+    """
+
+    def __init__(self, capacity: int = 1):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self._frames: deque[Frame] = deque()
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._wake_count = 0
+        self._seq = 0
+        self._stats = MailboxStats()
+
+    @property
+    def stats(self) -> MailboxStats:
+        with self._lock:
+            return dataclasses.replace(self._stats)
+
+    @property
+    def last_seq(self) -> int:
+        """
+        最後にput()された画像の通し番号 (まだなければ0)
+        """
+        with self._lock:
+            return self._seq
+
+    def put(
+        self, image: Any, orientation: int = 1, key: Optional[str] = None
+    ) -> int:
+        """
+        画像を入れて通し番号を返す。一杯なら最も古い画像を捨てる
+        """
+        with self._lock:
+            self._seq += 1
+            if len(self._frames) >= self._capacity:
+                self._frames.popleft()
+                self._stats.dropped += 1
+            self._frames.append(
+                Frame(self._seq, image, time.monotonic(), orientation, key)
+            )
+            self._stats.received += 1
+            self._changed.notify_all()
+            return self._seq
+
+    def take_latest(self) -> Optional[Frame]:
+        """
+        最新の画像を取り出し、それより古い画像は捨てる。空ならNone
+        """
+        with self._lock:
+            return self._take_latest()
+
+    def wait_latest(self, timeout: Optional[float] = None) -> Optional[Frame]:
+        """
+        画像が届くまで待ってからtake_latest()する
+        タイムアウトするかwake()されたらNoneを返す
+        """
+        with self._lock:
+            wake_count = self._wake_count
+            self._changed.wait_for(
+                lambda: self._frames or self._wake_count != wake_count, timeout
+            )
+            return self._take_latest()
+
+    def wait_all(self, timeout: Optional[float] = None) -> list[Frame]:
+        """
+        画像が届くまで待ってから、溜まっている画像をすべて古い順に取り出す
+        連写された中から画像を選ぶ場合に使う。タイムアウトするかwake()されたら空のリストを返す
+        """
+        with self._lock:
+            wake_count = self._wake_count
+            self._changed.wait_for(
+                lambda: self._frames or self._wake_count != wake_count, timeout
+            )
+            frames = list(self._frames)
+            self._frames.clear()
+            self._stats.taken += len(frames)
+            return frames
+
+    def wake(self):
+        """
+        wait_latest(), wait_all()で待っているスレッドを起こす
+        """
+        with self._lock:
+            self._wake_count += 1
+            self._changed.notify_all()
+
+    def drain(self) -> int:
+        """
+        溜まっている画像をすべて捨て、捨てた数を返す
+        画面を開いたときなど、それ以前に届いた画像を無視したい場合に呼ぶ
+        """
+        with self._lock:
+            count = len(self._frames)
+            self._frames.clear()
+            self._stats.dropped += count
+            return count
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._frames)
+
+    def _take_latest(self) -> Optional[Frame]:
+        if not self._frames:
+            return None
+        frame = self._frames.pop()
+        self._stats.dropped += len(self._frames)
+        self._frames.clear()
+        self._stats.taken += 1
+        return frame
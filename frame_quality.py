@@ -0,0 +1,77 @@
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+import cv2
+from cv2 import aruco
+import numpy as np
+from PIL import Image
+
+
+@dataclass(frozen=True)
+class FrameQuality:
+    sharpness: float  # 縮小画像のラプラシアンの分散 (大きいほどくっきりしている)
+    markers: int  # 縮小画像で見つかった、マークシートの四隅のマーカーの数
+
+
+class FrameQualityGate:
+    """
+    認識の前に縮小画像で画像の質を調べ、連写された中から認識する画像を選ぶために使う
+    縮小画像では小さく写ったマーカーが見つからないことがあるので、質を満たさない画像も認識はする
+    """
+
+    def __init__(
+        self,
+        marker_ids: Iterable[int],
+        min_sharpness: float = 30.0,
+        min_markers: Optional[int] = None,
+        thumbnail_size: int = 640,
+    ):
+        """
+        :param marker_ids: マークシートの四隅のマーカーのid (CorrectionProcessorのpreset_ids)
+            これ以外のidのマーカーは数えない
+        :param min_sharpness: これ未満の画像はぶれているとみなす
+            (thumbnail_sizeの画像での値。絵柄によって変わるので、明らかにぼけた画像だけを除く値にする)
+        :param min_markers: 必要なmarker_idsのマーカーの数。省略するとすべて
+        :param thumbnail_size: 調べる縮小画像の長辺のおおよその画素数
+        """
+        self.marker_ids = np.array(sorted(set(marker_ids)))
+        self.min_sharpness = min_sharpness
+        self.min_markers = len(self.marker_ids) if min_markers is None else min_markers
+        self.thumbnail_size = thumbnail_size
+        parameters = aruco.DetectorParameters()
+        parameters.cornerRefinementMethod = aruco.CORNER_REFINE_NONE
+        self.detector = aruco.ArucoDetector(
+            aruco.getPredefinedDictionary(aruco.DICT_4X4_50), parameters
+        )
+
+    def assess(self, image: Any) -> FrameQuality:
+        """
+        画像 (PIL.ImageかRGBのndarray) の質を調べる
+        """
+        gray = self._thumbnail(image)
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+        _, ids, _ = self.detector.detectMarkers(gray)
+        markers = 0 if ids is None else int(np.isin(self.marker_ids, ids).sum())
+        return FrameQuality(sharpness, markers)
+
+    def accepts(self, quality: FrameQuality) -> bool:
+        return (
+            quality.sharpness >= self.min_sharpness
+            and quality.markers >= self.min_markers
+        )
+
+    def _thumbnail(self, image: Any) -> np.ndarray:
+        """
+        長辺がthumbnail_size程度のグレースケール画像を返す
+        元の解像度の画像をグレースケールに変換したり、コピーしたりしない
+        """
+        if isinstance(image, Image.Image):
+            factor = max(1, max(image.size) // self.thumbnail_size)
+            small = image.reduce(factor) if factor > 1 else image
+            return np.asarray(small.convert("L"))
+        rgb = np.asarray(image)
+        scale = min(1.0, self.thumbnail_size / max(rgb.shape[:2]))
+        if scale < 1.0:
+            rgb = cv2.resize(
+                rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+        return cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
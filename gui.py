@@ -3,6 +3,7 @@ from tkinter import messagebox, ttk
 from typing import Callable, List, Optional
 from step.step import Step
 from PIL import ImageFile
+import queue
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
@@ -66,6 +67,41 @@ class MainWindow:
         self.on_press_return_first()
 
 
+# ---------------------
+# MainThreadDispatcher
+# ---------------------
+class MainThreadDispatcher:
+    """
+    他スレッドから渡されたコールバックを、Tkのメインループ(StepManagerのスレッド)で実行する
+    """
+
+    def __init__(self, root: tk.Tk, interval_ms: int = 10):
+        self.root = root
+        self.interval_ms = interval_ms
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    def start(self):
+        self._poll()
+
+    def call(self, callback: Callable[..., None], *args):
+        """
+        どのスレッドからでも呼べる
+        """
+        self._queue.put((callback, args))
+
+    def _poll(self):
+        while True:
+            try:
+                callback, args = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Callback error: {e}")
+        self.root.after(self.interval_ms, self._poll)
+
+
 # ---------------------
 # StepManager
 # ---------------------
@@ -0,0 +1,49 @@
+from typing import Tuple
+from PIL import ExifTags, Image
+
+ORIENTATION_TAG = ExifTags.Base.Orientation
+
+# EXIFのOrientationの値ごとの、正しい向きに直す変換 (1は変換なし)
+_TRANSPOSES = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def read_orientation(image: Image.Image) -> int:
+    """
+    EXIFのOrientationタグだけを読む。なければ1
+    """
+    orientation = image.getexif().get(ORIENTATION_TAG, 1)
+    return orientation if orientation in _TRANSPOSES else 1
+
+
+def oriented_size(size: Tuple[int, int], orientation: int) -> Tuple[int, int]:
+    """
+    正しい向きに直したときの (幅, 高さ)
+    """
+    if orientation in (5, 6, 7, 8):
+        return size[1], size[0]
+    return size
+
+
+def apply_orientation(image: Image.Image, orientation: int) -> Image.Image:
+    """
+    画像を正しい向きに直す。画素をコピーするので、表示用に縮小した画像に使う
+    """
+    transpose = _TRANSPOSES.get(orientation)
+    return image if transpose is None else image.transpose(transpose)
+
+
+def orientation_exif(orientation: int) -> Image.Exif:
+    """
+    保存時に渡すOrientationタグだけのEXIF
+    """
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = orientation
+    return exif
@@ -1,41 +1,43 @@
 from pathlib import Path
 from network.tcp_server import TCPServer
+from network.tcp_selector_server import SelectorTCPServer
+from network.async_tcp_common import EventLoopThread
+from network.async_tcp_server import AsyncTCPServer
+from network.async_tcp_client import AsyncTCPClient
 from network.data.data_decoder import DecodedData
-from network.data.image_data import IMAGE_DATA_TYPE, ImageDataDecoder
+from network.data.image_data import (
+    CONTENT_HASH_INFO,
+    IMAGE_DATA_TYPE,
+    IMAGE_DATA_TYPE_ID,
+    ImageDataDecoder,
+)
+from network.data.envelope import ENVELOPE_VERSION, EnvelopeDataDecoder
 from step.initial_step import InitialStepFactory
-from step.ssq_step import SSQStepFactory
-from step.mssq_step import MSSQStepFactory
+from step.ssq_step import SSQStepFactory, SSQ_PROCESSOR, create_ssq_processor
+from step.mssq_step import MSSQStepFactory, MSSQ_PROCESSOR, create_mssq_processor
+from recognition_pool import RecognitionPool
+from recognition_cache import RecognitionCache
+from participant_index import ParticipantIndex
 from step.unity_step import UnityStepFactory
 from step.vection_survey_step import VectionSurveyStepFactory
 from step.file_move_step import FileMoveStepFactory
-from PIL import ExifTags
-import queue
+from image_orientation import read_orientation
+from frame_mailbox import FrameMailbox
+from typing import Optional
 import ctypes
 import tkinter as tk
 import argparse
 import yaml
-from gui import MainWindow, StepManager
+from gui import MainWindow, StepManager, MainThreadDispatcher
 
 
-def on_receive(queue: queue.Queue, decodedData: DecodedData):
+def on_receive(mailbox: FrameMailbox, decodedData: DecodedData):
     if decodedData.get_name() == IMAGE_DATA_TYPE:
         image = decodedData.get_data()
-
-        exif = image._getexif()
-
-        # Orientationタグを探す
-        if exif is not None:
-            for tag, value in exif.items():
-                tag_name = ExifTags.TAGS.get(tag)
-                if tag_name == "Orientation":
-                    orientation = value
-                    if orientation == 3:
-                        image = image.rotate(180, expand=True)
-                    elif orientation == 6:
-                        image = image.rotate(270, expand=True)
-                    elif orientation == 8:
-                        image = image.rotate(90, expand=True)
-        queue.put(image)
+        # 画素は回転せず、向きは表示と保存のときに使う
+        # (マーカーのidで頂点の順番が決まるので、認識は画像の向きによらない)
+        key = image.info.get(CONTENT_HASH_INFO)
+        mailbox.put(image, read_orientation(image), key)
     else:
         print(f"Recieve {decodedData.get_name()}")
 
@@ -43,10 +45,62 @@ def on_receive(queue: queue.Queue, decodedData: DecodedData):
 # ---------------------
 # main
 # ---------------------
-def main(working_dir: Path, bb_dir: Path, sound_path: Path):
-    decoder = ImageDataDecoder()
-    q = queue.Queue(0)
-    server = TCPServer(decoder, lambda data: on_receive(q, data), port=51234)
+def create_server(
+    server_mode: str, decoder, on_receive, loop_thread: Optional[EventLoopThread]
+):
+    """
+    server_mode: "thread" (クライアントごとに受信スレッド), "selector" (単一スレッド),
+    "asyncio" (loop_threadのイベントループ)
+    Helloを送ってきたクライアントにはv2形式で返信する
+    """
+    if server_mode == "selector":
+        return SelectorTCPServer(
+            decoder, on_receive, port=51234, protocol_version=ENVELOPE_VERSION
+        )
+    if server_mode == "asyncio":
+        return AsyncTCPServer(
+            decoder,
+            on_receive,
+            loop_thread,
+            port=51234,
+            protocol_version=ENVELOPE_VERSION,
+        )
+    return TCPServer(
+        decoder, on_receive, port=51234, protocol_version=ENVELOPE_VERSION
+    )
+
+
+def main(
+    working_dir: Path,
+    bb_dir: Path,
+    sound_path: Path,
+    server_mode: str = "thread",
+    recognition_workers: int = 0,
+    image_decode_size: Optional[int] = None,
+    cache_dir: Optional[Path] = None,
+):
+    """
+    recognition_workers: 1以上ならマークシートの認識をその数のワーカープロセスで行う
+    image_decode_size: 指定すると受信したJPEGを長辺がこの画素数以上になる範囲で縮小してデコードする
+        (12MPの写真なら2016で1/2になり、認識の精度は変わらない)
+    cache_dir: 指定すると認識結果のキャッシュをこのディレクトリにも書き出す
+    """
+    # asyncioモードでは画像受信サーバとUnityとの接続を1つのイベントループで処理する
+    loop_thread = None
+    if server_mode == "asyncio":
+        loop_thread = EventLoopThread()
+        loop_thread.start()
+
+    # v2形式とレガシー形式のどちらで送ってくるクライアントも受け付ける
+    image_decoder = ImageDataDecoder(image_decode_size)
+    decoder = EnvelopeDataDecoder(
+        {IMAGE_DATA_TYPE_ID: image_decoder}, legacy_decoder=image_decoder
+    )
+    # 連写された画像から選べるよう数枚だけ残し、それより古い画像は捨てる
+    mailbox = FrameMailbox(capacity=4)
+    server = create_server(
+        server_mode, decoder, lambda data: on_receive(mailbox, data), loop_thread
+    )
     server.start_server()
 
     try:
@@ -57,16 +111,76 @@ def main(working_dir: Path, bb_dir: Path, sound_path: Path):
     root = tk.Tk()
     root.geometry("800x600")
     root.title("実験フロー")
+    dispatcher = MainThreadDispatcher(root)
+    dispatcher.start()
 
     data_container = {}
 
-    name_step_factory = InitialStepFactory(data_container, working_dir)
-    mssq_factory = MSSQStepFactory(working_dir, data_container, q)
-    before_ssq_factory = SSQStepFactory(working_dir, data_container, q, "SSQ", "before")
-    unity_step_factory = UnityStepFactory(data_container, working_dir, sound_path, 5)
-    file_move_step_factory = FileMoveStepFactory(bb_dir, working_dir, data_container)
-    vection_survey_step_factory = VectionSurveyStepFactory(working_dir, data_container)
-    after_ssq_factory = SSQStepFactory(working_dir, data_container, q, "SSQ", "after")
+    # 参加者ごとの終わった条件は起動時に1度だけ調べ、以降は保存するたびに更新する
+    participant_index = ParticipantIndex(working_dir)
+    participant_index.scan()
+    name_step_factory = InitialStepFactory(
+        data_container, working_dir, participant_index
+    )
+    # ワーカーは起動時に生成し、画像処理クラスを使い回す
+    recognition_pool = None
+    if recognition_workers > 0:
+        recognition_pool = RecognitionPool(
+            {
+                SSQ_PROCESSOR: create_ssq_processor,
+                MSSQ_PROCESSOR: create_mssq_processor,
+            },
+            workers=recognition_workers,
+        )
+    # 同じ画像の認識結果と保存した画像は、ステップ・参加者をまたいで使い回す
+    cache = RecognitionCache(disk_dir=cache_dir)
+    mssq_factory = MSSQStepFactory(
+        working_dir,
+        data_container,
+        mailbox,
+        recognition_pool=recognition_pool,
+        cache=cache,
+        participant_index=participant_index,
+    )
+    before_ssq_factory = SSQStepFactory(
+        working_dir,
+        data_container,
+        mailbox,
+        "SSQ",
+        "before",
+        recognition_pool,
+        cache,
+        participant_index,
+    )
+    create_unity_client = None
+    if loop_thread is not None:
+        create_unity_client = lambda decoder: AsyncTCPClient(
+            decoder, loop_thread, dispatcher.call
+        )
+    unity_step_factory = UnityStepFactory(
+        data_container,
+        working_dir,
+        sound_path,
+        5,
+        create_unity_client,
+        participant_index,
+    )
+    file_move_step_factory = FileMoveStepFactory(
+        bb_dir, working_dir, data_container, participant_index
+    )
+    vection_survey_step_factory = VectionSurveyStepFactory(
+        working_dir, data_container, participant_index
+    )
+    after_ssq_factory = SSQStepFactory(
+        working_dir,
+        data_container,
+        mailbox,
+        "SSQ",
+        "after",
+        recognition_pool,
+        cache,
+        participant_index,
+    )
     factories = [
         name_step_factory.create,
         mssq_factory.create,
@@ -87,6 +201,8 @@ def main(working_dir: Path, bb_dir: Path, sound_path: Path):
     manager.show_step(0)
 
     root.mainloop()
+    if recognition_pool is not None:
+        recognition_pool.close()
 
 
 if __name__ == "__main__":
@@ -110,4 +226,16 @@ if __name__ == "__main__":
     working_dir = config.get("working_dir")
     bb_dir = config.get("bb_dir")
     sound_path = config.get("sound_path")
-    main(Path(working_dir), Path(bb_dir), Path(sound_path))
+    server_mode = config.get("server_mode", "thread")
+    recognition_workers = config.get("recognition_workers", 0)
+    image_decode_size = config.get("image_decode_size")
+    cache_dir = config.get("cache_dir")
+    main(
+        Path(working_dir),
+        Path(bb_dir),
+        Path(sound_path),
+        server_mode,
+        recognition_workers,
+        image_decode_size,
+        Path(cache_dir) if cache_dir else None,
+    )
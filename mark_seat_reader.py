@@ -2,18 +2,51 @@ import cv2
 from cv2 import aruco
 import numpy as np
 import dataclasses
+import functools
 from typing import Tuple, Optional, Union, List
 
 
+@dataclasses.dataclass
+class TrackingStats:
+    hits: int = 0  # 前回のマーカー付近だけで4つとも見つかった数
+    misses: int = 0  # 付近で見つからず、画像全体を探し直した数
+    reused: int = 0  # 頂点がほとんど動かず、前回の射影変換行列を使い回した数
+
+
 class CorrectionProcessor:
+    # 追跡時、前回のマーカー付近を探すときのマーカーの一辺の画素数
+    TRACK_MARKER_SIZE = 96
+
     def __init__(
         self,
         width: int,
         height: int,
         preset_ids=[0, 1, 3, 2],
         preset_corner_ids=[2, 3, 0, 1],
+        detection_size: int = 1280,
+        tracking: bool = False,
+        track_margin: float = 0.5,
+        reuse_tolerance: float = 0.5,
     ):
+        """
+        :param detection_size: マーカーを探す縮小画像の長辺の画素数
+            縮小画像で見つからなければ元の解像度で探し直す
+        :param tracking: 前回見つかったマーカーの付近から先に探す
+            (同じ用紙を撮り直す場合、マーカーはほぼ同じ位置に写るため)
+        :param track_margin: 前回のマーカーの外接矩形を、マーカーの大きさの何倍広げて探すか
+        :param reuse_tolerance: 頂点の移動がこの画素数未満なら前回の射影変換行列を使い回す
+        """
         self.dic_aruco = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
+        # 頂点は元の解像度でcornerSubPixにより求めるので、検出器では補正しない
+        parameters = aruco.DetectorParameters()
+        parameters.cornerRefinementMethod = aruco.CORNER_REFINE_NONE
+        self.detector = aruco.ArucoDetector(self.dic_aruco, parameters)
+        self.detection_size = detection_size
+        self.subpix_criteria = (
+            cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT,
+            30,
+            0.01,
+        )
 
         # マーカー四角形の指定
         self.preset_ids = preset_ids  # 現実世界で貼るマーカーのid(左上から時計回り)
@@ -26,6 +59,29 @@ class CorrectionProcessor:
             [(0, 0), (self.rectW, 0), (self.rectW, self.rectH), (0, self.rectH)]
         )  # 長方形座標
 
+        self.tracking = tracking
+        self.track_margin = track_margin
+        self.reuse_tolerance = reuse_tolerance
+        self.tracking_stats = TrackingStats()
+        self._last_markers: Optional[dict[int, np.ndarray]] = None  # 元の解像度の座標
+        self._last_pts: Optional[np.ndarray] = None
+        self._last_homography: Optional[np.ndarray] = None
+
+    @property
+    def rect_size(self) -> tuple[int, int]:
+        """
+        補正後の長方形の (幅, 高さ)
+        """
+        return self.rectW, self.rectH
+
+    def reset_tracking(self):
+        """
+        前回のマーカー位置と射影変換行列を忘れる (別の用紙を撮るとき用)
+        """
+        self._last_markers = None
+        self._last_pts = None
+        self._last_homography = None
+
     def get_rectangle(self, frame):
         """
         対応する四角形の頂点を左上から時計回りで返す
@@ -33,26 +89,146 @@ class CorrectionProcessor:
         """
 
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)  # グレースケールにする
+        return self.get_rectangle_gray(gray)
+
+    def get_rectangle_gray(self, gray: np.ndarray):
+        """
+        get_rectangle() のグレースケール画像版
+        縮小画像でマーカーを検出し、必要な4頂点だけを元の解像度で補正する
+        追跡モードでは、先に前回のマーカーの付近だけを元の解像度で探す
+        """
+        markers, scale = None, 1.0
+        if self.tracking and self._last_markers is not None:
+            markers, scale = self._track_markers(gray)
+            if markers is None:
+                self.tracking_stats.misses += 1
+            else:
+                self.tracking_stats.hits += 1
+        if markers is None:
+            markers, scale = self._detect_markers(gray)
+        if markers is None:
+            self._last_markers = None
+            return None
+        if self.tracking:
+            self._last_markers = markers
+        pts1 = self._select_corners(markers)
+        # 縮小画像で検出した頂点は数画素 (元の画像で数/scale画素) ずれることがあるので、
+        # マーカーの内側の模様の角 (マーカーの1/6先) に届かない範囲で広く探して補正する
+        marker_size = min(
+            (markers[id].max(axis=0) - markers[id].min(axis=0)).max()
+            for id in self.preset_ids
+        )
+        half = max(3, int(np.ceil(2 / scale)), int(marker_size / 12))
+        cv2.cornerSubPix(gray, pts1, (half, half), (-1, -1), self.subpix_criteria)
+        return pts1
 
-        corners, ids, _ = aruco.detectMarkers(
-            gray, self.dic_aruco
-        )  # マーカー検出 corners(N,1,4,2) ids(N,1)
+    def _detect_markers(
+        self, gray: np.ndarray
+    ) -> Tuple[Optional[dict[int, np.ndarray]], float]:
+        """
+        画像全体からpreset_idsのマーカーを探し、(idごとの元の解像度での4頂点, 探した倍率) を返す
+        """
+        scale = min(1.0, self.detection_size / max(gray.shape))
+        if scale < 1.0:
+            small = cv2.resize(
+                gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+            markers = self._find_markers(small)
+            if markers is not None:
+                return {id: corner / scale for id, corner in markers.items()}, scale
+        # マーカーが小さく写っている場合は元の解像度で探し直す
+        return self._find_markers(gray), 1.0
+
+    def _track_markers(
+        self, gray: np.ndarray
+    ) -> Tuple[Optional[dict[int, np.ndarray]], float]:
+        """
+        前回のマーカーの付近だけを探し、(idごとの元の解像度での4頂点, 探した倍率) を返す
+        範囲はマーカーが一辺TRACK_MARKER_SIZE画素程度になるよう縮小してから探す
+        1つでも見つからなければマーカーはNone
+        """
+        height, width = gray.shape
+        markers = {}
+        min_scale = 1.0
+        for id, last in self._last_markers.items():
+            size = last.max(axis=0) - last.min(axis=0)
+            scale = min(1.0, self.TRACK_MARKER_SIZE / max(size.max(), 1))
+            x0, y0 = np.maximum(last.min(axis=0) - size * self.track_margin, 0)
+            x1, y1 = np.minimum(
+                last.max(axis=0) + size * self.track_margin, (width, height)
+            )
+            x0, y0, x1, y1 = int(x0), int(y0), int(np.ceil(x1)), int(np.ceil(y1))
+            if x0 >= x1 or y0 >= y1:
+                return None, 1.0
+            window = gray[y0:y1, x0:x1]
+            if scale < 1.0:
+                window = cv2.resize(
+                    window, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+                )
+            found = self._find_markers(window, [id])
+            # 範囲の端で切れたマーカーも誤り訂正で読めてしまうため、端に接していたら使わない
+            if found is None or not self._is_inside(found[id], window.shape):
+                return None, 1.0
+            markers[id] = found[id] / scale + np.float32((x0, y0))
+            min_scale = min(min_scale, scale)
+        return markers, min_scale
+
+    @staticmethod
+    def _is_inside(corners: np.ndarray, shape: tuple, border: int = 2) -> bool:
+        height, width = shape[:2]
+        return bool(
+            (corners >= border).all()
+            and (corners[:, 0] < width - border).all()
+            and (corners[:, 1] < height - border).all()
+        )
 
-        list_ids = np.ravel(ids)  # idsを一次元化する
+    def _find_markers(
+        self, gray: np.ndarray, ids: Optional[list[int]] = None
+    ) -> Optional[dict[int, np.ndarray]]:
+        """
+        idsのマーカーの4頂点 (4, 2) をidごとに返す (省略時はpreset_ids)
+        1つでも見つからなければNone
+        """
+        ids = self.preset_ids if ids is None else ids
+        # マーカー検出 corners(N,1,4,2) ids(N,1)
+        corners, found_ids, _ = self.detector.detectMarkers(gray)
+        if found_ids is None:
+            return None
         pt = {}
-        for id, corner in zip(list_ids, corners):  # まずは検出結果について
-            pt[id] = corner[0]  # idとcornerを紐づける
-        pts = []
-        for id, corner_id in zip(self.preset_ids, self.preset_corner_ids):
-            corner = pt.get(id)
-            if corner is not None:
-                pts.append(corner[corner_id])  # 特定の頂点の座標を順にリストに追加する
-        pts1 = np.float32(pts)  # 投影変換する前の四角形
-        print(f"found:{list_ids}")
-        if len(pts1) == 4:  # 頂点が4つ見つかったとき
-            return pts1
-        else:
+        for id, corner in zip(np.ravel(found_ids), corners):
+            pt[int(id)] = corner[0]  # idとcornerを紐づける
+        if any(id not in pt for id in ids):
             return None
+        return {id: pt[id] for id in ids}
+
+    def _select_corners(self, markers: dict[int, np.ndarray]) -> np.ndarray:
+        """
+        各マーカーのpreset_corner_idsの頂点を返す (左上から時計回り)
+        """
+        return np.float32(
+            [
+                markers[id][corner_id]
+                for id, corner_id in zip(self.preset_ids, self.preset_corner_ids)
+            ]
+        )
+
+    def get_homography(self, pts1: np.ndarray) -> np.ndarray:
+        """
+        画像上の四角形pts1を、補正後の長方形に移す射影変換行列を返す
+        追跡モードでは、頂点がほとんど動いていなければ前回の行列を返す
+        """
+        if (
+            self.tracking
+            and self._last_homography is not None
+            and np.abs(pts1 - self._last_pts).max() < self.reuse_tolerance
+        ):
+            self.tracking_stats.reused += 1
+            return self._last_homography
+        homography = cv2.getPerspectiveTransform(pts1, self.pts2)
+        if self.tracking:
+            self._last_pts = np.float32(pts1)
+            self._last_homography = homography
+        return homography
 
     def correct(
         self, frame
@@ -117,6 +293,54 @@ class CorrectionProcessor:
 
         return result_img
 
+    def overlay_polygons(
+        self,
+        base_img: np.ndarray,
+        polygons: np.ndarray,
+        pts1: np.ndarray,
+        alpha: float = 1.0,
+        color: tuple[int, int, int] = (0, 0, 0),
+        scale: float = 1.0,
+    ) -> np.ndarray:
+        """
+        補正後の長方形上の多角形を実画像上に射影し、指定色で重ねる (base_imgを直接書き換える)
+        頂点だけを射影変換し、多角形の外接矩形の範囲だけを合成するので、
+        処理時間は画像の画素数ではなく多角形の数に比例する
+
+        :param base_img: 重ねる先の画像 (元画像をscale倍に縮小したプレビューでもよい)
+        :param polygons: 多角形の頂点 (N, 頂点数, 2)。補正後の長方形の座標
+        :param pts1: 元画像上の投影先四角形 (上から時計回りの4点)
+        :param alpha: 色の不透明度 (1.0で完全塗りつぶし）
+        :param color: 上書きする色 (base_imgのチャンネル順)
+        :param scale: 元画像に対するbase_imgの倍率
+        :return: base_img
+        """
+        if len(polygons) == 0:
+            return base_img
+        M = cv2.getPerspectiveTransform(self.pts2, np.float32(pts1) * scale)
+        points = cv2.perspectiveTransform(
+            np.float32(polygons).reshape(-1, 1, 2), M
+        ).reshape(len(polygons), -1, 2)
+        height, width = base_img.shape[:2]
+        shift = 4  # 頂点を1/16画素単位で描く
+        for polygon in points:
+            x0, y0 = np.maximum(np.floor(polygon.min(axis=0)).astype(int), 0)
+            x1, y1 = np.minimum(
+                np.ceil(polygon.max(axis=0)).astype(int) + 1, (width, height)
+            )
+            if x0 >= x1 or y0 >= y1:
+                continue
+            roi = base_img[y0:y1, x0:x1]
+            vertices = np.round((polygon - (x0, y0)) * (1 << shift)).astype(np.int32)
+            if alpha >= 1.0:
+                cv2.fillPoly(roi, [vertices], color, shift=shift)
+                continue
+            filled = roi.copy()
+            cv2.fillPoly(filled, [vertices], color, shift=shift)
+            # 多角形の外側はfilledとroiが同じなので、合成しても値は変わらない
+            cv2.addWeighted(filled, alpha, roi, 1 - alpha, 0, dst=roi)
+        return base_img
+
 
 @dataclasses.dataclass(frozen=True)
 class Margin:
@@ -128,6 +352,163 @@ class Margin:
     margin_bottom: int = 0
 
 
+def _scale_margin(margin: Margin, scale: float) -> Margin:
+    if scale == 1.0:
+        return margin
+    return Margin(
+        round(margin.margin_top * scale),
+        round(margin.margin_left * scale),
+        round(margin.margin_right * scale),
+        round(margin.margin_bottom * scale),
+    )
+
+
+@dataclasses.dataclass(frozen=True, eq=False)
+class SheetLayout:
+    """
+    マークシートの配置を事前に計算したもの (不変)
+    座標はすべて作業解像度での値で、get_sheet_layout()で取得すると同じ配置は共有される
+    """
+
+    row: int
+    col: int
+    scale: float  # 作業解像度 (指定した寸法に対する倍率)
+    cell_width: int  # マーク部分の幅
+    cell_height: int  # マーク部分の高さ
+    pitch: tuple[float, float]  # 余白込みのセルの (幅, 高さ)。丸める前の値
+    rect_margin: Margin  # レイアウト全体に対するマーク領域の余白
+    cell_margin: Margin
+    layout_size: tuple[int, int]  # 余白を含めたレイアウト全体の (幅, 高さ)
+    # 指定した寸法のレイアウト全体にscaleを掛けた (幅, 高さ)。丸める前の値で、
+    # 補正後の長方形との対応はこの大きさで計算する
+    scaled_size: tuple[float, float]
+    region_size: tuple[int, int]  # マーク領域の (幅, 高さ)
+    region_slice: tuple[slice, slice]  # レイアウト内のマーク領域の (y, x) スライス
+    # マーク領域内の各セルの (x, y, 幅, 高さ)。形は (行, 列, 4)
+    cell_rects: np.ndarray
+    # マーク領域内の各セルの (y, x) スライス。cell_slices[行][列]
+    cell_slices: tuple[tuple[tuple[slice, slice], ...], ...]
+
+    @property
+    def cell_x0(self) -> np.ndarray:
+        return self.cell_rects[:, :, 0]
+
+    @property
+    def cell_y0(self) -> np.ndarray:
+        return self.cell_rects[:, :, 1]
+
+    @property
+    def cell_x1(self) -> np.ndarray:
+        return self.cell_rects[:, :, 0] + self.cell_width
+
+    @property
+    def cell_y1(self) -> np.ndarray:
+        return self.cell_rects[:, :, 1] + self.cell_height
+
+
+def _scale_position(value, scale: float):
+    """
+    指定した寸法での座標に倍率を掛けて四捨五入する (配列でもよい)
+    """
+    return np.floor(np.asarray(value) * scale + 0.5).astype(np.int64)
+
+
+@functools.lru_cache(maxsize=None)
+def get_sheet_layout(
+    rect_margin: Margin,
+    row: int,
+    col: int,
+    cell_width: int,
+    cell_height: int,
+    cell_margin: Margin,
+    scale: float = 1.0,
+) -> SheetLayout:
+    """
+    配置を計算したSheetLayoutを返す。同じ引数なら同じインスタンスを返す
+
+    各セルの位置は、指定した寸法での位置を求めてから倍率を掛けて丸める
+    (余白やセルの大きさを別々に丸めると、誤差が行・列ごとに積み重なるため)
+    """
+    pitch_width = cell_margin.margin_left + cell_width + cell_margin.margin_right
+    pitch_height = cell_margin.margin_top + cell_height + cell_margin.margin_bottom
+    design_width = (
+        rect_margin.margin_left + col * pitch_width + rect_margin.margin_right
+    )
+    design_height = (
+        rect_margin.margin_top + row * pitch_height + rect_margin.margin_bottom
+    )
+    x0 = int(_scale_position(rect_margin.margin_left, scale))
+    y0 = int(_scale_position(rect_margin.margin_top, scale))
+    scaled_cell_width = int(_scale_position(cell_width, scale))
+    scaled_cell_height = int(_scale_position(cell_height, scale))
+
+    rows, cols = np.mgrid[0:row, 0:col]
+    cell_x = (
+        _scale_position(
+            rect_margin.margin_left + cols * pitch_width + cell_margin.margin_left,
+            scale,
+        )
+        - x0
+    )
+    cell_y = (
+        _scale_position(
+            rect_margin.margin_top + rows * pitch_height + cell_margin.margin_top,
+            scale,
+        )
+        - y0
+    )
+    # 丸めによってセルがはみ出さないようにする
+    region_width = max(
+        int(_scale_position(rect_margin.margin_left + col * pitch_width, scale)) - x0,
+        int(cell_x.max()) + scaled_cell_width,
+    )
+    region_height = max(
+        int(_scale_position(rect_margin.margin_top + row * pitch_height, scale)) - y0,
+        int(cell_y.max()) + scaled_cell_height,
+    )
+    layout_width = max(int(_scale_position(design_width, scale)), x0 + region_width)
+    layout_height = max(int(_scale_position(design_height, scale)), y0 + region_height)
+
+    cell_rects = np.stack(
+        [
+            cell_x,
+            cell_y,
+            np.full_like(cell_x, scaled_cell_width),
+            np.full_like(cell_y, scaled_cell_height),
+        ],
+        axis=-1,
+    )
+    cell_rects.setflags(write=False)
+    cell_slices = tuple(
+        tuple(
+            (slice(y, y + scaled_cell_height), slice(x, x + scaled_cell_width))
+            for x, y, _, _ in row_rects.tolist()
+        )
+        for row_rects in cell_rects
+    )
+    return SheetLayout(
+        row=row,
+        col=col,
+        scale=scale,
+        cell_width=scaled_cell_width,
+        cell_height=scaled_cell_height,
+        pitch=(pitch_width * scale, pitch_height * scale),
+        rect_margin=Margin(
+            y0,
+            x0,
+            layout_width - x0 - region_width,
+            layout_height - y0 - region_height,
+        ),
+        cell_margin=_scale_margin(cell_margin, scale),
+        layout_size=(layout_width, layout_height),
+        scaled_size=(design_width * scale, design_height * scale),
+        region_size=(region_width, region_height),
+        region_slice=(slice(y0, y0 + region_height), slice(x0, x0 + region_width)),
+        cell_rects=cell_rects,
+        cell_slices=cell_slices,
+    )
+
+
 class MarkseatReader:
     """
     マークシート画像を読み取り、マークされた列インデックスを検出・可視化するクラス
@@ -141,35 +522,126 @@ class MarkseatReader:
         cell_width: int,
         cell_height: int,
         cell_margin: Margin,
+        scale: float = 1.0,
     ):
-        self.offset_top = rect_margin.margin_top
-        self.offset_left = rect_margin.margin_left
-        self.offset_bottom = rect_margin.margin_bottom
-        self.offset_right = rect_margin.margin_right
+        """
+        :param scale: 作業解像度。寸法はすべてこの倍率を掛けて扱う (1.0で指定した寸法のまま)
+        """
+        self.scale = scale
+        self.layout = get_sheet_layout(
+            rect_margin, row, col, cell_width, cell_height, cell_margin, scale
+        )
+        self.offset_top = self.layout.rect_margin.margin_top
+        self.offset_left = self.layout.rect_margin.margin_left
+        self.offset_bottom = self.layout.rect_margin.margin_bottom
+        self.offset_right = self.layout.rect_margin.margin_right
 
         self.row = row
         self.col = col
-        self.cell_width = cell_width
-        self.cell_height = cell_height
-        self.cell_margin = cell_margin
+        self.cell_width = self.layout.cell_width
+        self.cell_height = self.layout.cell_height
+        self.cell_margin = self.layout.cell_margin
+        # 積分画像から各セルの画素値の和を求めるための、セルの四隅の添字 (行, 列)
+        self._cell_x0 = self.layout.cell_x0
+        self._cell_y0 = self.layout.cell_y0
+        self._cell_x1 = self.layout.cell_x1
+        self._cell_y1 = self.layout.cell_y1
 
     def read(self, src: np.ndarray) -> list[list[int]]:
         """
         マークシートを読み取り、各行のマークされた列インデックスのリストを返す
         """
-        resized = self._resize(src)
-        region = self._extract_region(resized)
-        binary = self._binarize_image(region)
-        return [self._analyze_row(binary, r) for r in range(self.row)]
+        return self._analyze_scores(self._score_cells(self._binarize_source(src)))
+
+    def read_warped(
+        self, gray: np.ndarray, homography: np.ndarray, rect_size: tuple[int, int]
+    ) -> list[list[int]]:
+        """
+        補正前の写真(グレースケール)から直接読み取る
+        補正後の長方形の画像を作らずに、1回のwarpPerspectiveでマーク領域だけを切り出す
+
+        :param homography: 写真 → 補正後の長方形 (rect_size) の射影変換行列
+        """
+        region = self.warp_region(gray, homography, rect_size)
+        return self._analyze_scores(self._score_cells(self._binarize_image(region)))
+
+    def warp_region(
+        self, gray: np.ndarray, homography: np.ndarray, rect_size: tuple[int, int]
+    ) -> np.ndarray:
+        """
+        写真から、_extract_region(_resize(補正後の画像)) に相当するマーク領域を切り出す
+        補正後の長方形 → レイアウトの大きさへの拡大と、マーク領域への平行移動を
+        射影変換に合成する
+        """
+        layout_width, layout_height = self.layout.scaled_size
+        to_region = np.array(
+            [
+                [layout_width / rect_size[0], 0, -self.offset_left],
+                [0, layout_height / rect_size[1], -self.offset_top],
+                [0, 0, 1],
+            ]
+        )
+        return cv2.warpPerspective(
+            gray, to_region @ homography, self.layout.region_size
+        )
+
+    def score(self, src: np.ndarray) -> np.ndarray:
+        """
+        各セルの塗りつぶし率 (二値化後に白になった画素の割合, 0~1) を (行, 列) の配列で返す
+        """
+        return self._score_cells(self._binarize_source(src)) / 255
+
+    @staticmethod
+    def row_confidence(scores: np.ndarray) -> np.ndarray:
+        """
+        各行の確信度 (最も塗られたセルと2番目のセルの塗りつぶし率の差, 0~1) を返す
+        1つだけはっきり塗られていれば1に近く、迷いや無回答の行は0に近い
+        """
+        if scores.shape[1] < 2:
+            return scores[:, 0].copy()
+        top2 = np.partition(scores, -2, axis=1)[:, -2:]
+        return top2[:, 1] - top2[:, 0]
 
     def create_mask(self, marked: list[list[int]]):
-        cell_width, cell_height = self._calculate_cell_size()
-        width = self.offset_left + self.col * cell_width + self.offset_right
-        height = self.offset_top + self.row * cell_height + self.offset_bottom
+        width, height = self._layout_size()
         mask = np.zeros((height, width), dtype=np.uint8)  # 黒背景
         drawn = self._draw_cells(mask, marked, thickness=-1, color=1)
         return drawn
 
+    def cell_polygons(
+        self, marked: list[list[int]], rect_size: tuple[int, int]
+    ) -> np.ndarray:
+        """
+        マークされたセルの四隅 (N, 4, 2) を、補正後の長方形 (rect_size) の座標で返す
+        頂点は左上から時計回り
+        """
+        cells = [
+            (row_index, col_index)
+            for row_index, col_indices in enumerate(marked)
+            for col_index in col_indices
+        ]
+        if not cells:
+            return np.empty((0, 4, 2), dtype=np.float32)
+        rows, cols = np.array(cells).T
+        rects = self.layout.cell_rects[rows, cols]
+        x0 = rects[:, 0] + self.offset_left
+        y0 = rects[:, 1] + self.offset_top
+        x1 = x0 + rects[:, 2]
+        y1 = y0 + rects[:, 3]
+        corners = np.stack(
+            [
+                np.stack([x0, y0], axis=-1),
+                np.stack([x1, y0], axis=-1),
+                np.stack([x1, y1], axis=-1),
+                np.stack([x0, y1], axis=-1),
+            ],
+            axis=1,
+        ).astype(np.float32)
+        layout_width, layout_height = self.layout.scaled_size
+        return corners * np.float32(
+            (rect_size[0] / layout_width, rect_size[1] / layout_height)
+        )
+
     def highlight_all_cells(self, src: np.ndarray) -> np.ndarray:
         """
         全セルの領域に枠線を描画してマーク位置を可視化する（確認用）
@@ -202,38 +674,43 @@ class MarkseatReader:
         :return: 描画済み画像
         """
         resized = self._resize(src)
+        rects = self.layout.cell_rects
         for row_index, col_indices in enumerate(marked):
             for col_index in col_indices:
-                top_left = self._get_cell_position(row_index, col_index)
-                bottom_right = (
-                    top_left[0] + self.cell_width,
-                    top_left[1] + self.cell_height,
-                )
+                x, y, width, height = rects[row_index, col_index].tolist()
+                top_left = (self.offset_left + x, self.offset_top + y)
+                bottom_right = (top_left[0] + width, top_left[1] + height)
                 cv2.rectangle(
                     resized, top_left, bottom_right, color=color, thickness=thickness
                 )
 
         return cv2.resize(resized, src.shape[::-1])
 
+    def _binarize_source(self, src: np.ndarray) -> np.ndarray:
+        """
+        補正済み画像からマーク領域を切り出し、セルごとに二値化する
+        """
+        resized = self._resize(src)
+        region = self._extract_region(resized)
+        return self._binarize_image(region)
+
     def _resize(self, src: np.ndarray) -> np.ndarray:
         """
         マーク領域が正確に収まるサイズに画像をリサイズする
         """
-        cell_width, cell_height = self._calculate_cell_size()
-        width = self.offset_left + self.col * cell_width + self.offset_right
-        height = self.offset_top + self.row * cell_height + self.offset_bottom
-        return cv2.resize(src, (width, height))
+        return cv2.resize(src, self.layout.layout_size)
+
+    def _layout_size(self) -> tuple[int, int]:
+        """
+        余白を含めたレイアウト全体の (幅, 高さ)
+        """
+        return self.layout.layout_size
 
     def _extract_region(self, src: np.ndarray) -> np.ndarray:
         """
         マーク部分だけを画像から切り出す
         """
-        cell_width, cell_height = self._calculate_cell_size()
-        x0 = self.offset_left
-        y0 = self.offset_top
-        x1 = x0 + self.col * cell_width
-        y1 = y0 + self.row * cell_height
-        return src[y0:y1, x0:x1]
+        return src[self.layout.region_slice]
 
     def _binarize_image(self, src: np.ndarray) -> np.ndarray:
         """
@@ -244,78 +721,54 @@ class MarkseatReader:
         """
         output = np.zeros_like(src)  # 全体を黒（0）で初期化
 
-        for row_index in range(self.row):
-            for col_index in range(self.col):
-                x, y = self._get_cell_position_in_rect(row_index, col_index)
-                cell = src[y : y + self.cell_height, x : x + self.cell_width]
+        for row_slices in self.layout.cell_slices:
+            for cell_slice in row_slices:
                 # TODO ガウスノイズかけてもいいかも
                 # セルごとにOtsuでしきい値処理（マーク＝白、背景＝黒）
-                _, cell_bin = cv2.threshold(
-                    cell, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU
+                # 出力画像の同じ位置に直接書き込む
+                cv2.threshold(
+                    src[cell_slice],
+                    0,
+                    255,
+                    cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU,
+                    dst=output[cell_slice],
                 )
 
-                # 出力画像に埋め込む
-                output[y : y + self.cell_height, x : x + self.cell_width] = cell_bin
-
         return output
 
-    def _analyze_row(self, binary: np.ndarray, row_index: int) -> list[int]:
+    def _score_cells(self, binary: np.ndarray) -> np.ndarray:
         """
-        1行分の各セルを平均輝度で分析し、マークされている列を返す
+        二値化画像の積分画像から、各セルの平均輝度を (行, 列) の配列で返す
+        セルの大きさに関係なく、1セルあたり4回の参照で求まる
         """
-        means = []
-        for col_index in range(self.col):
-            x, y = self._get_cell_position_in_rect(row_index, col_index)
-            cell = binary[y : y + self.cell_height, x : x + self.cell_width]
-            mean = cv2.mean(cell)[0]
-            means.append(mean)
+        # 画素値の和がint32に収まらない大きさの場合のみfloat64で計算する
+        sdepth = cv2.CV_32S if binary.size * 255 < 2**31 else cv2.CV_64F
+        integral = cv2.integral(binary, sdepth=sdepth)
+        sums = (
+            integral[self._cell_y1, self._cell_x1]
+            - integral[self._cell_y0, self._cell_x1]
+            - integral[self._cell_y1, self._cell_x0]
+            + integral[self._cell_y0, self._cell_x0]
+        )
+        return sums / (self.cell_width * self.cell_height)
 
-        threshold = sum(means) / len(means)
-        return [i for i, val in enumerate(means) if self._is_marked(val, threshold)]
+    def _analyze_scores(self, scores: np.ndarray) -> list[list[int]]:
+        """
+        各行について、平均より十分高い列をマークされた列として返す
+        """
+        thresholds = scores.sum(axis=1, keepdims=True) / self.col
+        marked = self._is_marked(scores, thresholds)
+        return [np.flatnonzero(row).tolist() for row in marked]
 
-    def _is_marked(self, value: float, threshold: float) -> bool:
+    def _is_marked(self, value, threshold):
         """
-        平均輝度が閾値の1.4倍より高ければマークされたとみなす
+        平均輝度が閾値の1.4倍より高ければマークされたとみなす (配列同士でもよい)
 
         TODO 複数回答の場合、良くない
         二値化しているし、絶対値でいってもよさげ
         """
         return value > threshold * 1.4
 
-    def _calculate_cell_size(self) -> tuple[int, int]:
-        """
-        セルサイズ（余白込み）を返す
-        """
-        cell_width = (
-            self.cell_margin.margin_left
-            + self.cell_width
-            + self.cell_margin.margin_right
-        )
-        cell_height = (
-            self.cell_margin.margin_top
-            + self.cell_height
-            + self.cell_margin.margin_bottom
-        )
-        return cell_width, cell_height
-
-    def _get_cell_position(self, row: int, col: int) -> tuple[int, int]:
-        """
-        指定したセルの左上座標を返す（リサイズ済み画像内）
-        """
-        x_in_rect, y_in_rect = self._get_cell_position_in_rect(row, col)
-        x = self.offset_left + x_in_rect
-        y = self.offset_top + y_in_rect
-        return x, y
-
-    def _get_cell_position_in_rect(self, row: int, col: int) -> tuple[int, int]:
-        """
-        指定したセルの左上座標を返す（切り抜き済み画像内）
-        """
-        cell_width, cell_height = self._calculate_cell_size()
-        x = col * cell_width + self.cell_margin.margin_left
-        y = row * cell_height + self.cell_margin.margin_top
-        return x, y
-
 
 def main():
     # 1160 245
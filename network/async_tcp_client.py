@@ -0,0 +1,138 @@
+import asyncio
+from typing import Callable, Optional
+from network.data.serializable_data import SerializableData
+from network.data.data_decoder import DataDecoder, DecodedData
+from network.data.envelope import (
+    ENVELOPE_VERSION,
+    LEGACY_VERSION,
+    ProtocolNegotiator,
+)
+from network.tcp_common import SendQueueStats, set_no_delay
+from network.async_tcp_common import AsyncSendQueue, EventLoopThread, notify
+
+
+class AsyncTCPClient:
+    """
+    asyncioのストリームで通信するTCPClient
+    送受信はloop_threadのイベントループで行い、TCPClientと同じ同期APIも持つ
+
+    dispatchを指定すると、コールバックはdispatch経由で呼び出される
+    (MainThreadDispatcher.callを渡せば、Tkのメインスレッドで呼び出される)
+    """
+
+    def __init__(
+        self,
+        decoder: DataDecoder,
+        loop_thread: EventLoopThread,
+        dispatch: Optional[Callable[..., None]] = None,
+        no_delay: bool = True,
+        send_queue_size: int = 256,
+        drop_oldest: bool = False,
+        protocol_version: int = LEGACY_VERSION,
+    ):
+        self._loop_thread = loop_thread
+        self._decoder: DataDecoder = decoder
+        self._dispatch = dispatch
+        self.no_delay = no_delay  # TrueならNagleアルゴリズムを無効にする
+        self.send_queue_size = send_queue_size
+        self.drop_oldest = drop_oldest  # Trueなら送信キューが一杯のとき古いメッセージを破棄する
+        # 2以上なら接続時にHelloを送り、相手も対応していればv2形式で送信する
+        self.protocol_version = protocol_version
+        self._negotiator: Optional[ProtocolNegotiator] = None
+        self._send_queue: Optional[AsyncSendQueue] = None
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._receive_task: Optional[asyncio.Task] = None
+        self._connected = False
+        self.on_receive: Callable[[DecodedData], None] = None
+        self.on_disconnected: Optional[Callable[[], None]] = None
+        self.on_connected: Optional[Callable[[], None]] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    @property
+    def send_queue_stats(self) -> Optional[SendQueueStats]:
+        send_queue = self._send_queue
+        return send_queue.stats if send_queue else None
+
+    def connect(
+        self,
+        host="127.0.0.1",
+        port=12345,
+    ) -> bool:
+        return self._loop_thread.run_sync(self.connect_async(host, port))
+
+    def disconnect(self):
+        self._loop_thread.run_sync(self.disconnect_async())
+
+    def send_data(self, data: SerializableData):
+        """
+        どのスレッドからでも呼べる。送信キューに積むだけで完了を待たない
+        """
+        self._loop_thread.submit(self.send(data))
+
+    async def connect_async(self, host="127.0.0.1", port=12345) -> bool:
+        if self.connected:
+            return False
+        try:
+            self._reader, self._writer = await asyncio.open_connection(host, port)
+        except OSError as e:
+            print(f"Connection failed: {e}")
+            notify(self._dispatch, self.on_disconnected)
+            return False
+        print("Connected to server")
+        set_no_delay(self._writer.get_extra_info("socket"), self.no_delay)
+        self._send_queue = AsyncSendQueue(
+            self._writer, self.send_queue_size, self.drop_oldest
+        )
+        self._negotiator = self._send_queue.create_negotiator(self.protocol_version)
+        self._connected = True
+        if self._decoder and (
+            self.on_receive or self.protocol_version >= ENVELOPE_VERSION
+        ):
+            self._receive_task = asyncio.create_task(self._receive())
+        self._negotiator.start()
+        notify(self._dispatch, self.on_connected)
+        return True
+
+    async def disconnect_async(self):
+        if not self.connected:
+            return
+        print("Disconnecting...")
+        self._connected = False
+        task = self._receive_task
+        self._receive_task = None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        self._send_queue.close()
+        self._send_queue = None
+        writer = self._writer
+        self._reader = None
+        self._writer = None
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        notify(self._dispatch, self.on_disconnected)
+
+    async def send(self, data: SerializableData):
+        """
+        イベントループ上から送信キューに積む。キューが一杯なら空きができるまで待つ
+        """
+        if self._send_queue is not None:
+            await self._send_queue.send(data)
+
+    async def _receive(self):
+        try:
+            while True:
+                data = await self._decoder.accept_async(self._reader)
+                if not self._negotiator.handle(data):
+                    notify(self._dispatch, self.on_receive, data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Receive error: {e}")
+            await self.disconnect_async()
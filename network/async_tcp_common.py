@@ -0,0 +1,207 @@
+import asyncio
+import concurrent.futures
+import dataclasses
+import threading
+from collections import deque
+from typing import Any, Callable, Coroutine, Optional
+from network.data.envelope import LEGACY_VERSION, ProtocolNegotiator
+from network.data.serializable_data import SerializableData
+from network.tcp_common import SendQueueStats, encode_buffers
+
+
+class EventLoopThread(threading.Thread):
+    """
+    asyncioのイベントループを回し続けるスレッド
+    画像受信サーバ、Unityとの接続など複数の接続を1つのスレッドでまとめて扱う
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._started.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def start(self):
+        super().start()
+        self._started.wait()
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """
+        コルーチンをイベントループで実行する (どのスレッドからでも呼べる)
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run_sync(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        コルーチンをイベントループで実行し、完了まで待つ
+        イベントループのスレッドから呼ぶとデッドロックするため禁止
+        """
+        if threading.current_thread() is self:
+            raise RuntimeError("run_sync() cannot be called from the event loop thread")
+        return self.submit(coro).result(timeout)
+
+    def call_soon(self, callback: Callable[..., None], *args):
+        """
+        コールバックをイベントループのスレッドで実行する (どのスレッドからでも呼べる)
+        """
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if threading.current_thread() is not self:
+            self.join()
+
+
+def notify(
+    dispatch: Optional[Callable[..., None]],
+    callback: Optional[Callable[..., None]],
+    *args,
+):
+    """
+    コールバックを呼び出す
+    dispatchが指定されていれば、dispatch経由で別スレッド(Tkのメインスレッドなど)に渡す
+    """
+    if callback is None:
+        return
+    if dispatch is None:
+        callback(*args)
+    else:
+        dispatch(callback, *args)
+
+
+class AsyncSendQueue:
+    """
+    1接続分の上限付き送信キューと、それを書き出すタスク (イベントループ上でのみ使う)
+    溜まった小さなメッセージは1回の書き込みにまとめる
+
+    上限に達した場合、drop_oldestなら破棄してよい最も古いメッセージを破棄し、
+    そうでなければ空きができるまでput()を待たせる
+    破棄してよくないメッセージ (droppable=False) は、上限に達していても待たずに追加し、破棄もしない
+    書き込みに失敗するかclose()すると閉じられ、待っているput()も以降のput()も
+    ConnectionErrorになる
+    """
+
+    def __init__(
+        self,
+        writer: asyncio.StreamWriter,
+        max_messages: int = 256,
+        drop_oldest: bool = False,
+        max_batch_bytes: int = 64 * 1024,
+    ):
+        self.max_messages = max_messages
+        self.drop_oldest = drop_oldest
+        self.max_batch_bytes = max_batch_bytes
+        self._writer = writer
+        # (バッファのリスト, 破棄してよいか)
+        self._messages: deque[tuple[list[bytes], bool]] = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._stats = SendQueueStats()
+        self._closed = False
+        self.protocol_version = LEGACY_VERSION
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def stats(self) -> SendQueueStats:
+        return dataclasses.replace(self._stats)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def put(self, buffers: list[bytes], droppable: bool = True):
+        while (
+            droppable
+            and not self._closed
+            and len(self._messages) >= self.max_messages
+        ):
+            if self.drop_oldest and self._drop_oldest():
+                continue
+            self._not_full.clear()
+            await self._not_full.wait()
+        if self._closed:
+            raise ConnectionError("Send queue is closed")
+        self._messages.append((buffers, droppable))
+        self._stats.depth = len(self._messages)
+        self._stats.max_depth = max(self._stats.max_depth, self._stats.depth)
+        self._not_empty.set()
+
+    async def send(self, data: SerializableData):
+        """
+        この接続のプロトコルバージョンでエンコードして積む
+        閉じられていれば積まずにメッセージを出す
+        """
+        try:
+            await self.put(
+                encode_buffers(data, self.protocol_version), data.droppable
+            )
+        except ConnectionError as e:
+            print(f"Failed to send data: {e}")
+
+    def create_negotiator(self, supported_version: int) -> ProtocolNegotiator:
+        """
+        Helloの送信と、ネゴシエーション結果の反映をこのキューで行うネゴシエータを返す
+        """
+        return ProtocolNegotiator(
+            supported_version,
+            lambda data: asyncio.ensure_future(self.send(data)),
+            lambda version: setattr(self, "protocol_version", version),
+        )
+
+    def _drop_oldest(self) -> bool:
+        """
+        破棄してよい最も古いメッセージを破棄する。なければFalseを返す
+        """
+        for index, (_, droppable) in enumerate(self._messages):
+            if droppable:
+                del self._messages[index]
+                self._stats.dropped += 1
+                return True
+        return False
+
+    def close(self):
+        self._task.cancel()
+        self._shutdown()
+
+    def _shutdown(self):
+        self._closed = True
+        self._messages.clear()
+        self._stats.depth = 0
+        # 空きを待っているput()を起こし、ConnectionErrorにする
+        self._not_full.set()
+
+    async def _run(self):
+        try:
+            while True:
+                await self._not_empty.wait()
+                batch: list[bytes] = []
+                size = 0
+                count = 0
+                while self._messages:
+                    message_size = sum(len(buffer) for buffer in self._messages[0][0])
+                    if count > 0 and size + message_size > self.max_batch_bytes:
+                        break
+                    batch.extend(self._messages.popleft()[0])
+                    size += message_size
+                    count += 1
+                if not self._messages:
+                    self._not_empty.clear()
+                self._stats.sent_messages += count
+                self._stats.writes += 1
+                self._stats.depth = len(self._messages)
+                self._not_full.set()
+                self._writer.writelines(batch)
+                await self._writer.drain()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Failed to send data: {e}")
+            self._shutdown()
@@ -0,0 +1,133 @@
+import asyncio
+from typing import Callable, Optional
+from network.data.serializable_data import SerializableData
+from network.data.data_decoder import DataDecoder, DecodedData
+from network.data.envelope import LEGACY_VERSION
+from network.tcp_common import SendQueueStats, encode_buffers, set_no_delay
+from network.async_tcp_common import AsyncSendQueue, EventLoopThread, notify
+
+
+class AsyncTCPServer:
+    """
+    asyncioのストリームで通信するTCPServer
+    全クライアントをloop_threadのイベントループで処理し、TCPServerと同じ同期APIも持つ
+
+    dispatchを指定すると、on_receiveはdispatch経由で呼び出される
+    """
+
+    def __init__(
+        self,
+        decoder: DataDecoder,
+        on_receive: Callable[[DecodedData], None],
+        loop_thread: EventLoopThread,
+        host="0.0.0.0",
+        port=12345,
+        dispatch: Optional[Callable[..., None]] = None,
+        no_delay: bool = True,
+        send_queue_size: int = 256,
+        drop_oldest: bool = False,
+        protocol_version: int = LEGACY_VERSION,
+    ):
+        self.host = host
+        self.port = port
+        self.decoder: DataDecoder = decoder
+        self.on_receive: Callable[[DecodedData], None] = on_receive
+        self._loop_thread = loop_thread
+        self._dispatch = dispatch
+        self.no_delay = no_delay  # Trueなら接続したソケットのNagleアルゴリズムを無効にする
+        self.send_queue_size = send_queue_size
+        self.drop_oldest = drop_oldest  # Trueなら送信キューが一杯のとき古いメッセージを破棄する
+        # 2以上ならHelloを送ってきたクライアントにはv2形式で送信する
+        self.protocol_version = protocol_version
+        self._server: Optional[asyncio.AbstractServer] = None
+        # クライアントごとの送信キュー (イベントループのスレッドのみ触る)
+        self._clients: dict[asyncio.StreamWriter, AsyncSendQueue] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    def start_server(self):
+        self._loop_thread.run_sync(self.start_async())
+
+    def stop_server(self):
+        self._loop_thread.run_sync(self.stop_async())
+
+    def send_all(self, data: SerializableData):
+        """
+        どのスレッドからでも呼べる。送信キューに積むだけで完了を待たない
+        """
+        self._loop_thread.submit(self.broadcast(data))
+
+    def send_queue_stats(self) -> dict[tuple, SendQueueStats]:
+        """
+        クライアントのアドレスごとの送信キューの統計
+        """
+        return {
+            writer.get_extra_info("peername"): send_queue.stats
+            for writer, send_queue in list(self._clients.items())
+        }
+
+    async def start_async(self):
+        self._server = await asyncio.start_server(
+            self._handle_client, self.host, self.port
+        )
+        print(f"Server started on {self.host}:{self.port}")
+
+    async def stop_async(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._clients):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+        print("Server stopped")
+
+    async def broadcast(self, data: SerializableData):
+        """
+        イベントループ上から全クライアントの送信キューに積む
+        キューが一杯のクライアントがあっても、他のクライアントへの送信は待たせない
+        """
+        send_queues = list(self._clients.values())
+        # エンコードはプロトコルバージョンごとに1回だけ行う
+        encoded = {
+            version: encode_buffers(data, version)
+            for version in {send_queue.protocol_version for send_queue in send_queues}
+        }
+        results = await asyncio.gather(
+            *(
+                send_queue.put(encoded[send_queue.protocol_version], data.droppable)
+                for send_queue in send_queues
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            # 書き込みに失敗して閉じたクライアントの分
+            if isinstance(result, Exception):
+                print(f"Failed to send data: {result}")
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        addr = writer.get_extra_info("peername")
+        print(f"Client connected from {addr}")
+        set_no_delay(writer.get_extra_info("socket"), self.no_delay)
+        send_queue = AsyncSendQueue(writer, self.send_queue_size, self.drop_oldest)
+        self._clients[writer] = send_queue
+        negotiator = send_queue.create_negotiator(self.protocol_version)
+        try:
+            while True:
+                data = await self.decoder.accept_async(reader)
+                if not negotiator.handle(data):
+                    notify(self._dispatch, self.on_receive, data)
+        except asyncio.IncompleteReadError:
+            pass
+        except Exception as e:
+            print(f"Receive error: {e}")
+        finally:
+            print(f"Client {addr} disconnected")
+            send_queue = self._clients.pop(writer, None)
+            if send_queue is not None:
+                send_queue.close()
+            writer.close()
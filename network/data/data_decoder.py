@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
-import socket
+import asyncio
 from typing import Any
+from network.data.frame_reader import FrameReader
 
 
 class DecodedData:
@@ -16,18 +17,46 @@ class DecodedData:
 
 
 class DataDecoder(ABC):
+    """
+    受信したバイト列から1メッセージ分を読み込んでデコードする
+    """
+
     @abstractmethod
-    def accept(
-        self,
-        sock: socket.socket,
-    ) -> DecodedData:
+    def accept(self, reader: FrameReader) -> DecodedData:
         pass
 
-    def _recv_all(self, sock: socket.socket, size, timeout=-1):
-        data = b""
-        while len(data) < size:
-            packet = sock.recv(size - len(data))
-            if not packet:
-                raise ConnectionError("Connection closed during recv")
-            data += packet
-        return data
+    @abstractmethod
+    async def accept_async(self, stream: asyncio.StreamReader) -> DecodedData:
+        """
+        accept() のasyncio版
+        """
+        pass
+
+
+class PayloadDataDecoder(DataDecoder):
+    """
+    4バイトの長さヘッダで区切られたペイロードをデコードするDataDecoder
+    ペイロードの長さが分かっていれば、decode() だけを直接呼んでもよい
+    """
+
+    def accept(self, reader: FrameReader) -> DecodedData:
+        """
+        4バイトの長さヘッダとペイロードを読み込み、decode() に渡す
+        """
+        size = reader.read_uint32()
+        return self.decode(reader.read_exact(size))
+
+    async def accept_async(self, stream: asyncio.StreamReader) -> DecodedData:
+        """
+        accept() のasyncio版
+        """
+        size = int.from_bytes(await stream.readexactly(4), byteorder="little")
+        return self.decode(memoryview(await stream.readexactly(size)))
+
+    @abstractmethod
+    def decode(self, payload: memoryview) -> DecodedData:
+        """
+        ペイロードをデコードする
+        payloadは受信バッファのスライスなので、保持する場合はコピーすること
+        """
+        pass
@@ -0,0 +1,190 @@
+import asyncio
+import struct
+from typing import Callable, Optional
+from network.data.data_decoder import DataDecoder, DecodedData, PayloadDataDecoder
+from network.data.frame_reader import FrameReader
+from network.data.serializable_data import SerializableData, get_type_id
+
+# v2形式のヘッダ: マジック, バージョン, フラグ, 型ID, ペイロード長
+ENVELOPE_HEADER = struct.Struct("<4sBBHI")
+ENVELOPE_MAGIC = b"EXTL"
+ENVELOPE_VERSION = 2
+# 名前ヘッダ + 長さヘッダの形式
+LEGACY_VERSION = 1
+
+# これより大きいペイロードは読み込まずに読み飛ばす
+DEFAULT_MAX_PAYLOAD_SIZE = 64 * 1024 * 1024
+
+HELLO_DATA_TYPE = "Hello"
+HELLO_DATA_TYPE_ID = 0
+
+
+class HelloData(SerializableData, type_id=HELLO_DATA_TYPE_ID):
+    """
+    対応しているプロトコルバージョンを相手に伝えるメッセージ
+    常にv2形式で送信する
+    """
+
+    def __init__(self, version: int = ENVELOPE_VERSION):
+        self.version = version
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.version])
+
+    def name(self) -> str:
+        return HELLO_DATA_TYPE
+
+
+class HelloDataDecoder(PayloadDataDecoder):
+    def decode(self, payload: memoryview) -> DecodedData:
+        return DecodedData(HELLO_DATA_TYPE, payload[0])
+
+
+# 型ごとにエンコード済みのv2ヘッダの先頭部分 (マジック, バージョン, フラグ, 型ID)
+_envelope_prefixes: dict[type, bytes] = {}
+
+
+def encode_envelope_buffers(data: SerializableData, flags: int = 0) -> list[bytes]:
+    """
+    (v2ヘッダ, データ) の順に送信するバッファのリストを返す
+    """
+    bytes_data = data.to_bytes()
+    prefix = _envelope_prefixes.get(type(data))
+    if prefix is None or flags != 0:
+        header = ENVELOPE_HEADER.pack(
+            ENVELOPE_MAGIC, ENVELOPE_VERSION, flags, get_type_id(data), len(bytes_data)
+        )
+        if flags == 0:
+            _envelope_prefixes[type(data)] = header[:-4]
+    else:
+        header = prefix + len(bytes_data).to_bytes(4, byteorder="little")
+    return [header, bytes_data]
+
+
+class EnvelopeDataDecoder(DataDecoder):
+    """
+    v2形式のメッセージを型IDでデコーダに振り分ける
+
+    マジックで始まらないメッセージはlegacy_decoderに任せるので、
+    レガシー形式の相手とも同じ接続で通信できる
+    (レガシー形式の先頭4バイトは長さで、マジックと一致するほど大きくはならない)
+
+    未知のバージョン・型IDやmax_payload_sizeを超えるメッセージは、中身を見ずに読み飛ばす
+    """
+
+    def __init__(
+        self,
+        decoders: dict[int, PayloadDataDecoder],
+        legacy_decoder: Optional[DataDecoder] = None,
+        max_payload_size: int = DEFAULT_MAX_PAYLOAD_SIZE,
+    ):
+        self.decoders = {HELLO_DATA_TYPE_ID: HelloDataDecoder(), **decoders}
+        self.legacy_decoder = legacy_decoder
+        self.max_payload_size = max_payload_size
+        self.skipped = 0  # 読み飛ばしたメッセージ数
+
+    def accept(self, reader: FrameReader) -> DecodedData:
+        while True:
+            if reader.peek(len(ENVELOPE_MAGIC)) != ENVELOPE_MAGIC:
+                return self._accept_legacy(reader)
+            _, version, flags, type_id, size = reader.read_struct(ENVELOPE_HEADER)
+            decoder = self._get_decoder(version, type_id, size)
+            if decoder is None:
+                reader.skip(size)
+                continue
+            return decoder.decode(reader.read_exact(size))
+
+    async def accept_async(self, stream: asyncio.StreamReader) -> DecodedData:
+        while True:
+            magic = await stream.readexactly(len(ENVELOPE_MAGIC))
+            if magic != ENVELOPE_MAGIC:
+                if self.legacy_decoder is None:
+                    raise Exception("Legacy format is not supported.")
+                return await self.legacy_decoder.accept_async(
+                    _PrefixedStream(magic, stream)
+                )
+            rest = await stream.readexactly(ENVELOPE_HEADER.size - len(magic))
+            _, version, flags, type_id, size = ENVELOPE_HEADER.unpack(magic + rest)
+            decoder = self._get_decoder(version, type_id, size)
+            if decoder is None:
+                while size > 0:
+                    chunk = await stream.read(min(size, 64 * 1024))
+                    if not chunk:
+                        raise asyncio.IncompleteReadError(b"", size)
+                    size -= len(chunk)
+                continue
+            return decoder.decode(memoryview(await stream.readexactly(size)))
+
+    def _accept_legacy(self, reader: FrameReader) -> DecodedData:
+        if self.legacy_decoder is None:
+            raise Exception("Legacy format is not supported.")
+        return self.legacy_decoder.accept(reader)
+
+    def _get_decoder(
+        self, version: int, type_id: int, size: int
+    ) -> Optional[PayloadDataDecoder]:
+        decoder = self.decoders.get(type_id) if version == ENVELOPE_VERSION else None
+        if decoder is None or size > self.max_payload_size:
+            print(f"Skip message: version={version}, type_id={type_id}, size={size}")
+            self.skipped += 1
+            return None
+        return decoder
+
+
+class _PrefixedStream:
+    """
+    先読みしたバイト列を先頭に戻したStreamReaderとして振る舞う (readexactlyのみ)
+    """
+
+    def __init__(self, prefix: bytes, stream: asyncio.StreamReader):
+        self._prefix = prefix
+        self._stream = stream
+
+    async def readexactly(self, n: int) -> bytes:
+        if not self._prefix:
+            return await self._stream.readexactly(n)
+        head = self._prefix[:n]
+        self._prefix = self._prefix[n:]
+        if len(head) == n:
+            return head
+        return head + await self._stream.readexactly(n - len(head))
+
+
+class ProtocolNegotiator:
+    """
+    1接続分のプロトコルバージョンのネゴシエーション
+
+    supported_versionが2以上のとき、接続した側がstart()でHelloを送り、
+    Helloを受け取った側は対応していればHelloを返す
+    お互いのHelloを受け取るまでは、レガシー形式で送信する
+    """
+
+    def __init__(
+        self,
+        supported_version: int,
+        send: Callable[[SerializableData], None],
+        set_version: Callable[[int], None],
+    ):
+        self.supported_version = supported_version
+        self.version = LEGACY_VERSION
+        self._send = send
+        self._set_version = set_version
+        self._hello_sent = False
+
+    def start(self):
+        if self.supported_version >= ENVELOPE_VERSION:
+            self._hello_sent = True
+            self._send(HelloData(self.supported_version))
+
+    def handle(self, data: DecodedData) -> bool:
+        """
+        Helloなら処理してTrueを返す
+        """
+        if data.get_name() != HELLO_DATA_TYPE:
+            return False
+        if self.supported_version >= ENVELOPE_VERSION:
+            if not self._hello_sent:
+                self.start()
+            self.version = min(data.get_data(), self.supported_version)
+            self._set_version(self.version)
+        return True
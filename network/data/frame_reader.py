@@ -0,0 +1,195 @@
+import socket
+import struct
+
+DEFAULT_BUFFER_SIZE = 256 * 1024
+
+_UINT32 = struct.Struct("<I")
+
+
+class IncompleteFrame(Exception):
+    """
+    ノンブロッキングモードで、メッセージの続きがまだ届いていないことを表す
+    """
+
+
+class FrameReader:
+    """
+    ソケットから事前確保したバッファへrecv_intoで受信し、デコーダへ切り出して渡すクラス
+    接続ごとに1つ生成する
+
+    read_exact() が返す memoryview はバッファのゼロコピーなスライスであり、
+    次の読み込みを行うまでの間のみ有効
+
+    blocking=Falseの場合は自身では受信せず、receive() で受信したデータだけを読む
+    データが足りなければ IncompleteFrame を送出するので、begin() で記録した
+    メッセージ先頭まで rollback() し、次の受信後にデコードをやり直す
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        blocking: bool = True,
+    ):
+        self.sock = sock
+        self.blocking = blocking
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # 未読データの先頭
+        self._end = 0  # 受信済みデータの末尾
+        self._mark = 0  # デコード中のメッセージの先頭
+        self._wanted = 0  # デコードの再開に必要な、メッセージ先頭からのバイト数
+        self._discard = 0  # skip()で読み飛ばす、まだ受信していないバイト数
+
+    @property
+    def buffered(self) -> int:
+        """
+        受信済みで未読のバイト数
+        """
+        return self._end - self._start
+
+    @property
+    def ready(self) -> bool:
+        """
+        前回のデコードで不足していた分を受信し終えたか
+        """
+        return (
+            self._discard == 0
+            and self.buffered > 0
+            and self._end - self._mark >= self._wanted
+        )
+
+    def begin(self):
+        """
+        メッセージのデコードを開始する位置を記録する
+        """
+        self._mark = self._start
+
+    def rollback(self):
+        """
+        begin() で記録した位置まで読み込み位置を戻す
+        """
+        self._start = self._mark
+
+    def read_exact(self, size: int) -> memoryview:
+        """
+        sizeバイトを読み込み、バッファのスライスを返す
+        """
+        self._fill(size)
+        start = self._start
+        self._start += size
+        return self._view[start : self._start]
+
+    def read_bytes(self, size: int) -> bytes:
+        """
+        sizeバイトを読み込み、コピーして返す
+        """
+        return bytes(self.read_exact(size))
+
+    def peek(self, size: int) -> memoryview:
+        """
+        sizeバイトを読み込み位置を進めずに返す
+        """
+        self._fill(size)
+        return self._view[self._start : self._start + size]
+
+    def read_struct(self, header: struct.Struct) -> tuple:
+        """
+        固定長ヘッダを1回のunpack_fromで読み込む
+        """
+        self._fill(header.size)
+        values = header.unpack_from(self._buffer, self._start)
+        self._start += header.size
+        return values
+
+    def skip(self, size: int):
+        """
+        sizeバイトを中身を見ずに読み飛ばす
+        バッファに入りきらない大きさでもバッファを拡張せず、受信した端から捨てる
+        ノンブロッキングモードでは、ここまでのデコードを確定させてから残りを捨てる
+        """
+        available = min(self.buffered, size)
+        self._start += available
+        remaining = size - available
+        if remaining == 0:
+            return
+        self._start = self._end = 0
+        if not self.blocking:
+            self._mark = 0
+            self._wanted = 0
+            self._discard = remaining
+            raise IncompleteFrame()
+        while remaining > 0:
+            received = self.sock.recv_into(
+                self._view[: min(remaining, len(self._buffer))]
+            )
+            if received == 0:
+                raise ConnectionError("Connection closed during recv")
+            remaining -= received
+
+    def read_uint32(self) -> int:
+        """
+        リトルエンディアンの4バイト整数ヘッダを読み込む
+        """
+        self._fill(_UINT32.size)
+        (value,) = _UINT32.unpack_from(self._buffer, self._start)
+        self._start += _UINT32.size
+        return value
+
+    def receive(self) -> int:
+        """
+        ノンブロッキングモード用
+        ソケットから現在受信できる分を受信し、受信したバイト数を返す
+        """
+        needed = max(self._wanted, self._end - self._mark + 1)
+        if len(self._buffer) - self._mark < needed or self._end == len(self._buffer):
+            self._make_room(self._mark, needed)
+        try:
+            received = self.sock.recv_into(self._view[self._end :])
+        except BlockingIOError:
+            return 0
+        if received == 0:
+            raise ConnectionError("Connection closed during recv")
+        self._end += received
+        if self._discard > 0:
+            discarded = min(self._discard, self.buffered)
+            self._start += discarded
+            self._mark = self._start
+            self._discard -= discarded
+        return received
+
+    def _fill(self, size: int):
+        """
+        未読データがsizeバイト以上になるまで受信する
+        """
+        if self.buffered >= size:
+            self._wanted = 0
+            return
+        if not self.blocking:
+            self._wanted = self._start - self._mark + size
+            raise IncompleteFrame()
+        if len(self._buffer) - self._start < size:
+            self._make_room(self._start, size)
+        while self.buffered < size:
+            received = self.sock.recv_into(self._view[self._end :])
+            if received == 0:
+                raise ConnectionError("Connection closed during recv")
+            self._end += received
+
+    def _make_room(self, keep_from: int, size: int):
+        """
+        keep_from以降のデータを先頭へ詰め、sizeバイト入らなければバッファを拡張する
+        拡張時は新しいバッファを確保するため、返却済みのスライスは古いバッファを参照し続ける
+        """
+        remaining = self._end - keep_from
+        if size <= len(self._buffer):
+            self._view[:remaining] = self._view[keep_from : self._end]
+        else:
+            buffer = bytearray(max(size, len(self._buffer) * 2))
+            view = memoryview(buffer)
+            view[:remaining] = self._view[keep_from : self._end]
+            self._buffer = buffer
+            self._view = view
+        self._start -= keep_from
+        self._mark = max(self._mark - keep_from, 0)
+        self._end = remaining
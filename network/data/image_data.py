@@ -1,18 +1,47 @@
 from network.data.serializable_data import SerializableData
-from network.data.data_decoder import DataDecoder, DecodedData
-import socket
+from network.data.data_decoder import DecodedData, PayloadDataDecoder
 from PIL import Image
+from typing import Optional
+import hashlib
 import io
 
 IMAGE_DATA_TYPE = "ImageData"
+IMAGE_DATA_TYPE_ID = 2
+# デコードした画像のinfoに入れる、受信したバイト列のハッシュ
+CONTENT_HASH_INFO = "content_hash"
 
 
-class ImageDataDecoder(DataDecoder):
-    def accept(self, sock: socket.socket) -> DecodedData:
-        size_header = self._recv_all(sock, 4)
-        size = int.from_bytes(size_header, byteorder="little")
-        print(size)
-        data = self._recv_all(sock, size)
-        image = Image.open(io.BytesIO(data))
+def content_hash(data) -> str:
+    """
+    画像のバイト列 (bytes, memoryview) のハッシュ。同じ画像かどうかの判定に使う
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ImageDataDecoder(PayloadDataDecoder):
+    def __init__(self, decode_size: Optional[int] = None):
+        """
+        :param decode_size: 指定すると、JPEGは長辺がこの画素数以上になる範囲で
+            DCTの段階で縮小 (1/2, 1/4, 1/8) してデコードする。Noneなら元の解像度
+        """
+        self.decode_size = decode_size
+
+    def decode(self, payload: memoryview) -> DecodedData:
+        print(len(payload))
+        # Image.openは遅延読み込みなので、受信バッファから切り離しておく
+        image = Image.open(io.BytesIO(bytes(payload)))
+        # 同じ画像が再送されたときに認識結果を使い回せるよう、内容のハッシュを付けておく
+        image.info[CONTENT_HASH_INFO] = content_hash(payload)
+        if self.decode_size is not None:
+            self._draft(image)
         print("decoded")
         return DecodedData(IMAGE_DATA_TYPE, image)
+
+    def _draft(self, image: Image.Image):
+        """
+        画素を読み込む前に、縮小してデコードするよう設定する (JPEG以外では何もしない)
+        縦長・横長どちらの画像でも長辺で判断するよう、画像と同じ向きの大きさを渡す
+        """
+        width, height = image.size
+        scale = min(1.0, self.decode_size / max(width, height))
+        image.draft(image.mode, (round(width * scale), round(height * scale)))
@@ -1,7 +1,8 @@
 from network.data.data_decoder import DataDecoder, DecodedData
 from network.data.serializable_data import SerializableData
-import socket
+from network.data.frame_reader import FrameReader
 from typing import Any
+import asyncio
 
 MULTI_TYPE_DATA = "MultiTypeData"
 
@@ -11,14 +12,21 @@ class MultiTypeDataDecoder(DataDecoder):
     def __init__(self, decoders: dict[str, DataDecoder]):
         self.decoders = decoders
 
-    def accept(self, sock: socket) -> DecodedData:
-        size_header = self._recv_all(sock, 4)
-        size = int.from_bytes(size_header, byteorder="little")
-        name = self._recv_all(sock, size).decode()
+    def accept(self, reader: FrameReader) -> DecodedData:
+        size = reader.read_uint32()
+        name = str(reader.read_exact(size), "utf-8")
         decoder = self.decoders.get(name)
         if decoder is None:
             raise Exception("Decoder does not found.")
-        return decoder.accept(sock)
+        return decoder.accept(reader)
+
+    async def accept_async(self, stream: asyncio.StreamReader) -> DecodedData:
+        size = int.from_bytes(await stream.readexactly(4), byteorder="little")
+        name = (await stream.readexactly(size)).decode()
+        decoder = self.decoders.get(name)
+        if decoder is None:
+            raise Exception("Decoder does not found.")
+        return await decoder.accept_async(stream)
 
 
 class MultiTypeData(SerializableData):
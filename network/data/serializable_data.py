@@ -1,7 +1,36 @@
 from abc import ABC, abstractmethod
+from typing import Optional, Union
+
+# v2形式で使う型ID (SerializableDataのクラス → 型ID)
+_type_ids: dict[type, int] = {}
 
 
 class SerializableData(ABC):
+    """
+    v2形式で送信するクラスは、定義するときに型IDを登録する
+        class StringData(SerializableData, type_id=STRING_DATA_TYPE_ID): ...
+    """
+
+    # Trueなら送信キューが一杯のとき破棄してよい (画像などの大きなデータ)
+    # Falseのデータ (Unityへのコマンドなど) は上限を超えてもキューに積む
+    droppable = False
+
+    def __init_subclass__(cls, type_id: Optional[int] = None, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if type_id is None:
+            return
+        for registered, registered_id in _type_ids.items():
+            # 同じクラスの再定義 (モジュールの再読み込み) は上書きする
+            same_class = (registered.__module__, registered.__qualname__) == (
+                cls.__module__,
+                cls.__qualname__,
+            )
+            if registered_id == type_id and not same_class:
+                raise ValueError(
+                    f"type_id {type_id} is already used by {registered.__name__}"
+                )
+        _type_ids[cls] = type_id
+
     @abstractmethod
     def to_bytes(self) -> bytes:
         pass
@@ -9,3 +38,14 @@ class SerializableData(ABC):
     @abstractmethod
     def name(self) -> str:
         pass
+
+
+def get_type_id(data: Union[SerializableData, type]) -> int:
+    """
+    登録されている型IDを返す。登録されていなければKeyError
+    """
+    cls = data if isinstance(data, type) else type(data)
+    type_id = _type_ids.get(cls)
+    if type_id is None:
+        raise KeyError(f"{cls.__name__} has no type_id for the v2 format")
+    return type_id
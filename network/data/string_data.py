@@ -1,12 +1,12 @@
 from network.data.serializable_data import SerializableData
-from network.data.data_decoder import DataDecoder, DecodedData
-import socket
+from network.data.data_decoder import DecodedData, PayloadDataDecoder
 
 
 STRING_DATA_TYPE = "StringData"
+STRING_DATA_TYPE_ID = 1
 
 
-class StringData(SerializableData):
+class StringData(SerializableData, type_id=STRING_DATA_TYPE_ID):
 
     def __init__(self, message: str):
         self.message = message
@@ -18,9 +18,6 @@ class StringData(SerializableData):
         return STRING_DATA_TYPE
 
 
-class StringDataDecoder(DataDecoder):
-    def accept(self, sock: socket.socket) -> DecodedData:
-        size_header = self._recv_all(sock, 4)
-        size = int.from_bytes(size_header, byteorder="little")
-        message = self._recv_all(sock, size).decode()
-        return DecodedData(STRING_DATA_TYPE, message)
+class StringDataDecoder(PayloadDataDecoder):
+    def decode(self, payload: memoryview) -> DecodedData:
+        return DecodedData(STRING_DATA_TYPE, str(payload, "utf-8"))
@@ -5,18 +5,38 @@ from typing import Callable, Optional
 from network.data.multi_type_data_decoder import MultiTypeDataDecoder
 from network.data.string_data import StringData, STRING_DATA_TYPE, StringDataDecoder
 from network.data.data_decoder import DataDecoder, DecodedData
-from network.tcp_common import DataReceiver, DataSender
+from network.data.envelope import ENVELOPE_VERSION, LEGACY_VERSION, ProtocolNegotiator
+from network.tcp_common import (
+    DataReceiver,
+    QueuedDataSender,
+    SendQueueStats,
+    set_no_delay,
+)
 
 
 class TCPClient:
-    def __init__(self, decoder: DataDecoder):
+    def __init__(
+        self,
+        decoder: DataDecoder,
+        no_delay: bool = True,
+        send_queue_size: int = 256,
+        drop_oldest: bool = False,
+        protocol_version: int = LEGACY_VERSION,
+    ):
         self._sock: Optional[socket.socket] = None
         self._connected = False
         self._lock = threading.Lock()
         self._sender_lock = threading.Lock()
-        self._sender: Optional[DataSender] = None
+        self._sender: Optional[QueuedDataSender] = None
         self._receiver: Optional[DataReceiver] = None
         self._decoder: DataDecoder = decoder
+        self.no_delay = no_delay  # TrueならNagleアルゴリズムを無効にする
+        self.send_queue_size = send_queue_size
+        self.drop_oldest = drop_oldest  # Trueなら送信キューが一杯のとき古いメッセージを破棄する
+        # 2以上なら接続時にHelloを送り、相手も対応していればv2形式で送信する
+        # (decoderはHelloを読めるEnvelopeDataDecoderにすること)
+        self.protocol_version = protocol_version
+        self._negotiator: Optional[ProtocolNegotiator] = None
         self.on_receive: Callable[[DecodedData], None] = None
         self.on_disconnected: Optional[Callable[[], None]] = None
         self.on_connected: Optional[Callable[[], None]] = None
@@ -25,6 +45,11 @@ class TCPClient:
     def connected(self) -> bool:
         return self._connected
 
+    @property
+    def send_queue_stats(self) -> Optional[SendQueueStats]:
+        sender = self._sender
+        return sender.stats if sender else None
+
     def connect(
         self,
         host="127.0.0.1",
@@ -37,15 +62,27 @@ class TCPClient:
             try:
                 self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self._sock.connect((host, port))
+                set_no_delay(self._sock, self.no_delay)
                 print("Connected to server")
                 self._connected = True
-                self._sender = DataSender(self._sock)
+                sender = QueuedDataSender(
+                    self._sock, self.send_queue_size, self.drop_oldest
+                )
+                self._sender = sender
+                self._negotiator = ProtocolNegotiator(
+                    self.protocol_version,
+                    sender.send,
+                    lambda version: setattr(sender, "protocol_version", version),
+                )
                 # Start receiver thread
-                if self.on_receive and self._decoder:
+                if self._decoder and (
+                    self.on_receive or self.protocol_version >= ENVELOPE_VERSION
+                ):
                     self._receiver = DataReceiver(
-                        self._sock, self._decoder, self.on_receive, self.disconnect
+                        self._sock, self._decoder, self._on_receive, self.disconnect
                     )
                     self._receiver.start()
+                self._negotiator.start()
                 if self.on_connected is not None:
                     self.on_connected()
                 return True
@@ -64,11 +101,14 @@ class TCPClient:
                 self._receiver.stop()
                 self._receiver = None
 
+            if self._sender:
+                self._sender.stop()
+                self._sender = None
+
             if self._sock:
                 self._sock.close()
                 self._sock = None
             self._connected = False
-            self._sender = None
             if self.on_disconnected is not None:
                 self.on_disconnected()
 
@@ -77,6 +117,13 @@ class TCPClient:
             if self._sender:
                 self._sender.send(data)
 
+    def _on_receive(self, data: DecodedData):
+        negotiator = self._negotiator
+        if negotiator is not None and negotiator.handle(data):
+            return
+        if self.on_receive is not None:
+            self.on_receive(data)
+
 
 def on_receive(decodedData: DecodedData):
     if decodedData.get_name() == STRING_DATA_TYPE:
@@ -1,32 +1,298 @@
 import socket
 import threading
+import dataclasses
+from collections import deque
 from network.data.serializable_data import SerializableData
-from typing import Callable
+from typing import Callable, Optional
 from network.data.data_decoder import DataDecoder, DecodedData
-import select
+from network.data.frame_reader import FrameReader
+from network.data.envelope import (
+    ENVELOPE_VERSION,
+    LEGACY_VERSION,
+    HelloData,
+    encode_envelope_buffers,
+)
+import selectors
+
+
+# 型ごとにエンコード済みの名前ヘッダ (名前の長さ + 名前)
+# name() はクラスごとに固定の文字列を返す前提
+_type_headers: dict[type, bytes] = {}
+
+
+def get_type_header(data: SerializableData) -> bytes:
+    """
+    名前の長さと名前をエンコードしたヘッダを返す (クラスごとにキャッシュする)
+    """
+    header = _type_headers.get(type(data))
+    if header is None:
+        encoded = data.name().encode()
+        header = len(encoded).to_bytes(4, byteorder="little") + encoded
+        _type_headers[type(data)] = header
+    return header
+
+
+def encode_buffers(
+    data: SerializableData, version: int = LEGACY_VERSION
+) -> list[bytes]:
+    """
+    送信するバッファのリストを返す
+    レガシー形式では (名前ヘッダ, データの長さ, データ)、v2形式では (v2ヘッダ, データ)
+    HelloDataは常にv2形式
+    """
+    if version >= ENVELOPE_VERSION or isinstance(data, HelloData):
+        return encode_envelope_buffers(data)
+    bytes_data = data.to_bytes()
+    return [
+        get_type_header(data),
+        len(bytes_data).to_bytes(4, byteorder="little"),
+        bytes_data,
+    ]
+
+
+def encode_data(data: SerializableData, version: int = LEGACY_VERSION) -> bytes:
+    """
+    DataSender.send() と同じ形式にエンコードする
+    """
+    return b"".join(encode_buffers(data, version))
+
+
+def set_no_delay(sock: socket.socket, enabled: bool):
+    """
+    Nagleアルゴリズムの有効・無効を切り替える
+    無効にすると、小さなコマンドがカーネル内で待たされずにすぐ送信される
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if enabled else 0)
+
+
+# 1回のsendmsgに渡すバッファ数の上限 (IOV_MAXより小さくする)
+_MAX_IOV = 512
+
+
+def send_buffers(sock: socket.socket, buffers: list[bytes]):
+    """
+    複数のバッファを1回のsendmsgでまとめて送信する
+    sendmsgがない環境(Windows)では連結してsendallする
+    """
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(b"".join(buffers))
+        return
+    views = [memoryview(buffer) for buffer in buffers if buffer]
+    while views:
+        sent = sock.sendmsg(views[:_MAX_IOV])
+        consume_views(views, sent)
+
+
+def send_views(sock: socket.socket, views: list[memoryview]) -> int:
+    """
+    バッファを1回の書き込みで送信できるだけ送信し、送信したバイト数を返す
+    """
+    if hasattr(sock, "sendmsg"):
+        return sock.sendmsg(views[:_MAX_IOV])
+    return sock.send(b"".join(views))
+
+
+def consume_views(views: list[memoryview], sent: int):
+    """
+    送信済みのsentバイトをviewsの先頭から取り除く
+    """
+    while sent > 0:
+        if sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        else:
+            views[0] = views[0][sent:]
+            sent = 0
+
+
+@dataclasses.dataclass
+class SendQueueStats:
+    """
+    送信キューの統計
+    """
+
+    depth: int = 0  # 現在の送信待ちメッセージ数
+    max_depth: int = 0  # 送信待ちメッセージ数の最大値
+    sent_messages: int = 0  # 送信したメッセージ数
+    writes: int = 0  # 書き込み回数 (まとめて送ったメッセージは1回と数える)
+    dropped: int = 0  # drop_oldestで破棄したメッセージ数
+    rejected: int = 0  # キューが一杯で追加しなかったメッセージ数 (blockしないput)
+
+
+class SendQueue:
+    """
+    1接続分の送信待ちメッセージを保持する上限付きキュー (スレッドセーフ)
+
+    上限に達した場合、drop_oldestなら破棄してよい最も古いメッセージを破棄し、
+    そうでなければput(block=True)は空きができるまで待ち、
+    put(block=False)は新しいメッセージを追加せずにrejectedに数える
+    破棄してよくないメッセージ (droppable=False) は、上限に達していても待たずに追加し、破棄もしない
+    """
+
+    def __init__(self, max_messages: int = 256, drop_oldest: bool = False):
+        self.max_messages = max_messages
+        self.drop_oldest = drop_oldest
+        # (バッファのリスト, 破棄してよいか)
+        self._messages: deque[tuple[list[bytes], bool]] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = SendQueueStats()
+
+    @property
+    def stats(self) -> SendQueueStats:
+        with self._cond:
+            return dataclasses.replace(self._stats)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put(
+        self, buffers: list[bytes], block: bool = True, droppable: bool = True
+    ) -> bool:
+        """
+        メッセージ(encode_buffers()の結果)を追加する
+        閉じられている場合と、blockせずに追加できなかった場合はFalseを返す
+        """
+        with self._cond:
+            while (
+                droppable
+                and not self._closed
+                and len(self._messages) >= self.max_messages
+            ):
+                if self.drop_oldest and self._drop_oldest():
+                    continue
+                if not block:
+                    self._stats.rejected += 1
+                    return False
+                self._cond.wait()
+            if self._closed:
+                return False
+            self._messages.append((buffers, droppable))
+            self._stats.depth = len(self._messages)
+            self._stats.max_depth = max(self._stats.max_depth, self._stats.depth)
+            self._cond.notify_all()
+            return True
+
+    def take_batch(self, max_bytes: int, block: bool = True) -> list[bytes]:
+        """
+        送信待ちのメッセージを合計max_bytesまでまとめて取り出し、バッファのリストを返す
+        (先頭のメッセージがmax_bytesより大きい場合はそれだけを返す)
+        blockならメッセージが来るまで待つ。閉じられている場合は空のリストを返す
+        """
+        with self._cond:
+            while block and not self._messages and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return []
+            batch: list[bytes] = []
+            size = 0
+            count = 0
+            while self._messages:
+                message_size = sum(len(buffer) for buffer in self._messages[0][0])
+                if count > 0 and size + message_size > max_bytes:
+                    break
+                batch.extend(self._messages.popleft()[0])
+                size += message_size
+                count += 1
+            if count > 0:
+                self._stats.sent_messages += count
+                self._stats.writes += 1
+                self._stats.depth = len(self._messages)
+                self._cond.notify_all()
+            return batch
+
+    def _drop_oldest(self) -> bool:
+        """
+        破棄してよい最も古いメッセージを破棄する。なければFalseを返す
+        """
+        for index, (_, droppable) in enumerate(self._messages):
+            if droppable:
+                del self._messages[index]
+                self._stats.dropped += 1
+                return True
+        return False
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._messages.clear()
+            self._stats.depth = 0
+            self._cond.notify_all()
 
 
 class DataSender:
     def __init__(self, sock: socket.socket):
         self.sock = sock
         self.lock = threading.Lock()
+        self.protocol_version = LEGACY_VERSION
 
     def send(self, data: SerializableData):
         try:
+            buffers = encode_buffers(data, self.protocol_version)
             with self.lock:
-                # TODO length dataに変更
-                encoded = data.name().encode()
-                size = len(encoded)
-                size_header = size.to_bytes(4, byteorder="little")
-                self.sock.sendall(size_header)
-                self.sock.sendall(encoded)
-                bytes_data = data.to_bytes()
-                size_header = len(bytes_data).to_bytes(4, byteorder="little")
-                self.sock.sendall(size_header)
-                self.sock.sendall(bytes_data)
+                send_buffers(self.sock, buffers)
+        except Exception as e:
+            print(f"Failed to send data: {e}")
+
+
+class QueuedDataSender:
+    """
+    DataSenderと同じsend()を持つが、送信キューに積むだけで呼び出し元をブロックしない
+    実際の送信は接続ごとの書き込みスレッドが行い、溜まった小さなメッセージは1回の書き込みにまとめる
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        max_messages: int = 256,
+        drop_oldest: bool = False,
+        max_batch_bytes: int = 64 * 1024,
+    ):
+        self.sock = sock
+        self.queue = SendQueue(max_messages, drop_oldest)
+        self.max_batch_bytes = max_batch_bytes
+        self.protocol_version = LEGACY_VERSION
+        try:
+            self.peer: Optional[tuple] = sock.getpeername()
+        except OSError:
+            self.peer = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def stats(self) -> SendQueueStats:
+        return self.queue.stats
+
+    def send(self, data: SerializableData):
+        try:
+            # Tkのスレッドから呼ばれるので、キューが一杯でも待たない
+            # (破棄してよいデータだけを、stats.rejectedに数えて捨てる)
+            buffers = encode_buffers(data, self.protocol_version)
+            if not self.queue.put(buffers, block=False, droppable=data.droppable):
+                if not self.queue.closed:
+                    print(f"Send queue is full, dropped {data.name()}")
         except Exception as e:
             print(f"Failed to send data: {e}")
 
+    def stop(self):
+        """
+        送信待ちのメッセージを破棄して書き込みスレッドを止める
+        """
+        self.queue.close()
+
+    def _run(self):
+        while True:
+            batch = self.queue.take_batch(self.max_batch_bytes)
+            if not batch:
+                break
+            try:
+                send_buffers(self.sock, batch)
+            except OSError as e:
+                print(f"Failed to send data: {e}")
+                self.queue.close()
+                break
+
 
 class DataReceiver(threading.Thread):
     def __init__(
@@ -38,22 +304,55 @@ class DataReceiver(threading.Thread):
     ):
         super().__init__(daemon=True)
         self.sock = sock
+        self.reader = FrameReader(sock)
         self.running = True
         self.decoder = decoder
         self.on_receive = on_receive
         self.on_failed = on_failed
+        # stop()から待機中のselectを起こすための通知用ソケット
+        # (Windowsではパイプをselectできないため、socketpairを使う)
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ)
 
     def run(self):
         try:
             while self.running:
-                readable, _, _ = select.select([self.sock], [], [], 0.0)
-                if readable:
-                    data = self.decoder.accept(self.sock)
+                # 前回の受信で次のメッセージまで読み込んでいる場合は待たない
+                if self.reader.buffered == 0 and not self._wait_readable():
+                    continue
+                data = self.decoder.accept(self.reader)
+                if self.running:
                     self.on_receive(data)
         except Exception as e:
-            print(f"Receive error: {e}")
             if self.running:
+                print(f"Receive error: {e}")
                 self.on_failed()
+        finally:
+            self.selector.close()
+            self._wakeup_recv.close()
+            self._wakeup_send.close()
+
+    def _wait_readable(self) -> bool:
+        """
+        ソケットが読み込み可能になるかstop()されるまでブロックする
+        """
+        events = self.selector.select()
+        return any(key.fileobj is self.sock for key, _ in events)
 
     def stop(self):
         self.running = False
+        try:
+            self._wakeup_send.send(b"\0")
+        except OSError:
+            # 受信スレッドが既に終了している
+            pass
+        try:
+            # メッセージの途中で続きを待っているrecvはselectでは起こせないので、受信側を閉じる
+            # (別のスレッドからclose()しても、待っているrecvは戻らない)
+            self.sock.shutdown(socket.SHUT_RD)
+        except OSError:
+            # 既に閉じられている
+            pass
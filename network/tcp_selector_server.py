@@ -0,0 +1,278 @@
+import socket
+import selectors
+import threading
+import queue
+from typing import Callable, Optional
+from network.data.serializable_data import SerializableData
+from network.data.data_decoder import DataDecoder, DecodedData
+from network.data.frame_reader import FrameReader, IncompleteFrame
+from network.data.envelope import LEGACY_VERSION, ProtocolNegotiator
+from network.tcp_common import (
+    SendQueue,
+    SendQueueStats,
+    consume_views,
+    encode_buffers,
+    send_views,
+    set_no_delay,
+)
+
+
+class _Connection:
+    """
+    1クライアント分の受信バッファ(デコード途中の状態を含む)と送信待ちデータ
+    """
+
+    def __init__(self, sock: socket.socket, addr, send_queue: SendQueue):
+        self.sock = sock
+        self.addr = addr
+        self.reader = FrameReader(sock, blocking=False)
+        self.send_queue = send_queue
+        self.outgoing: list[memoryview] = []  # 書き込み途中のバッファ (ループのスレッドのみ触る)
+        self.protocol_version = LEGACY_VERSION
+        self.negotiator: Optional[ProtocolNegotiator] = None
+
+
+class SelectorTCPServer:
+    """
+    待ち受けソケットと全クライアントソケットを1つのスレッドのselectorで処理するサーバ
+    TCPServerと同じインターフェースを持つ
+
+    デコードしたデータはディスパッチ用キューに積まれ、
+    ディスパッチスレッドがon_receiveを呼び出す
+    """
+
+    def __init__(
+        self,
+        decoder: DataDecoder,
+        on_receive: Callable[[DecodedData], None],
+        host="0.0.0.0",
+        port=12345,
+        no_delay: bool = True,
+        send_queue_size: int = 256,
+        drop_oldest: bool = False,
+        max_batch_bytes: int = 64 * 1024,
+        protocol_version: int = LEGACY_VERSION,
+    ):
+        self.host = host
+        self.port = port
+        self.no_delay = no_delay  # Trueなら接続したソケットのNagleアルゴリズムを無効にする
+        self.server_sock: Optional[socket.socket] = None
+        self.running = False
+        self.send_queue_size = send_queue_size
+        self.drop_oldest = drop_oldest  # Trueなら送信キューが一杯のとき古いメッセージを破棄する
+        self.max_batch_bytes = max_batch_bytes
+        # 2以上ならHelloを送ってきたクライアントにはv2形式で送信する
+        self.protocol_version = protocol_version
+        self.decoder: DataDecoder = decoder
+        self.on_receive: Callable[[DecodedData], None] = on_receive
+        self.dispatch_queue: queue.Queue[Optional[DecodedData]] = queue.Queue()
+        self._clients: dict[socket.socket, _Connection] = {}
+        self._clients_lock = threading.Lock()
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._wakeup_recv: Optional[socket.socket] = None
+        self._wakeup_send: Optional[socket.socket] = None
+        self._pending_writes: set[_Connection] = set()
+        self._pending_lock = threading.Lock()
+        self._loop_thread: Optional[threading.Thread] = None
+        self._dispatch_thread: Optional[threading.Thread] = None
+
+    @property
+    def client_count(self) -> int:
+        with self._clients_lock:
+            return len(self._clients)
+
+    def start_server(self):
+        self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_sock.bind((self.host, self.port))
+        self.server_sock.listen()
+        self.server_sock.setblocking(False)
+
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.server_sock, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+
+        self.running = True
+        print(f"Server started on {self.host}:{self.port}")
+
+        self._loop_thread = threading.Thread(target=self._run, daemon=True)
+        self._loop_thread.start()
+        self._dispatch_thread = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatch_thread.start()
+
+    def stop_server(self):
+        if not self.running:
+            return
+        self.running = False
+        self._wakeup()
+        self._loop_thread.join()
+        self.dispatch_queue.put(None)
+        print("Server stopped")
+
+    def send_queue_stats(self) -> dict[tuple, SendQueueStats]:
+        """
+        クライアントのアドレスごとの送信キューの統計
+        """
+        with self._clients_lock:
+            connections = list(self._clients.values())
+        return {conn.addr: conn.send_queue.stats for conn in connections}
+
+    def send_all(self, data: SerializableData):
+        """
+        各クライアントの送信キューに積み、書き込みはイベントループに任せる
+        """
+        with self._clients_lock:
+            connections = list(self._clients.values())
+        # エンコードはプロトコルバージョンごとに1回だけ行う
+        encoded: dict[int, list[bytes]] = {}
+        for conn in connections:
+            version = conn.protocol_version
+            buffers = encoded.get(version)
+            if buffers is None:
+                buffers = encoded[version] = encode_buffers(data, version)
+            self._enqueue(conn, buffers, data)
+        if connections:
+            self._wakeup()
+
+    def _enqueue(
+        self, conn: _Connection, buffers: list[bytes], data: SerializableData
+    ):
+        # キューを空けるのはループのスレッドなので、ループのスレッド(Helloの返信)でも
+        # Tkのスレッド(send_all)でも待たない
+        # 一杯なら破棄してよいデータだけを、stats.rejectedに数えて捨てる
+        if conn.send_queue.put(buffers, block=False, droppable=data.droppable):
+            with self._pending_lock:
+                self._pending_writes.add(conn)
+        elif not conn.send_queue.closed:
+            print(f"Send queue for {conn.addr} is full, dropped {data.name()}")
+
+    def _wakeup(self):
+        try:
+            self._wakeup_send.send(b"\0")
+        except OSError:
+            pass
+
+    def _run(self):
+        try:
+            while self.running:
+                for key, mask in self._selector.select():
+                    if key.fileobj is self.server_sock:
+                        self._accept_client()
+                    elif key.fileobj is self._wakeup_recv:
+                        self._handle_wakeup()
+                    else:
+                        conn: _Connection = key.data
+                        if mask & selectors.EVENT_READ:
+                            self._read(conn)
+                        if mask & selectors.EVENT_WRITE and conn.sock.fileno() != -1:
+                            self._write(conn)
+        finally:
+            with self._clients_lock:
+                connections = list(self._clients.values())
+                self._clients.clear()
+            for conn in connections:
+                conn.send_queue.close()
+                conn.sock.close()
+            self._selector.close()
+            self.server_sock.close()
+            self._wakeup_recv.close()
+            self._wakeup_send.close()
+
+    def _accept_client(self):
+        try:
+            client_sock, addr = self.server_sock.accept()
+        except BlockingIOError:
+            return
+        except OSError as e:
+            print(f"Accept error: {e}")
+            return
+        print(f"Client connected from {addr}")
+        client_sock.setblocking(False)
+        set_no_delay(client_sock, self.no_delay)
+        conn = _Connection(
+            client_sock, addr, SendQueue(self.send_queue_size, self.drop_oldest)
+        )
+        conn.negotiator = ProtocolNegotiator(
+            self.protocol_version,
+            lambda data: self._enqueue(
+                conn, encode_buffers(data, conn.protocol_version), data
+            ),
+            lambda version: setattr(conn, "protocol_version", version),
+        )
+        with self._clients_lock:
+            self._clients[client_sock] = conn
+        self._selector.register(client_sock, selectors.EVENT_READ, conn)
+
+    def _handle_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._pending_lock:
+            pending = self._pending_writes
+            self._pending_writes = set()
+        for conn in pending:
+            if conn.sock.fileno() != -1:
+                self._selector.modify(
+                    conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, conn
+                )
+
+    def _read(self, conn: _Connection):
+        try:
+            conn.reader.receive()
+            while conn.reader.ready:
+                conn.reader.begin()
+                try:
+                    data = self.decoder.accept(conn.reader)
+                except IncompleteFrame:
+                    conn.reader.rollback()
+                    break
+                if conn.negotiator.handle(data):
+                    # Helloへの返信はループのスレッドで積むので、ここで書き込みを待つ
+                    self._handle_wakeup()
+                    continue
+                self.dispatch_queue.put(data)
+        except Exception as e:
+            print(f"Receive error: {e}")
+            self._remove_client(conn)
+
+    def _write(self, conn: _Connection):
+        """
+        送信キューに溜まったメッセージをまとめて1回の書き込みで送る
+        """
+        if not conn.outgoing:
+            batch = conn.send_queue.take_batch(self.max_batch_bytes, block=False)
+            conn.outgoing = [memoryview(buffer) for buffer in batch if buffer]
+            if not conn.outgoing:
+                self._selector.modify(conn.sock, selectors.EVENT_READ, conn)
+                return
+        try:
+            sent = send_views(conn.sock, conn.outgoing)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            print(f"Failed to send data: {e}")
+            self._remove_client(conn)
+            return
+        consume_views(conn.outgoing, sent)
+
+    def _remove_client(self, conn: _Connection):
+        print(f"Client {conn.addr} disconnected")
+        with self._clients_lock:
+            self._clients.pop(conn.sock, None)
+        conn.send_queue.close()
+        self._selector.unregister(conn.sock)
+        conn.sock.close()
+
+    def _dispatch(self):
+        while True:
+            data = self.dispatch_queue.get()
+            if data is None:
+                break
+            try:
+                self.on_receive(data)
+            except Exception as e:
+                print(f"Dispatch error: {e}")
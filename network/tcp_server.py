@@ -5,7 +5,13 @@ from typing import Callable, Optional, Tuple
 from network.data.data_decoder import DataDecoder, DecodedData
 from network.data.string_data import StringData, STRING_DATA_TYPE, StringDataDecoder
 from network.data.multi_type_data_decoder import MultiTypeDataDecoder
-from network.tcp_common import DataSender, DataReceiver
+from network.data.envelope import LEGACY_VERSION, ProtocolNegotiator
+from network.tcp_common import (
+    QueuedDataSender,
+    DataReceiver,
+    SendQueueStats,
+    set_no_delay,
+)
 from network.data.image_data import ImageDataDecoder, IMAGE_DATA_TYPE
 import time
 
@@ -17,12 +23,24 @@ class TCPServer:
         on_receive: Callable[[DecodedData], None],
         host="0.0.0.0",
         port=12345,
+        no_delay: bool = True,
+        send_queue_size: int = 256,
+        drop_oldest: bool = False,
+        protocol_version: int = LEGACY_VERSION,
     ):
         self.host = host
         self.port = port
+        self.no_delay = no_delay  # Trueなら接続したソケットのNagleアルゴリズムを無効にする
         self.server_sock: Optional[socket.socket] = None
         self.running = False
-        self.client_threads: list[Tuple[socket.socket, DataSender, DataReceiver]] = []
+        self.send_queue_size = send_queue_size
+        self.drop_oldest = drop_oldest  # Trueなら送信キューが一杯のとき古いメッセージを破棄する
+        # 2以上ならHelloを送ってきたクライアントにはv2形式で送信する
+        self.protocol_version = protocol_version
+        self.client_threads: list[
+            Tuple[socket.socket, QueuedDataSender, DataReceiver]
+        ] = []
+        self.client_lock = threading.Lock()  # client_threadsの保護
         self.decoder: DataDecoder = decoder
         self.on_receive: Callable[[DecodedData], None] = on_receive
 
@@ -41,7 +59,22 @@ class TCPServer:
             try:
                 client_sock, addr = self.server_sock.accept()
                 print(f"Client connected from {addr}")
-                sender = DataSender(client_sock)
+                set_no_delay(client_sock, self.no_delay)
+                sender = QueuedDataSender(
+                    client_sock, self.send_queue_size, self.drop_oldest
+                )
+
+                negotiator = ProtocolNegotiator(
+                    self.protocol_version,
+                    sender.send,
+                    lambda version, sender=sender: setattr(
+                        sender, "protocol_version", version
+                    ),
+                )
+
+                def on_receive(data: DecodedData, negotiator=negotiator):
+                    if not negotiator.handle(data):
+                        self.on_receive(data)
 
                 def on_disconnect():
                     print(f"Client {addr} disconnected")
@@ -50,34 +83,51 @@ class TCPServer:
                 receiver = DataReceiver(
                     client_sock,
                     self.decoder,
-                    self.on_receive,
+                    on_receive,
                     on_disconnect,
                 )
+                with self.client_lock:
+                    self.client_threads.append((client_sock, sender, receiver))
                 receiver.start()
-                self.client_threads.append((client_sock, sender, receiver))
             except Exception as e:
                 print(f"Accept error: {e}")
 
     def _remove_client(self, sock: socket.socket):
-        for i, (client_sock, sender, receiver) in enumerate(self.client_threads):
-            if client_sock == sock:
-                receiver.stop()
-                client_sock.close()
-                del self.client_threads[i]
-                break
+        with self.client_lock:
+            for i, (client_sock, sender, receiver) in enumerate(self.client_threads):
+                if client_sock == sock:
+                    receiver.stop()
+                    sender.stop()
+                    client_sock.close()
+                    del self.client_threads[i]
+                    break
 
     def stop_server(self):
         self.running = False
-        for sock, sender, receiver in self.client_threads:
+        with self.client_lock:
+            clients = self.client_threads
+            self.client_threads = []
+        for sock, sender, receiver in clients:
             receiver.stop()
+            sender.stop()
             sock.close()
         if self.server_sock:
             self.server_sock.close()
 
         print("Server stopped")
 
+    def send_queue_stats(self) -> dict[tuple, SendQueueStats]:
+        """
+        クライアントのアドレスごとの送信キューの統計
+        """
+        with self.client_lock:
+            clients = list(self.client_threads)
+        return {sender.peer: sender.stats for _, sender, _ in clients}
+
     def send_all(self, data: SerializableData):
-        for client_sock, sender, _ in self.client_threads:
+        with self.client_lock:
+            clients = list(self.client_threads)
+        for client_sock, sender, _ in clients:
             sender.send(data)
 
 
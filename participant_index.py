@@ -0,0 +1,99 @@
+import bisect
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+import step.util as sutil
+
+
+class ParticipantIndex:
+    """
+    working_dir/モード/場所/名前 のディレクトリから作る、参加者ごとの終わった条件の索引
+    起動時にos.scandirで1度だけ読み、以降はデータを保存したときにadd_dirで更新する
+    (名前を入力するたびにディレクトリを調べない)
+
+    Tkのスレッドと、ファイルを移動するスレッドから使うのでロックで保護する
+    """
+
+    def __init__(self, working_dir: Path):
+        self.working_dir = working_dir
+        # 名前 → {条件: 最終更新時刻}
+        self._participants: dict[str, dict[int, float]] = {}
+        self._names: list[str] = []  # 前方一致の検索用に並べた名前
+        self._lock = threading.Lock()
+        # (モード, 場所) のディレクトリ名 → 条件
+        self._conditions = {
+            (sutil.get_mode(condition), sutil.get_position(condition)): condition
+            for condition in sutil.list_condition()
+        }
+
+    def scan(self):
+        participants: dict[str, dict[int, float]] = {}
+        for mode_entry in self._scandir(self.working_dir):
+            for position_entry in self._scandir(Path(mode_entry.path)):
+                condition = self._conditions.get((mode_entry.name, position_entry.name))
+                if condition is None:
+                    continue
+                # Windowsではscandirの結果に更新時刻が含まれるので、追加の問い合わせはない
+                for name_entry in self._scandir(Path(position_entry.path)):
+                    mtime = name_entry.stat().st_mtime
+                    participants.setdefault(name_entry.name, {})[condition] = mtime
+        with self._lock:
+            self._participants = participants
+            self._names = sorted(participants)
+
+    def add_dir(self, save_dir: Path, mtime: Optional[float] = None):
+        """
+        save_dirにデータを保存したことを記録する。参加者の条件のディレクトリでなければ何もしない
+        """
+        try:
+            mode, position, name = save_dir.relative_to(self.working_dir).parts
+        except ValueError:
+            return
+        condition = self._conditions.get((mode, position))
+        if condition is None:
+            return
+        with self._lock:
+            conditions = self._participants.get(name)
+            if conditions is None:
+                conditions = self._participants[name] = {}
+                bisect.insort(self._names, name)
+            conditions[condition] = time.time() if mtime is None else mtime
+
+    def get_completed_conditions(self, name: str) -> list[int]:
+        if not name.strip():
+            return []
+        with self._lock:
+            conditions = self._participants.get(name, {})
+            return [c for c in sutil.list_condition() if c in conditions]
+
+    def get_last_modified_time(self, name: str) -> float:
+        """
+        終わった条件のディレクトリのうち最も新しい更新時刻。なければ-1
+        """
+        if not name.strip():
+            return -1
+        with self._lock:
+            return max(self._participants.get(name, {}).values(), default=-1)
+
+    def find_names(self, prefix: str, limit: int = 20) -> list[str]:
+        """
+        prefixで始まる名前を、名前順に最大limit個返す
+        """
+        with self._lock:
+            begin = bisect.bisect_left(self._names, prefix)
+            result = []
+            for name in self._names[begin:]:
+                if not name.startswith(prefix) or len(result) >= limit:
+                    break
+                result.append(name)
+            return result
+
+    @staticmethod
+    def _scandir(directory: Path) -> list[os.DirEntry]:
+        try:
+            with os.scandir(directory) as entries:
+                return [entry for entry in entries if entry.is_dir()]
+        except OSError:
+            return []
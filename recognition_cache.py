@@ -0,0 +1,160 @@
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from PIL import Image
+
+# 表示用の縮小画像の長辺の画素数
+PREVIEW_SIZE = 1280
+
+
+def make_preview(image: Image.Image) -> Image.Image:
+    """
+    長辺がPREVIEW_SIZEの縮小画像 (元から小さければそのまま) を返す
+    """
+    scale = PREVIEW_SIZE / max(image.size)
+    if scale >= 1.0:
+        return image
+    size = max(1, round(image.width * scale)), max(1, round(image.height * scale))
+    return image.resize(size, Image.Resampling.BILINEAR)
+
+
+def _image_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+@dataclass
+class CachedFrame:
+    image: Image.Image  # 表示・保存する画像 (認識できれば重ね描きした画像)
+    preview: Image.Image  # 表示用の縮小画像
+    orientation: int = 1  # EXIFのOrientation
+    answers: Optional[list[int]] = None  # 認識結果 (認識していなければNone)
+    rect: Optional[np.ndarray] = None  # 元の画像上のマーカーの四角形
+
+    @property
+    def nbytes(self) -> int:
+        preview_bytes = 0 if self.preview is self.image else _image_bytes(self.preview)
+        return _image_bytes(self.image) + preview_bytes
+
+
+class RecognitionCache:
+    """
+    画像の内容のハッシュをキーにした、認識結果と画像のキャッシュ
+    メモリ上はmax_bytesを超えないよう、最後に使ってから最も時間が経ったものから捨てる
+    disk_dirを指定すると、捨てたものもディスクから読み直せるよう書き出しておく
+
+    キーはnamespace (画像処理の種類など) ごとに分かれる
+    受信スレッド、認識スレッド、Tkのスレッドから使うのでロックで保護する
+    """
+
+    def __init__(
+        self, max_bytes: int = 512 * 1024 * 1024, disk_dir: Optional[Path] = None
+    ):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, str], CachedFrame] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return self._bytes
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, namespace: str, key: Optional[str]) -> Optional[CachedFrame]:
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None:
+                self._entries.move_to_end((namespace, key))
+                self.hits += 1
+                return entry
+        entry = self._load(namespace, key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._insert((namespace, key), entry)
+            return entry
+
+    def put(
+        self,
+        namespace: str,
+        key: Optional[str],
+        entry: CachedFrame,
+        persist: bool = True,
+    ):
+        """
+        :param persist: Falseならディスクには書き出さない (元のファイルが残っている場合など)
+        """
+        if key is None:
+            return
+        with self._lock:
+            self._insert((namespace, key), entry)
+        if persist and self.disk_dir is not None:
+            self._store(namespace, key, entry)
+
+    def _insert(self, cache_key: tuple[str, str], entry: CachedFrame):
+        old = self._entries.pop(cache_key, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        if entry.nbytes > self.max_bytes:
+            return
+        self._entries[cache_key] = entry
+        self._bytes += entry.nbytes
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def _paths(self, namespace: str, key: str) -> tuple[Path, Path]:
+        base = self.disk_dir / f"{namespace}_{key}"
+        return base.with_suffix(".json"), base.with_suffix(".jpeg")
+
+    def _store(self, namespace: str, key: str, entry: CachedFrame):
+        json_path, image_path = self._paths(namespace, key)
+        try:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            entry.image.save(image_path, quality=95)
+            meta = {
+                "orientation": entry.orientation,
+                "answers": entry.answers,
+                "rect": None if entry.rect is None else entry.rect.tolist(),
+            }
+            # 画像を書き終えてからメタデータを書き、中途半端なエントリを読まないようにする
+            json_path.write_text(json.dumps(meta), encoding="utf-8")
+        except Exception as e:
+            print(f"Failed to write cache {json_path}: {e}")
+
+    def _load(self, namespace: str, key: str) -> Optional[CachedFrame]:
+        if self.disk_dir is None:
+            return None
+        json_path, image_path = self._paths(namespace, key)
+        try:
+            meta = json.loads(json_path.read_text(encoding="utf-8"))
+            with Image.open(image_path) as img:
+                image = img.copy()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Failed to read cache {json_path}: {e}")
+            return None
+        rect = meta["rect"]
+        return CachedFrame(
+            image,
+            make_preview(image),
+            meta["orientation"],
+            meta["answers"],
+            None if rect is None else np.float32(rect),
+        )
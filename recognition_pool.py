@@ -0,0 +1,323 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from typing import Any, Callable, Optional, Tuple
+import numpy as np
+from PIL import Image
+from step.base_survey_step import BaseImageProcessor
+
+# 12MP (4096x3072) のRGB画像が入る大きさ
+DEFAULT_SLOT_BYTES = 4096 * 3072 * 3
+
+
+class SharedFramePool:
+    """
+    事前に確保した共有メモリの画像スロット
+    画像はスロットにコピーして、ワーカープロセスにはスロット番号と形だけを渡す
+    """
+
+    def __init__(self, slot_count: int, slot_bytes: int = DEFAULT_SLOT_BYTES):
+        self.slot_bytes = slot_bytes
+        self._slots = [
+            shared_memory.SharedMemory(create=True, size=slot_bytes)
+            for _ in range(slot_count)
+        ]
+        self._free: queue.Queue[int] = queue.Queue()
+        for slot in range(slot_count):
+            self._free.put(slot)
+
+    @property
+    def names(self) -> list[str]:
+        return [slot.name for slot in self._slots]
+
+    def acquire(self, timeout: Optional[float] = None) -> int:
+        """
+        空いているスロットの番号を返す。すべて使用中なら空くまで待つ
+        """
+        return self._free.get(timeout=timeout)
+
+    def release(self, slot: int):
+        self._free.put(slot)
+
+    def view(self, slot: int, shape: tuple) -> np.ndarray:
+        """
+        スロットの先頭をshapeのuint8配列として返す (コピーしない)
+        """
+        return np.ndarray(shape, dtype=np.uint8, buffer=self._slots[slot].buf)
+
+    def close(self):
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
+        self._slots = []
+
+
+def _worker_main(
+    factories: dict[str, Callable[[], BaseImageProcessor]],
+    slot_names: list[str],
+    tasks: mp.Queue,
+    results: mp.Queue,
+):
+    """
+    ワーカープロセスの処理
+    画像処理クラスは起動時に1度だけ生成し、以降の画像で使い回す
+    タスクの世代が変わったら (RecognitionPool.reset_tracking) 追跡の状態を忘れる
+    """
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    processors = {kind: factory() for kind, factory in factories.items()}
+    generations = {kind: 0 for kind in factories}
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            task_id, kind, generation, slot, shape = task
+            image = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf)
+            try:
+                processor = processors[kind]
+                if generations[kind] != generation:
+                    processor.reset_tracking()
+                    generations[kind] = generation
+                answers, rect = processor.read_answers_array(image)
+                if answers is not None:
+                    # 重ね描きした画像は同じスロットに書き戻す
+                    image[...] = processor.overlay_array(image, rect, answers)
+                results.put((task_id, answers, rect, None))
+            except Exception as e:
+                results.put((task_id, None, None, f"{type(e).__name__}: {e}"))
+            finally:
+                # 共有メモリを閉じる前に参照を外す
+                del image
+    finally:
+        for slot in slots:
+            slot.close()
+
+
+class RecognitionPool:
+    """
+    マークシートの認識を複数のワーカープロセスで行う
+    画像は共有メモリのスロット経由で受け渡し、pickleしない
+
+    factoriesには画像処理の名前と、それを生成するモジュールレベルの関数を渡す
+    (Windowsのspawnでワーカーに渡すため、lambdaは使えない)
+
+    ワーカープロセスが異常終了したら、処理中の依頼はすべて例外で終わらせ、以降の依頼も受け付けない
+    (どの依頼を処理していたか分からず、そのスロットを再び使えないため)
+    close()したときに終わっていない依頼も例外で終わらせる
+    """
+
+    def __init__(
+        self,
+        factories: dict[str, Callable[[], BaseImageProcessor]],
+        workers: Optional[int] = None,
+        slot_bytes: int = DEFAULT_SLOT_BYTES,
+    ):
+        workers = workers or os.cpu_count() or 1
+        self.workers = workers
+        context = mp.get_context("spawn")  # Windowsと同じ起動方法にそろえる
+        # ワーカーが処理中の画像と、次に処理する画像の分を確保する
+        self._frames = SharedFramePool(workers * 2, slot_bytes)
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._pending: dict[int, Tuple[Future, int, tuple]] = {}
+        self._generations = {kind: 0 for kind in factories}
+        self._processes = [
+            context.Process(
+                target=_worker_main,
+                args=(factories, self._frames.names, self._tasks, self._results),
+                daemon=True,
+            )
+            for _ in range(workers)
+        ]
+        for process in self._processes:
+            process.start()
+        self._closed = False
+        self._broken = False  # ワーカープロセスが異常終了した
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def submit(self, kind: str, image: Any) -> Future:
+        """
+        画像 (PIL.ImageかRGBのndarray) の認識を依頼する
+        Futureの結果は (answers, rect, overlay) で、overlayは重ね描きしたRGBのndarray
+        マーカーが見つからなければ (None, None, None)
+        空いているスロットがなければ、空くまで待つ
+        close()した後か、ワーカープロセスが異常終了した後はRuntimeErrorを送出する
+        """
+        if isinstance(image, Image.Image) and image.mode != "RGB":
+            image = image.convert("RGB")
+        array = np.asarray(image)
+        if array.dtype != np.uint8 or array.ndim != 3 or array.shape[2] != 3:
+            raise ValueError(f"Unsupported image: {array.dtype} {array.shape}")
+        if array.nbytes > self._frames.slot_bytes:
+            raise ValueError(f"Image is too large: {array.shape}")
+        slot = self._acquire_slot()
+        self._frames.view(slot, array.shape)[...] = array
+        future: Future = Future()
+        task_id = next(self._ids)
+        with self._lock:
+            if self._closed or self._broken:
+                self._frames.release(slot)
+                raise RuntimeError(self._unavailable_reason())
+            self._pending[task_id] = (future, slot, array.shape)
+            generation = self._generations[kind]
+        self._tasks.put((task_id, kind, generation, slot, array.shape))
+        return future
+
+    def recognize(
+        self, kind: str, image: Any
+    ) -> Tuple[Optional[list[int]], Optional[np.ndarray], Optional[np.ndarray]]:
+        return self.submit(kind, image).result()
+
+    def _acquire_slot(self) -> int:
+        while True:
+            with self._lock:
+                if self._closed or self._broken:
+                    raise RuntimeError(self._unavailable_reason())
+            try:
+                return self._frames.acquire(timeout=0.5)
+            except queue.Empty:
+                continue
+
+    def _unavailable_reason(self) -> str:
+        if self._broken:
+            return "A recognition worker process exited unexpectedly"
+        return "RecognitionPool is closed"
+
+    def reset_tracking(self, kind: str):
+        """
+        kindの画像処理が前の画像から引き継いでいる状態を、各ワーカーで次の画像から忘れさせる
+        """
+        with self._lock:
+            self._generations[kind] += 1
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+        self._collector.join()
+        self._fail_pending()
+        self._frames.close()
+
+    def _collect(self):
+        """
+        ワーカーの結果を受け取り、スロットから重ね描きした画像をコピーしてFutureを完了させる
+        """
+        while True:
+            try:
+                result = self._results.get(timeout=0.5)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if result is None:
+                break
+            task_id, answers, rect, error = result
+            with self._lock:
+                entry = self._pending.pop(task_id, None)
+            if entry is None:
+                # 異常終了を検出したときに例外で終わらせた依頼
+                continue
+            future, slot, shape = entry
+            overlay = None
+            if error is None and answers is not None:
+                overlay = self._frames.view(slot, shape).copy()
+            self._frames.release(slot)
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result((answers, rect, overlay))
+
+    def _check_workers(self):
+        """
+        close()の前に終了したワーカープロセスがあれば、処理中の依頼をすべて例外で終わらせる
+        """
+        with self._lock:
+            if self._closed or self._broken:
+                return
+            if all(process.is_alive() for process in self._processes):
+                return
+            self._broken = True
+        print("A recognition worker process exited unexpectedly")
+        self._fail_pending()
+
+    def _fail_pending(self):
+        """
+        終わっていない依頼をすべてRuntimeErrorで終わらせる
+        ワーカーが書き込んでいるかもしれないので、それらのスロットは空きに戻さない
+        """
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            reason = self._unavailable_reason()
+        for future, _, _ in pending:
+            future.set_exception(RuntimeError(reason))
+
+
+class PooledImageProcessor(BaseImageProcessor):
+    """
+    RecognitionPoolで認識するBaseImageProcessor
+    read_answersで重ね描きまでワーカーに依頼し、overlay_imageはその結果を返す
+    (RecognitionWorkerのように、同じ画像についてread_answers, overlay_imageの順に呼ぶ前提)
+
+    RecognitionWorkerはsubmitで結果を待たずに依頼し、ワーカーの数だけ同時に認識させる
+    """
+
+    def __init__(self, pool: RecognitionPool, kind: str):
+        self.pool = pool
+        self.kind = kind
+        self._last_rect = None
+        self._last_overlay: Optional[np.ndarray] = None
+
+    def read_answers_array(
+        self, rgb: np.ndarray
+    ) -> Tuple[list[int], np.ndarray] | Tuple[None, None]:
+        answers, rect, overlay = self.pool.recognize(self.kind, rgb)
+        self._last_rect = rect
+        self._last_overlay = overlay
+        return answers, rect
+
+    @property
+    def max_in_flight(self) -> int:
+        return self.pool.workers
+
+    def submit(self, image: Any) -> Future:
+        """
+        画像の認識を依頼する。Futureの結果は (answers, rect, overlay) で、
+        overlayは重ね描きしたPIL.Image (マーカーが見つからなければすべてNone)
+        """
+        future: Future = Future()
+
+        def on_done(done: Future):
+            try:
+                answers, rect, overlay = done.result()
+            except Exception as e:
+                future.set_exception(e)
+                return
+            if overlay is not None:
+                overlay = Image.fromarray(overlay)
+            future.set_result((answers, rect, overlay))
+
+        self.pool.submit(self.kind, image).add_done_callback(on_done)
+        return future
+
+    def reset_tracking(self):
+        self.pool.reset_tracking(self.kind)
+
+    def overlay_array(self, rgb: np.ndarray, rect, answers: list[int]) -> np.ndarray:
+        if self._last_overlay is None or rect is not self._last_rect:
+            raise ValueError("overlay_array() must follow read_answers() for the image")
+        return self._last_overlay
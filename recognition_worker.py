@@ -0,0 +1,348 @@
+import dataclasses
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Optional
+import numpy as np
+from frame_mailbox import Frame, FrameMailbox
+from frame_quality import FrameQuality, FrameQualityGate
+from recognition_cache import CachedFrame, RecognitionCache, make_preview
+
+
+@dataclass
+class RecognitionResult:
+    seq: int  # 認識した画像の通し番号
+    answers: Optional[list[int]]  # マーカーが見つからなければNone
+    rect: Optional[np.ndarray]
+    overlay: Any  # 表示する画像 (認識できなければ元の画像)
+    timings: dict[str, float] = field(default_factory=dict)  # 処理段階ごとの秒数
+    orientation: int = 1  # 画像のEXIFのOrientation (overlayは回転していない)
+    quality: Optional[FrameQuality] = None  # quality_gateを使う場合の画像の質
+    preview: Any = None  # cacheを使う場合の表示用の縮小画像
+
+
+@dataclass
+class RecognitionStats:
+    completed: int = 0  # 結果を返した数
+    cancelled: int = 0  # 新しい画像が届いたため途中でやめた数
+    failed: int = 0  # 例外が発生した数
+    rejected: int = 0  # 質を満たす画像がなく、最も良い画像をそのまま認識した数
+    skipped: int = 0  # 連写された中から選ばれなかった数
+    cached: int = 0  # 同じ内容の画像の結果をキャッシュから返した数
+    last_timings: dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class _Recognition:
+    """
+    認識することにした画像と、それまでに分かったこと
+    """
+
+    frame: Frame
+    quality: Optional[FrameQuality]
+    timings: dict[str, float]
+    start: float  # 処理を始めた時刻 (time.perf_counter())
+    submitted: float = 0.0  # processor.submit()した時刻 (time.perf_counter())
+
+
+class RecognitionWorker(threading.Thread):
+    """
+    mailboxに届いた画像を別スレッドで認識するスレッド
+    read_answers, overlay_imageをTkのスレッドで実行しないようにする
+
+    結果は1件分だけ保持し、poll()でTkのスレッド(afterのコールバック)から取り出す
+    処理中に新しい画像が届いたら、その画像の処理は途中でやめて新しい方を処理する
+
+    quality_gateを指定すると、burst_window秒以内に続けて届いた画像は連写とみなし、
+    縮小画像で質を比べて最も良い1枚だけを認識する
+    連写が続いても、最初の画像からmax_burst_time秒で打ち切り、新しいmax_burst_frames枚だけを比べる
+    縮小画像ではマーカーが見つからなくても認識では見つかることがあるので、
+    質を満たす画像がなくても最も良い画像を認識する (質は比べるためだけに使う)
+
+    cacheを指定すると、同じ内容の画像 (Frame.keyが同じ) はcache_namespaceの結果を返す
+
+    processorがsubmit(image)を持つ場合 (PooledImageProcessor) は結果を待たずに依頼し、
+    processor.max_in_flight枚まで同時に認識させる。新しい画像の結果を返した後に
+    届いた古い画像の結果は捨てる
+    """
+
+    def __init__(
+        self,
+        mailbox: FrameMailbox,
+        processor,
+        quality_gate: Optional[FrameQualityGate] = None,
+        burst_window: float = 0.15,
+        cache: Optional[RecognitionCache] = None,
+        cache_namespace: str = "",
+        max_burst_frames: int = 4,
+        max_burst_time: float = 0.5,
+    ):
+        super().__init__(daemon=True)
+        self.mailbox = mailbox
+        self.processor = processor  # BaseImageProcessor (このスレッドからのみ使う)
+        self.quality_gate = quality_gate
+        self.burst_window = burst_window
+        self.max_burst_frames = max_burst_frames
+        self.max_burst_time = max_burst_time
+        self.cache = cache
+        self.cache_namespace = cache_namespace
+        self.running = True
+        self._lock = threading.Lock()
+        self._result: Optional[RecognitionResult] = None
+        self._stats = RecognitionStats()
+
+    @property
+    def stats(self) -> RecognitionStats:
+        with self._lock:
+            return dataclasses.replace(
+                self._stats, last_timings=dict(self._stats.last_timings)
+            )
+
+    def poll(self) -> Optional[RecognitionResult]:
+        """
+        まだ取り出していない最新の結果を返す。なければNone
+        """
+        with self._lock:
+            result = self._result
+            self._result = None
+            return result
+
+    def stop(self):
+        self.running = False
+        self.mailbox.wake()
+
+    def run(self):
+        if hasattr(self.processor, "submit"):
+            self._run_async()
+            return
+        while self.running:
+            frames = self.mailbox.wait_all()
+            if not frames or not self.running:
+                continue
+            if self.quality_gate is not None:
+                frames = self._collect_burst(frames)
+            try:
+                result = self._process(frames)
+            except Exception as e:
+                print(f"Recognition error: {e}")
+                with self._lock:
+                    self._stats.failed += 1
+                continue
+            with self._lock:
+                self._stats.skipped += len(frames) - 1
+                if result is None:
+                    self._stats.cancelled += 1
+                else:
+                    self._store(result)
+
+    def _run_async(self):
+        in_flight: list[tuple[Future, _Recognition]] = []  # 依頼した順
+        waiting: list[Frame] = []  # 依頼できる数に空きができるのを待っている画像
+        published_seq = 0  # 最後に返した結果の画像の通し番号
+        max_in_flight = max(1, getattr(self.processor, "max_in_flight", 1))
+        while self.running:
+            # 認識が終わるとwake()で起こされるが、起こされる直前に待ち始めた場合に備えて時間を区切る
+            frames = self.mailbox.wait_all(0.1 if in_flight else None)
+            if frames and self.quality_gate is not None:
+                frames = self._collect_burst(frames)
+            # 空きを待つ間も新しい画像だけを残す (比べないなら最新の1枚、比べるなら連写の分)
+            waiting = self._keep_latest(waiting + frames)
+            if not self.running:
+                break
+            in_flight, published_seq = self._collect_done(in_flight, published_seq)
+            if not waiting or len(in_flight) >= max_in_flight:
+                continue
+            frames, waiting = waiting, []
+            with self._lock:
+                self._stats.skipped += len(frames) - 1
+            try:
+                prepared = self._prepare(frames)
+                if isinstance(prepared, RecognitionResult):
+                    with self._lock:
+                        self._store(prepared)
+                    published_seq = prepared.seq
+                    continue
+                prepared.submitted = time.perf_counter()
+                future = self.processor.submit(prepared.frame.image)
+            except Exception as e:
+                print(f"Recognition error: {e}")
+                with self._lock:
+                    self._stats.failed += 1
+                continue
+            future.add_done_callback(lambda _: self.mailbox.wake())
+            in_flight.append((future, prepared))
+
+    def _collect_done(
+        self, in_flight: list[tuple[Future, _Recognition]], published_seq: int
+    ) -> tuple[list[tuple[Future, _Recognition]], int]:
+        """
+        認識が終わった依頼の結果を新しい順に返し、(残りの依頼, 最後に返した画像の通し番号) を返す
+        """
+        remaining = []
+        for future, task in reversed(in_flight):
+            if not future.done():
+                remaining.insert(0, (future, task))
+                continue
+            try:
+                answers, rect, overlay = future.result()
+            except Exception as e:
+                print(f"Recognition error: {e}")
+                with self._lock:
+                    self._stats.failed += 1
+                continue
+            if task.frame.seq <= published_seq:
+                with self._lock:
+                    self._stats.cancelled += 1
+                continue
+            task.timings["recognize"] = time.perf_counter() - task.submitted
+            if overlay is None:
+                overlay = task.frame.image
+            result = self._finish(task, answers, rect, overlay)
+            with self._lock:
+                self._store(result)
+            published_seq = task.frame.seq
+        return remaining, published_seq
+
+    def _store(self, result: RecognitionResult):
+        """
+        poll()で取り出す結果を更新する (self._lockを取得して呼ぶ)
+        """
+        self._result = result
+        self._stats.completed += 1
+        if "cache" in result.timings:
+            self._stats.cached += 1
+        self._stats.last_timings = dict(result.timings)
+        quality = result.quality
+        if quality is not None and not self.quality_gate.accepts(quality):
+            self._stats.rejected += 1
+
+    def _collect_burst(self, frames: list[Frame]) -> list[Frame]:
+        """
+        最後の画像からburst_window秒以内に届いた画像を続けて受け取り、framesに加えて返す
+        最初の画像からmax_burst_time秒経ったら打ち切る。新しいmax_burst_frames枚だけを残し、
+        残さなかった画像はskippedに数える
+        """
+        deadline = frames[0].received_at + self.max_burst_time
+        frames = self._keep_latest(frames)
+        while self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            more = self.mailbox.wait_all(min(self.burst_window, remaining))
+            if not more:
+                break
+            frames = self._keep_latest(frames + more)
+        return frames
+
+    def _keep_latest(self, frames: list[Frame]) -> list[Frame]:
+        """
+        新しい画像だけを残し、残さなかった画像はskippedに数える
+        """
+        keep = 1 if self.quality_gate is None else self.max_burst_frames
+        dropped = len(frames) - keep
+        if dropped <= 0:
+            return frames
+        with self._lock:
+            self._stats.skipped += dropped
+        return frames[dropped:]
+
+    def _select(self, frames: list[Frame]) -> tuple[Frame, Optional[FrameQuality]]:
+        """
+        認識する画像を選び、(画像, 質) を返す
+        quality_gateがないか1枚だけなら最新の画像を (質は調べない)、
+        あれば質を満たすもの、マーカーが多く見つかったもの、くっきりしたものの順に優先する
+        """
+        if self.quality_gate is None or len(frames) == 1:
+            return frames[-1], None
+        qualities = [self.quality_gate.assess(frame.image) for frame in frames]
+        # 同じなら新しい方を選ぶ
+        _, _, _, index = max(
+            (
+                self.quality_gate.accepts(quality),
+                quality.markers,
+                quality.sharpness,
+                index,
+            )
+            for index, quality in enumerate(qualities)
+        )
+        return frames[index], qualities[index]
+
+    def _is_stale(self, latest: Frame) -> bool:
+        return not self.running or self.mailbox.last_seq != latest.seq
+
+    def _prepare(self, frames: list[Frame]) -> RecognitionResult | _Recognition:
+        """
+        frames (古い順) から認識する画像を選ぶ
+        キャッシュにあれば、その結果を返す
+        """
+        latest = frames[-1]
+        start = time.perf_counter()
+        if self.cache is not None:
+            cached = self.cache.get(self.cache_namespace, latest.key)
+            if cached is not None:
+                timings = {"wait": time.monotonic() - latest.received_at}
+                timings["cache"] = timings["total"] = time.perf_counter() - start
+                return RecognitionResult(
+                    latest.seq,
+                    cached.answers,
+                    cached.rect,
+                    cached.image,
+                    timings,
+                    latest.orientation,
+                    preview=cached.preview,
+                )
+        frame, quality = self._select(frames)
+        timings = {"wait": time.monotonic() - frame.received_at}
+        if quality is not None:
+            timings["quality"] = time.perf_counter() - start
+        return _Recognition(frame, quality, timings, start)
+
+    def _finish(
+        self, task: _Recognition, answers, rect, overlay
+    ) -> RecognitionResult:
+        frame = task.frame
+        preview = None
+        if self.cache is not None:
+            preview = make_preview(overlay)
+            self.cache.put(
+                self.cache_namespace,
+                frame.key,
+                CachedFrame(overlay, preview, frame.orientation, answers, rect),
+            )
+        task.timings["total"] = time.perf_counter() - task.start
+        return RecognitionResult(
+            frame.seq,
+            answers,
+            rect,
+            overlay,
+            task.timings,
+            frame.orientation,
+            task.quality,
+            preview,
+        )
+
+    def _process(self, frames: list[Frame]) -> Optional[RecognitionResult]:
+        """
+        frames (古い順) から選んだ画像を認識する
+        新しい画像が届いていたら途中でやめてNoneを返す
+        """
+        latest = frames[-1]
+        prepared = self._prepare(frames)
+        if isinstance(prepared, RecognitionResult):
+            return prepared
+        image = prepared.frame.image
+        timings = prepared.timings
+        read_start = time.perf_counter()
+        answers, rect = self.processor.read_answers(image)
+        read_end = time.perf_counter()
+        timings["read_answers"] = read_end - read_start
+        if self._is_stale(latest):
+            return None
+        overlay = image
+        if answers is not None:
+            overlay = self.processor.overlay_image(image, rect, answers)
+            timings["overlay"] = time.perf_counter() - read_end
+            if self._is_stale(latest):
+                return None
+        return self._finish(prepared, answers, rect, overlay)
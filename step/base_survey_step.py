@@ -4,13 +4,28 @@ from typing import Callable, Optional, List, Tuple
 from PIL import Image
 import PIL.ImageTk
 from step.step import Step
-from queue import Queue
+from frame_mailbox import FrameMailbox
+from image_orientation import (
+    apply_orientation,
+    orientation_exif,
+    oriented_size,
+    read_orientation,
+)
+from recognition_worker import RecognitionWorker
+from frame_quality import FrameQualityGate
+from recognition_cache import CachedFrame, RecognitionCache, make_preview
+from participant_index import ParticipantIndex
+from network.data.image_data import content_hash
 import numpy as np
 import csv
+import io
 from pathlib import Path
 
 
 class BaseSurveyUI:
+    # ウィンドウの大きさの変更が止まってから再描画するまでの時間
+    RESIZE_DEBOUNCE_MS = 100
+
     def __init__(
         self,
         container: ttk.Frame,
@@ -23,6 +38,13 @@ class BaseSurveyUI:
         self.canvas = None
         self.radio_vars: list[tk.IntVar] = []
         self.tk_image = None
+        self._image_item = None  # canvas上の画像のid
+        # 表示中の画像と、それを画面の大きさ程度に縮小して正しい向きに直した画像
+        self._source: Optional[Image.Image] = None
+        self._orientation = 1
+        self._base: Optional[Image.Image] = None
+        self._on_resize: Optional[Callable] = None
+        self._resize_after_id = None
 
     def build(self, on_resize: Callable, on_radio_update: Callable):
         self.container.columnconfigure(0, weight=2)
@@ -36,7 +58,8 @@ class BaseSurveyUI:
             camera_container, background="gray", highlightthickness=0
         )
         self.canvas.pack(expand=True, fill="both")
-        self.canvas.bind("<Configure>", on_resize)
+        self._on_resize = on_resize
+        self.canvas.bind("<Configure>", self._on_configure)
 
         # 表示側
         display_container = ttk.Frame(self.container)
@@ -80,9 +103,16 @@ class BaseSurveyUI:
                         command=on_radio_update,
                     ).grid(row=row, column=col + 1, sticky="w", padx=5, pady=5)
 
-    def update_canvas(self, pil_image: Optional[Image.Image]):
-        self.canvas.delete("all")
+    def update_canvas(self, pil_image: Optional[Image.Image], orientation: int = 1):
+        """
+        orientation (EXIFのOrientation) に従い、縮小してから正しい向きに直して表示する
+        同じ画像なら、前回作った画面の大きさ程度の画像から縮小し直すだけにする
+        """
         if pil_image is None:
+            self._source = self._base = None
+            self._image_item = None
+            self.tk_image = None
+            self.canvas.delete("all")
             self.canvas.create_text(
                 self.canvas.winfo_width() // 2,
                 self.canvas.winfo_height() // 2,
@@ -91,22 +121,77 @@ class BaseSurveyUI:
                 font=("Arial", 14),
             )
             return
-
-        canvas_ratio = self.canvas.winfo_width() / self.canvas.winfo_height()
-        img_ratio = pil_image.width / pil_image.height
+        if pil_image is not self._source or orientation != self._orientation:
+            self._source = pil_image
+            self._orientation = orientation
+            self._base = self._make_base(pil_image, orientation)
+        self._render()
+
+    def _make_base(self, pil_image: Image.Image, orientation: int) -> Image.Image:
+        """
+        画面に収まる程度まで整数倍で縮小 (reduce) し、正しい向きに直した画像を返す
+        (受信した画像は認識でも使っているので、draft()で書き換えることはしない)
+        """
+        screen_width = self.canvas.winfo_screenwidth()
+        screen_height = self.canvas.winfo_screenheight()
+        image_width, image_height = oriented_size(pil_image.size, orientation)
+        # 画面に収めたときの大きさを下回らない範囲で縮小する
+        factor = int(max(image_width / screen_width, image_height / screen_height))
+        if factor > 1:
+            pil_image = pil_image.reduce(factor)
+        return apply_orientation(pil_image, orientation)
+
+    def _render(self):
+        canvas_width = self.canvas.winfo_width()
+        canvas_height = self.canvas.winfo_height()
+        if self._base is None or canvas_width <= 0 or canvas_height <= 0:
+            return
+        canvas_ratio = canvas_width / canvas_height
+        img_ratio = self._base.width / self._base.height
         if canvas_ratio > img_ratio:
-            height = self.canvas.winfo_height()
+            height = canvas_height
             width = int(height * img_ratio)
         else:
-            width = self.canvas.winfo_width()
+            width = canvas_width
             height = int(width / img_ratio)
         if width <= 0 or height <= 0:
             return
-        resized = pil_image.resize((width, height))
-        self.tk_image = PIL.ImageTk.PhotoImage(resized)
-        x = (self.canvas.winfo_width() - width) // 2
-        y = (self.canvas.winfo_height() - height) // 2
-        self.canvas.create_image(x, y, anchor="nw", image=self.tk_image)
+        resized = self._base.resize((width, height))
+        if (
+            self.tk_image is not None
+            and self.tk_image.width() == width
+            and self.tk_image.height() == height
+        ):
+            # 大きさが同じならPhotoImageを作り直さずに画素だけ書き換える
+            self.tk_image.paste(resized)
+        else:
+            self.tk_image = PIL.ImageTk.PhotoImage(resized)
+        x = (canvas_width - width) // 2
+        y = (canvas_height - height) // 2
+        if self._image_item is None:
+            self.canvas.delete("all")
+            self._image_item = self.canvas.create_image(
+                x, y, anchor="nw", image=self.tk_image
+            )
+        else:
+            self.canvas.coords(self._image_item, x, y)
+            self.canvas.itemconfigure(self._image_item, image=self.tk_image)
+
+    def _on_configure(self, event):
+        """
+        ウィンドウの端をドラッグしている間は何度も呼ばれるので、止まってから再描画する
+        """
+        if self._resize_after_id is not None:
+            self.canvas.after_cancel(self._resize_after_id)
+        self._resize_after_id = self.canvas.after(
+            self.RESIZE_DEBOUNCE_MS, self._on_resize_settled, event
+        )
+
+    def _on_resize_settled(self, event):
+        self._resize_after_id = None
+        # 待っている間に画面が破棄された場合は何もしない
+        if self.canvas.winfo_exists():
+            self._on_resize(event)
 
     def get_radio_values(self) -> list[int]:
         return [var.get() for var in self.radio_vars]
@@ -117,29 +202,80 @@ class BaseSurveyUI:
 
 
 class BaseImageProcessor:
+    """
+    サブクラスはRGBのndarrayを受け取るread_answers_array, overlay_arrayを実装する
+    (別プロセスの共有メモリ上の画像をそのまま渡せるようにするため)
+    """
+
     def read_answers(
         self, image: Image.Image
     ) -> Tuple[list[int], np.ndarray] | Tuple[None, None]:
-        raise NotImplementedError
+        return self.read_answers_array(np.asarray(image))
 
     def overlay_image(
         self, image: Image.Image, rect, answers: list[int]
     ) -> Image.Image:
+        return Image.fromarray(self.overlay_array(np.asarray(image), rect, answers))
+
+    def read_answers_array(
+        self, rgb: np.ndarray
+    ) -> Tuple[list[int], np.ndarray] | Tuple[None, None]:
+        raise NotImplementedError
+
+    def reset_tracking(self):
+        """
+        前の画像から引き継いでいる状態 (マーカーの位置など) を忘れる
+        """
+
+    def overlay_array(self, rgb: np.ndarray, rect, answers: list[int]) -> np.ndarray:
         raise NotImplementedError
 
 
 class BaseDataSaver:
-    def __init__(self, save_dir: Path, file_name: str):
+    # 保存した画像をcacheに入れるときのnamespace
+    CACHE_NAMESPACE = "saved"
+
+    def __init__(
+        self,
+        save_dir: Path,
+        file_name: str,
+        cache: Optional[RecognitionCache] = None,
+        participant_index: Optional[ParticipantIndex] = None,
+    ):
+        """
+        :param cache: 指定すると、保存・読み込みした画像をファイルの内容のハッシュで覚えておき、
+            同じファイルを読み込むときはデコードしない
+        :param participant_index: 指定すると、保存したことを記録する
+        """
         self.save_dir = save_dir
         self.file_name = file_name
+        self.cache = cache
+        self.participant_index = participant_index
 
     def _ensure_dir_exists(self):
         self.save_dir.mkdir(parents=True, exist_ok=True)
+        if self.participant_index is not None:
+            self.participant_index.add_dir(self.save_dir)
 
-    def save_image(self, image: Image.Image):
+    def save_image(
+        self,
+        image: Image.Image,
+        orientation: int = 1,
+        preview: Optional[Image.Image] = None,
+    ):
+        """
+        画素は回転せずに、向きはEXIFのOrientationとして保存する
+        """
         self._ensure_dir_exists()
         image_path = self.save_dir / f"{self.file_name}.jpeg"
-        image.save(image_path)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", exif=orientation_exif(orientation))
+        data = buffer.getbuffer()
+        image_path.write_bytes(data)
+        if self.cache is not None:
+            frame = CachedFrame(image, preview or make_preview(image), orientation)
+            # 元のファイルが残るので、キャッシュのディスクには書き出さない
+            self.cache.put(self.CACHE_NAMESPACE, content_hash(data), frame, False)
 
     def save_csv(self, answers: list[int]):
         self._ensure_dir_exists()
@@ -148,14 +284,13 @@ class BaseDataSaver:
             writer = csv.writer(f)
             writer.writerow(answers)
 
-    def load(self) -> Tuple[Optional[Image.Image], Optional[list[int]]]:
+    def load(self) -> Tuple[Optional[CachedFrame], Optional[list[int]]]:
         image_path = self.save_dir / f"{self.file_name}.jpeg"
         csv_path = self.save_dir / f"{self.file_name}.csv"
         image, answers = None, None
 
         try:
-            with Image.open(image_path) as img:
-                image = img.copy()
+            image = self._load_image(image_path.read_bytes())
         except Exception:
             pass
 
@@ -168,57 +303,94 @@ class BaseDataSaver:
 
         return image, answers
 
+    def _load_image(self, data: bytes) -> CachedFrame:
+        key = None
+        if self.cache is not None:
+            key = content_hash(data)
+            frame = self.cache.get(self.CACHE_NAMESPACE, key)
+            if frame is not None:
+                return frame
+        with Image.open(io.BytesIO(data)) as img:
+            image = img.copy()
+            orientation = read_orientation(img)
+        frame = CachedFrame(image, make_preview(image), orientation)
+        if self.cache is not None:
+            self.cache.put(self.CACHE_NAMESPACE, key, frame, False)
+        return frame
+
 
 class BaseSurveyStep(Step):
     def __init__(
         self,
-        queue: Queue,
+        mailbox: FrameMailbox,
         container: tk.Frame,
         set_complete: Callable[[bool], None],
         ui: BaseSurveyUI,
         processor: BaseImageProcessor,
         saver: BaseDataSaver,
+        quality_gate: Optional[FrameQualityGate] = None,
+        cache: Optional[RecognitionCache] = None,
+        cache_namespace: str = "",
     ):
-        self.queue = queue
+        self.mailbox = mailbox
         self.container = container
         self.set_complete = set_complete
         self.ui = ui
         self.processor = processor
         self.saver = saver
+        self.quality_gate = quality_gate  # 指定すると質の足りない画像は認識しない
+        # 指定すると同じ内容の画像は認識せず、cache_namespaceの結果を使う
+        self.cache = cache
+        self.cache_namespace = cache_namespace
         self.image = None
+        self.preview = None  # 表示用の縮小画像 (なければself.imageを表示する)
+        self.orientation = 1  # self.imageのEXIFのOrientation
         self.after_id = None
+        self.worker: Optional[RecognitionWorker] = None
 
     def build(self):
-        with self.queue.mutex:
-            self.queue.queue.clear()
-            self.queue.all_tasks_done.notify_all()
-            self.queue.unfinished_tasks = 0
+        # この画面を開く前に届いた画像は使わない
+        self.mailbox.drain()
+        # 前の参加者・ステップで撮った用紙の位置を引き継がない
+        self.processor.reset_tracking()
+        # 認識は別スレッドで行い、結果を_update()で受け取る
+        self.worker = RecognitionWorker(
+            self.mailbox,
+            self.processor,
+            self.quality_gate,
+            cache=self.cache,
+            cache_namespace=self.cache_namespace,
+        )
+        self.worker.start()
 
         self.ui.build(self._on_resize, self._on_radio_update)
-        image, answers = self.saver.load()
+        saved, answers = self.saver.load()
         if answers:
             self.ui.set_radio_values(answers)
             self._on_radio_update()
-        if image:
-            self.image = image
-            self.ui.update_canvas(image)
+        if saved:
+            self.image = saved.image
+            self.preview = saved.preview
+            self.orientation = saved.orientation
+            self.ui.update_canvas(self.preview, self.orientation)
         self._update()
 
     def _on_resize(self, event):
-        self.ui.update_canvas(self.image)
+        self.ui.update_canvas(self._display_image(), self.orientation)
+
+    def _display_image(self):
+        return self.image if self.preview is None else self.preview
 
     def _update(self):
-        if self.queue.qsize() > 0:
-            image = self.queue.get(False)
-            if image:
-                answers, rect = self.processor.read_answers(image)
-                if answers is not None:
-                    self.ui.set_radio_values(answers)
-                    self._on_radio_update()
-                    self.image = self.processor.overlay_image(image, rect, answers)
-                else:
-                    self.image = image
-                self.ui.update_canvas(self.image)
+        result = self.worker.poll()
+        if result is not None:
+            if result.answers is not None:
+                self.ui.set_radio_values(result.answers)
+                self._on_radio_update()
+            self.image = result.overlay
+            self.preview = result.preview
+            self.orientation = result.orientation
+            self.ui.update_canvas(self._display_image(), self.orientation)
         self.after_id = self.container.after(30, self._update)
 
     def _on_radio_update(self):
@@ -228,8 +400,12 @@ class BaseSurveyStep(Step):
     def on_dispose(self):
         if self.after_id:
             self.container.after_cancel(self.after_id)
+        if self.worker:
+            self.worker.stop()
+            # 画像処理クラスはこのステップ専用なので、処理中の画像が終わるのを待たなくてよい
+            self.worker = None
 
     def before_next(self):
         if self.image:
-            self.saver.save_image(self.image)
+            self.saver.save_image(self.image, self.orientation, self.preview)
         self.saver.save_csv(self.ui.get_radio_values())
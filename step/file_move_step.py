@@ -1,16 +1,19 @@
 from tkinter import ttk
 import tkinter as tk
-from typing import Callable
+from typing import Callable, Optional
 from step.step import Step
 import step.util as sutil
 from pathlib import Path
-import shutil
+from file_transfer import FileTransfer
+from file_watcher import FileWatcher, WatchProgress
+from participant_index import ParticipantIndex
 
 
 class FileMoveStepUI:
     def __init__(self, container: ttk.Frame):
         self.container = container
         self.label = None
+        self.progress_label = None
 
     def build(self,set_complete):
         ttk.Button(self.container, text="スキップ",command=lambda:set_complete(True)).pack()
@@ -18,32 +21,66 @@ class FileMoveStepUI:
     def show_waiting(self):
         self.label = ttk.Label(self.container, text="ファイルを待っています...")
         self.label.pack()
+        self.progress_label = ttk.Label(self.container, text="")
+        self.progress_label.pack()
+
+    def show_progress(self, progress: WatchProgress):
+        lines = [
+            f"書き込み中: {name} ({size / 1024:.0f} KB)"
+            for name, size in sorted(progress.writing.items())
+        ]
+        if progress.moved:
+            lines.append(f"移動済み: {len(progress.moved)} 件")
+        if progress.failed:
+            lines.append(f"移動できなかったファイル: {', '.join(progress.failed)}")
+        if self.progress_label:
+            self.progress_label.config(text="\n".join(lines))
 
     def show_complete(self):
         if self.label:
             self.label.destroy()
+            self.label = None
         ttk.Label(self.container, text="ファイルの移動が完了しました!").pack()
 
 
 class FileMoveProcessor:
-    def __init__(self, src_folder: Path, dst_folder: Path, pattern):
+    def __init__(
+        self,
+        src_folder: Path,
+        dst_folder: Path,
+        pattern,
+        transfer: Optional[FileTransfer] = None,
+        participant_index: Optional[ParticipantIndex] = None,
+    ):
         self.src_folder = src_folder
         self.dst_folder = dst_folder
         self.pattern = pattern
+        self.transfer = transfer or FileTransfer()
+        self.participant_index = participant_index  # 指定すると移動したことを記録する
+
+    def move(self, paths: list[Path]) -> list[bool]:
+        """
+        書き終わったファイルを並列に移動する (FileWatcherのスレッドから呼ばれる)
+        失敗したファイルはコピー元に残り、次に移動するときは続きからコピーする
+        """
+        results = self.transfer.transfer_all(paths, self.dst_folder)
+        if self.participant_index is not None and any(r.ok for r in results):
+            self.participant_index.add_dir(self.dst_folder)
+        return [result.ok for result in results]
 
     def move_file(self) -> bool:
-        self.dst_folder.mkdir(parents=True, exist_ok=True)
-        count = 0
-        for csv_file in self.src_folder.glob(self.pattern):
-            try:
-                shutil.move(str(csv_file), str(self.dst_folder / csv_file.name))
-                count += 1
-            except:
-                pass
-        return count > 0
+        return any(self.move(list(self.src_folder.glob(self.pattern))))
 
 
 class FileMoveStep(Step):
+    """
+    FileWatcherでsrc_folderを監視し、書き終わったファイルから移動する
+    最初のファイルを移動したら完了にするが、後から来たファイルもステップを離れるまで移動する
+    """
+
+    # 進捗の表示を更新する間隔 (監視スレッドの状態を読むだけで、ディスクには触れない)
+    PROGRESS_INTERVAL_MS = 200
+
     def __init__(
         self,
         container: ttk.Frame,
@@ -56,18 +93,29 @@ class FileMoveStep(Step):
         self.ui = ui
         self.processor = processor
         self.after_id = None
+        self.watcher = None
+        self.last_progress = None
+        self.completed = False
 
     def build(self):
         self.ui.build(self.set_complete)
         self.ui.show_waiting()
+        self.watcher = FileWatcher(
+            self.processor.src_folder, self.processor.pattern, self.processor.move
+        )
+        self.watcher.start()
         self._update()
 
     def _update(self):
-        if not self.processor.move_file():
-            self.after_id = self.container.after(30, self._update)
-        else:
-            self.ui.show_complete()
-            self.set_complete(True)
+        progress = self.watcher.progress
+        if progress != self.last_progress:
+            self.last_progress = progress
+            self.ui.show_progress(progress)
+            if progress.moved and not self.completed:
+                self.completed = True
+                self.ui.show_complete()
+                self.set_complete(True)
+        self.after_id = self.container.after(self.PROGRESS_INTERVAL_MS, self._update)
 
     def before_next(self):
         pass
@@ -75,16 +123,28 @@ class FileMoveStep(Step):
     def on_dispose(self):
         if self.after_id:
             self.container.after_cancel(self.after_id)
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher.join(1.0)
 
 
 class FileMoveStepFactory:
-    def __init__(self, src_dir: Path, working_dir: Path, data_container: dict):
+    def __init__(
+        self,
+        src_dir: Path,
+        working_dir: Path,
+        data_container: dict,
+        participant_index: Optional[ParticipantIndex] = None,
+    ):
         self.working_dir = working_dir
         self.data_container = data_container
         self.src_dir = src_dir
+        self.participant_index = participant_index  # 指定すると移動したことを記録する
 
     def create(self, frame: ttk.Frame, set_complete: Callable[[bool], None]) -> Step:
         ui = FileMoveStepUI(frame)
         save_dir = sutil.get_save_dir_from_container(self.working_dir, self.data_container)
-        processor = FileMoveProcessor(self.src_dir, save_dir, "*.csv")
+        processor = FileMoveProcessor(
+            self.src_dir, save_dir, "*.csv", participant_index=self.participant_index
+        )
         return FileMoveStep(frame, set_complete, ui, processor)
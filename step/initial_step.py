@@ -4,9 +4,7 @@ from typing import Callable, Optional
 from step.step import Step
 from datetime import datetime
 import step.util as sutil
-from pathlib import Path
-import os
-from datetime import datetime
+from participant_index import ParticipantIndex
 
 class InitialStepUI:
     def __init__(self, container: ttk.Frame):
@@ -26,7 +24,8 @@ class InitialStepUI:
         ttk.Label(self.container, text="名前を入力").pack()
         self.name_var = tk.StringVar()
         self.name_var.trace_add("write", self._on_name_change)
-        self.name_entry = ttk.Entry(self.container, textvariable=self.name_var)
+        # 入力中の名前で始まる、これまでの参加者の名前を候補に出す
+        self.name_entry = ttk.Combobox(self.container, textvariable=self.name_var)
         self.name_entry.pack()
 
         ttk.Label(self.container, text="冷却モードを選択").pack(pady=(10, 0))
@@ -74,6 +73,9 @@ class InitialStepUI:
         self.position_label.pack_forget()
         self.position_combobox.pack_forget()
 
+    def set_name_suggestions(self, names: list[str]):
+        self.name_entry.config(values=names)
+
     def set_last_modified(self,timestamp):
         # フォーマットして表示
         if self.last_modified_label is not None:
@@ -98,36 +100,16 @@ class InitialStepUI:
             label.pack(side="bottom")
             self.completed_label.append(label)
 
-class DirectoryManager:
-    def __init__(self,working_dir:Path):
-        self.working_dir = working_dir
-
-    def get_completed_conditions(self,name:str)->list:
-        result = []
-        if name.strip():
-            for condition in sutil.list_condition():
-                if sutil.get_save_dir(self.working_dir,condition,name).exists():
-                    result.append(condition)
-        return result
-    
-    def get_last_modified_time(self,name:str)->list:
-        completed = self.get_completed_conditions(name)
-        last = -1
-        for condition in completed:
-            path = sutil.get_save_dir(self.working_dir,condition,name)
-            last = max(os.path.getmtime(path),last)
-        return last
-
 class InitialStep(Step):
     def __init__(
         self,
         ui: InitialStepUI,
-        directory_manager:DirectoryManager,
+        participant_index: ParticipantIndex,
         set_complete: Callable[[bool], None],
         save_value: Callable[[str, int], None],
     ):
         self.set_complete = set_complete
-        self.directory_manager = directory_manager
+        self.participant_index = participant_index
         self.save_value = save_value
         self.ui = ui
         self.ui.on_change = self.on_value_change
@@ -138,8 +120,10 @@ class InitialStep(Step):
     def on_value_change(self):
         self.set_complete(self.can_proceed())
         name = self.ui.name
-        self.ui.set_completed(self.directory_manager.get_completed_conditions(name))
-        self.ui.set_last_modified(self.directory_manager.get_last_modified_time(name))
+        # ディレクトリは調べず、起動時に作った索引から表示する
+        self.ui.set_name_suggestions(self.participant_index.find_names(name))
+        self.ui.set_completed(self.participant_index.get_completed_conditions(name))
+        self.ui.set_last_modified(self.participant_index.get_last_modified_time(name))
 
     def before_next(self):
         mode = self.ui.mode
@@ -159,9 +143,18 @@ class InitialStep(Step):
 
 
 class InitialStepFactory:
-    def __init__(self, data_container: dict,working_dir):
+    def __init__(
+        self,
+        data_container: dict,
+        working_dir,
+        participant_index: Optional[ParticipantIndex] = None,
+    ):
         self.data_container = data_container
         self.working_dir = working_dir
+        if participant_index is None:
+            participant_index = ParticipantIndex(working_dir)
+            participant_index.scan()
+        self.participant_index = participant_index
 
     def create(self, frame: ttk.Frame, set_complete: Callable[[bool], None]) -> Step:
         def save(name: str, condition: int):
@@ -170,6 +163,5 @@ class InitialStepFactory:
             now = datetime.now()
             timestamp = now.strftime("%Y%m%d_%H%M%S")
             self.data_container["timestamp"] = timestamp
-        directory_manager = DirectoryManager(self.working_dir)
         ui = InitialStepUI(frame)
-        return InitialStep(ui,directory_manager, set_complete, save)
+        return InitialStep(ui, self.participant_index, set_complete, save)
@@ -8,13 +8,21 @@ from step.base_survey_step import (
 )
 from mark_seat_reader import CorrectionProcessor, Margin, MarkseatReader
 from pathlib import Path
-from queue import Queue
-from typing import Callable, Tuple
+from frame_mailbox import FrameMailbox
+from recognition_pool import PooledImageProcessor, RecognitionPool
+from frame_quality import FrameQualityGate
+from recognition_cache import RecognitionCache
+from participant_index import ParticipantIndex
+from typing import Callable, Optional, Tuple
 import numpy as np
-from PIL import Image
 import cv2
 import step.util as sutil
 
+# RecognitionPoolに登録する画像処理の名前
+MSSQ_PROCESSOR = "MSSQ"
+# 用紙の四隅に貼るマーカーのid (左上から時計回り)
+MSSQ_MARKER_IDS = [4, 5, 7, 6]
+
 
 class MSSQImageProcessor(BaseImageProcessor):
     def __init__(
@@ -29,32 +37,74 @@ class MSSQImageProcessor(BaseImageProcessor):
         self.upper_row_count = upper_row_count
         self.reader2 = reader2
 
-    def read_answers(
-        self, image: Image.Image
+    def read_answers_array(
+        self, rgb: np.ndarray
     ) -> Tuple[list[int], np.ndarray] | Tuple[None, None]:
-        opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        corrected, rect = self.correction_processor.correct(opencv_image)
-        if corrected is None:
+        # グレースケールの写真から、補正とリサイズを読み取り範囲ごとに1回の射影変換で行う
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        rect = self.correction_processor.get_rectangle_gray(gray)
+        if rect is None:
             return None, None
-        gray = cv2.cvtColor(corrected, cv2.COLOR_BGR2GRAY)
+        homography = self.correction_processor.get_homography(rect)
+        rect_size = self.correction_processor.rect_size
         answers = []
         for reader in (self.reader1, self.reader2):
-            result = reader.read(gray)
+            result = reader.read_warped(gray, homography, rect_size)
             answers.extend([row[0] if len(row) == 1 else -1 for row in result])
         return answers, rect
 
-    def overlay_image(
-        self, image: Image.Image, rect, answers: list[int]
-    ) -> Image.Image:
-        opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+    def reset_tracking(self):
+        self.correction_processor.reset_tracking()
+
+    def overlay_array(self, rgb: np.ndarray, rect, answers: list[int]) -> np.ndarray:
         marked1 = [[a] if a != -1 else [] for a in answers[: self.upper_row_count]]
         marked2 = [[a] if a != -1 else [] for a in answers[self.upper_row_count :]]
-        mask1 = self.reader1.create_mask(marked1)
-        mask2 = self.reader2.create_mask(marked2)
-        overlayed = self.correction_processor.overlay_mask(
-            opencv_image, [mask1, mask2], rect, alpha=0.5
+        rect_size = self.correction_processor.rect_size
+        polygons = np.concatenate(
+            [
+                self.reader1.cell_polygons(marked1, rect_size),
+                self.reader2.cell_polygons(marked2, rect_size),
+            ]
         )
-        return Image.fromarray(cv2.cvtColor(overlayed, cv2.COLOR_BGR2RGB))
+        return self.correction_processor.overlay_polygons(
+            rgb.copy(), polygons, rect, alpha=0.5
+        )
+
+
+def create_mssq_processor(working_scale: float = 0.5) -> MSSQImageProcessor:
+    """
+    MSSQ用の画像処理クラスを生成する
+    認識用のワーカープロセスでも使うので、モジュールレベルの関数にしている
+
+    :param working_scale: 読み取りを行う解像度 (レイアウトの寸法に対する倍率)
+        レイアウトは補正後の長方形より2倍以上大きいので、0.5でも元の写真の情報は失われない
+    """
+    margin = Margin(15, 75, 75, 15)
+    rect_margin1 = Margin(280, 1050, 0, 1260)
+    rect_margin2 = Margin(1440, 1050, 0, 60)
+
+    reader1 = MarkseatReader(
+        rect_margin=rect_margin1,
+        row=8,
+        col=5,
+        cell_width=120,
+        cell_height=60,
+        cell_margin=margin,
+        scale=working_scale,
+    )
+    reader2 = MarkseatReader(
+        rect_margin=rect_margin2,
+        row=8,
+        col=5,
+        cell_width=120,
+        cell_height=60,
+        cell_margin=margin,
+        scale=working_scale,
+    )
+    correction_processor = CorrectionProcessor(
+        1075, 860, MSSQ_MARKER_IDS, tracking=True
+    )
+    return MSSQImageProcessor(correction_processor, reader1, 8, reader2)
 
 
 class MSSQStepFactory:
@@ -62,39 +112,25 @@ class MSSQStepFactory:
         self,
         working_dir: Path,
         data_container,
-        queue: Queue,
+        mailbox: FrameMailbox,
         file_name_prefix: str = "MSSQ",
         file_name_suffix: str = "",
+        recognition_pool: Optional[RecognitionPool] = None,
+        cache: Optional[RecognitionCache] = None,
+        participant_index: Optional[ParticipantIndex] = None,
     ):
         self.working_dir = working_dir
         self.data_container = data_container
-        self.queue = queue
+        self.mailbox = mailbox
         self.file_name_prefix = file_name_prefix
         self.file_name_suffix = file_name_suffix
+        self.recognition_pool = recognition_pool  # 指定すると認識をワーカープロセスで行う
+        self.quality_gate = FrameQualityGate(MSSQ_MARKER_IDS)
+        self.cache = cache  # 指定すると同じ画像の認識結果や保存した画像を使い回す
+        self.participant_index = participant_index  # 指定すると保存したことを記録する
 
     def create(self, frame, set_complete: Callable[[bool], None]) -> BaseSurveyStep:
-        margin = Margin(15, 75, 75, 15)
-        rect_margin1 = Margin(280, 1050, 0, 1260)
-        rect_margin2 = Margin(1440, 1050, 0, 60)
-
-        reader1 = MarkseatReader(
-            rect_margin=rect_margin1,
-            row=8,
-            col=5,
-            cell_width=120,
-            cell_height=60,
-            cell_margin=margin,
-        )
-        reader2 = MarkseatReader(
-            rect_margin=rect_margin2,
-            row=8,
-            col=5,
-            cell_width=120,
-            cell_height=60,
-            cell_margin=margin,
-        )
-        correction_processor = CorrectionProcessor(1075, 860, [4, 5, 7, 6])
-        processor = MSSQImageProcessor(correction_processor, reader1, 8, reader2)
+        processor = self._create_processor()
         save_dir = self.working_dir / "MSSQ"
         file_name = sutil.get_name(self.data_container)
         ui = BaseSurveyUI(
@@ -102,5 +138,27 @@ class MSSQStepFactory:
             sections=[("12歳以前", 8, 5), ("直近10年", 8, 5)],
             main_title="MSSQを回答してください",
         )
-        saver = BaseDataSaver(save_dir, file_name)
-        return BaseSurveyStep(self.queue, frame, set_complete, ui, processor, saver)
+        saver = BaseDataSaver(
+            save_dir, file_name, self.cache, self.participant_index
+        )
+        return BaseSurveyStep(
+            self.mailbox,
+            frame,
+            set_complete,
+            ui,
+            processor,
+            saver,
+            self.quality_gate,
+            self.cache,
+            MSSQ_PROCESSOR,
+        )
+
+    def _create_processor(self) -> BaseImageProcessor:
+        """
+        ステップごとに画像処理クラスを生成する
+        画像処理クラスは状態 (前回のマーカー位置など) を持つため、RecognitionWorker間で共有しない
+        (用紙の寸法はget_sheet_layoutでキャッシュされるので、生成は軽い)
+        """
+        if self.recognition_pool is not None:
+            return PooledImageProcessor(self.recognition_pool, MSSQ_PROCESSOR)
+        return create_mssq_processor()
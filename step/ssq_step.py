@@ -8,14 +8,22 @@ from step.base_survey_step import (
 )
 from mark_seat_reader import CorrectionProcessor, Margin, MarkseatReader
 from pathlib import Path
-from queue import Queue
-from typing import Callable, Tuple
+from frame_mailbox import FrameMailbox
+from recognition_pool import PooledImageProcessor, RecognitionPool
+from frame_quality import FrameQualityGate
+from recognition_cache import RecognitionCache
+from participant_index import ParticipantIndex
+from typing import Callable, Optional, Tuple
 import numpy as np
-from PIL import Image
 import cv2
 import step.util as sutil
 from tkinter import ttk
 
+# RecognitionPoolに登録する画像処理の名前
+SSQ_PROCESSOR = "SSQ"
+# 用紙の四隅に貼るマーカーのid (左上から時計回り)
+SSQ_MARKER_IDS = [0, 1, 3, 2]
+
 
 class SSQImageProcessor(BaseImageProcessor):
     def __init__(
@@ -24,28 +32,55 @@ class SSQImageProcessor(BaseImageProcessor):
         self.correction_processor = correction_processor
         self.markseat_reader = markseat_reader
 
-    def read_answers(
-        self, image: Image.Image
+    def read_answers_array(
+        self, rgb: np.ndarray
     ) -> Tuple[list[int], np.ndarray] | Tuple[None, None]:
-        opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        corrected, rect = self.correction_processor.correct(opencv_image)
-        if corrected is None:
+        # グレースケールの写真から、補正とリサイズを1回の射影変換で行う
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        rect = self.correction_processor.get_rectangle_gray(gray)
+        if rect is None:
             return None, None
-        gray = cv2.cvtColor(corrected, cv2.COLOR_BGR2GRAY)
-        result = self.markseat_reader.read(gray)
+        homography = self.correction_processor.get_homography(rect)
+        result = self.markseat_reader.read_warped(
+            gray, homography, self.correction_processor.rect_size
+        )
         answers = [row[0] if len(row) == 1 else -1 for row in result]
         return answers, rect
 
-    def overlay_image(
-        self, image: Image.Image, rect, answers: list[int]
-    ) -> Image.Image:
-        opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+    def reset_tracking(self):
+        self.correction_processor.reset_tracking()
+
+    def overlay_array(self, rgb: np.ndarray, rect, answers: list[int]) -> np.ndarray:
         marked = [[a] if a != -1 else [] for a in answers]
-        mask = self.markseat_reader.create_mask(marked)
-        overlayed = self.correction_processor.overlay_mask(
-            opencv_image, mask, rect, alpha=0.5
+        polygons = self.markseat_reader.cell_polygons(
+            marked, self.correction_processor.rect_size
         )
-        return Image.fromarray(cv2.cvtColor(overlayed, cv2.COLOR_BGR2RGB))
+        return self.correction_processor.overlay_polygons(
+            rgb.copy(), polygons, rect, alpha=0.5
+        )
+
+
+def create_ssq_processor(working_scale: float = 0.5) -> SSQImageProcessor:
+    """
+    SSQ用の画像処理クラスを生成する
+    認識用のワーカープロセスでも使うので、モジュールレベルの関数にしている
+
+    :param working_scale: 読み取りを行う解像度 (レイアウトの寸法に対する倍率)
+        レイアウトは補正後の長方形より2倍以上大きいので、0.5でも元の写真の情報は失われない
+    """
+    rect_margin = Margin(285, 1110, 0, 60)
+    margin = Margin(15, 75, 75, 15)
+    markseat_reader = MarkseatReader(
+        rect_margin=rect_margin,
+        row=16,
+        col=4,
+        cell_width=120,
+        cell_height=60,
+        cell_margin=margin,
+        scale=working_scale,
+    )
+    correction_processor = CorrectionProcessor(1000, 900, SSQ_MARKER_IDS, tracking=True)
+    return SSQImageProcessor(correction_processor, markseat_reader)
 
 
 class SSQStepFactory:
@@ -53,34 +88,53 @@ class SSQStepFactory:
         self,
         working_dir: Path,
         data_container,
-        queue: Queue,
+        mailbox: FrameMailbox,
         file_name_prefix: str = "",
         file_name_suffix: str = "",
+        recognition_pool: Optional[RecognitionPool] = None,
+        cache: Optional[RecognitionCache] = None,
+        participant_index: Optional[ParticipantIndex] = None,
     ):
         self.working_dir = working_dir
         self.data_container = data_container
-        self.queue = queue
+        self.mailbox = mailbox
         self.file_name_prefix = file_name_prefix
         self.file_name_suffix = file_name_suffix
+        self.recognition_pool = recognition_pool  # 指定すると認識をワーカープロセスで行う
+        self.quality_gate = FrameQualityGate(SSQ_MARKER_IDS)
+        self.cache = cache  # 指定すると同じ画像の認識結果や保存した画像を使い回す
+        self.participant_index = participant_index  # 指定すると保存したことを記録する
 
     def create(
         self, frame: ttk.Frame, set_complete: Callable[[bool], None]
     ) -> BaseSurveyStep:
-        rect_margin = Margin(285, 1110, 0, 60)
-        margin = Margin(15, 75, 75, 15)
-        markseat_reader = MarkseatReader(
-            rect_margin=rect_margin,
-            row=16,
-            col=4,
-            cell_width=120,
-            cell_height=60,
-            cell_margin=margin,
-        )
-        processor = SSQImageProcessor(CorrectionProcessor(1000, 900), markseat_reader)
+        processor = self._create_processor()
         save_dir = sutil.get_save_dir_from_container(
             self.working_dir, self.data_container
         )
         file_name = f"{self.file_name_prefix}_{sutil.get_timestamp(self.data_container)}_{self.file_name_suffix}"
         ui = BaseSurveyUI(frame, [("", 16, 4)], "SSQを回答してください")
-        saver = BaseDataSaver(save_dir, file_name)
-        return BaseSurveyStep(self.queue, frame, set_complete, ui, processor, saver)
+        saver = BaseDataSaver(
+            save_dir, file_name, self.cache, self.participant_index
+        )
+        return BaseSurveyStep(
+            self.mailbox,
+            frame,
+            set_complete,
+            ui,
+            processor,
+            saver,
+            self.quality_gate,
+            self.cache,
+            SSQ_PROCESSOR,
+        )
+
+    def _create_processor(self) -> BaseImageProcessor:
+        """
+        ステップごとに画像処理クラスを生成する
+        画像処理クラスは状態 (前回のマーカー位置など) を持つため、RecognitionWorker間で共有しない
+        (用紙の寸法はget_sheet_layoutでキャッシュされるので、生成は軽い)
+        """
+        if self.recognition_pool is not None:
+            return PooledImageProcessor(self.recognition_pool, SSQ_PROCESSOR)
+        return create_ssq_processor()
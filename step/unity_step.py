@@ -1,14 +1,22 @@
 import tkinter as tk
 from tkinter import ttk
-from typing import Callable, List
+from typing import Callable, List, Optional
 from step.step import Step
 import step.util as sutil
 from network.data.multi_type_data_decoder import MultiTypeDataDecoder
-from network.data.string_data import STRING_DATA_TYPE, StringDataDecoder, StringData
+from network.data.string_data import (
+    STRING_DATA_TYPE,
+    STRING_DATA_TYPE_ID,
+    StringDataDecoder,
+    StringData,
+)
+from network.data.envelope import EnvelopeDataDecoder
 from network.tcp_client import TCPClient
-from network.data.data_decoder import DecodedData
+from network.async_tcp_client import AsyncTCPClient
+from network.data.data_decoder import DataDecoder, DecodedData
 from network.simple_serial import ArduinoSerial,ArduinoSerialMock
 from pathlib import Path
+from participant_index import ParticipantIndex
 import simpleaudio as sa
 from datetime import datetime
 import csv
@@ -21,12 +29,20 @@ def show_non_blocking(title,message):
 
 
 class DataSaver:
-    def __init__(self, save_dir: Path, file_name: str):
+    def __init__(
+        self,
+        save_dir: Path,
+        file_name: str,
+        participant_index: Optional[ParticipantIndex] = None,
+    ):
         self.save_dir = save_dir
         self.file_name = file_name
+        self.participant_index = participant_index  # 指定すると、保存したことを記録する
 
     def _ensure_dir_exists(self):
         self.save_dir.mkdir(parents=True, exist_ok=True)
+        if self.participant_index is not None:
+            self.participant_index.add_dir(self.save_dir)
 
     def save_csv(self, answers: List[int]):
         self._ensure_dir_exists()
@@ -302,7 +318,7 @@ class UnityStepUI:
 class UnityStepController:
     def __init__(
         self,
-        unity_client: TCPClient,
+        unity_client: TCPClient | AsyncTCPClient,
         arduino_client: ArduinoSerial,
         saver: DataSaver,
         condition: int,
@@ -546,12 +562,23 @@ class UnityStep(Step):
 
 class UnityStepFactory:
     def __init__(
-        self, data_container: dict, working_dir: Path, sound_path: Path, lap_count: int
+        self,
+        data_container: dict,
+        working_dir: Path,
+        sound_path: Path,
+        lap_count: int,
+        create_unity_client: Optional[
+            Callable[[DataDecoder], TCPClient | AsyncTCPClient]
+        ] = None,
+        participant_index: Optional[ParticipantIndex] = None,
     ):
         self.data_container = data_container
         self.sound_path = sound_path
         self.lap_count = lap_count
         self.working_dir = working_dir
+        # Unityとの接続に使うクライアントを差し替える (AsyncTCPClientなど)
+        self.create_unity_client = create_unity_client or TCPClient
+        self.participant_index = participant_index  # 指定すると保存したことを記録する
 
     def save_ip_port(self, ip: str, port: int):
         self.data_container["ip"] = ip
@@ -570,8 +597,14 @@ class UnityStepFactory:
         ]
         ui = UnityStepUI(frame, position, mode, ip, port, checklist, self.lap_count)
 
-        decoder = MultiTypeDataDecoder({STRING_DATA_TYPE: StringDataDecoder()})
-        unity_client = TCPClient(decoder)
+        # Unity側がv2形式で送ってきても、レガシー形式で送ってきても読めるようにする
+        decoder = EnvelopeDataDecoder(
+            {STRING_DATA_TYPE_ID: StringDataDecoder()},
+            legacy_decoder=MultiTypeDataDecoder(
+                {STRING_DATA_TYPE: StringDataDecoder()}
+            ),
+        )
+        unity_client = self.create_unity_client(decoder)
 
         arduino_client = ArduinoSerial(port="COM3")
 #        arduino_client = ArduinoSerialMock()
@@ -580,7 +613,7 @@ class UnityStepFactory:
             self.working_dir, self.data_container
         )
         file_name = f"FMS_{sutil.get_timestamp(self.data_container)}"
-        saver = DataSaver(save_dir, file_name)
+        saver = DataSaver(save_dir, file_name, self.participant_index)
 
         controller = UnityStepController(unity_client, arduino_client, saver, condition)
         if sutil.get_mode_number(mode) == 3:
@@ -5,6 +5,7 @@ from step.step import Step
 from datetime import datetime
 import step.util as sutil
 from pathlib import Path
+from participant_index import ParticipantIndex
 import csv
 import math
 
@@ -56,12 +57,20 @@ class VectionSurveyStepUI:
 
 
 class DataSaver:
-    def __init__(self, save_dir: Path, file_name: str):
+    def __init__(
+        self,
+        save_dir: Path,
+        file_name: str,
+        participant_index: Optional[ParticipantIndex] = None,
+    ):
         self.save_dir = save_dir
         self.file_name = file_name
+        self.participant_index = participant_index  # 指定すると、保存したことを記録する
 
     def _ensure_dir_exists(self):
         self.save_dir.mkdir(parents=True, exist_ok=True)
+        if self.participant_index is not None:
+            self.participant_index.add_dir(self.save_dir)
 
     def save_csv(self, vection: int):
         self._ensure_dir_exists()
@@ -98,13 +107,15 @@ class VectionSurveyStepFactory:
         self,
         working_dir: Path,
         data_container: dict,
+        participant_index: Optional[ParticipantIndex] = None,
     ):
         self.working_dir = working_dir
         self.data_container = data_container
+        self.participant_index = participant_index  # 指定すると保存したことを記録する
 
     def create(self, frame: ttk.Frame, set_complete: Callable[[bool], None]) -> Step:
         ui = VectionSurveyStepUI(frame)
         save_dir = sutil.get_save_dir_from_container(self.working_dir, self.data_container)
         file_name = f"vection_{sutil.get_timestamp(self.data_container)}"
-        data_saver = DataSaver(save_dir, file_name)
+        data_saver = DataSaver(save_dir, file_name, self.participant_index)
         return VectionSurveyStep(set_complete, ui, data_saver)